@@ -0,0 +1,418 @@
+#!/bin/env python
+"""
+HKEBinaryCache.py - Persistent on-disk caches for HKE binary files.
+
+Parsing the header and building the structured dtype of an HKE binary
+file is repeated every time the file is opened. HeaderCache stores the
+parsed header and dtype of each file in a user cache directory so that
+reopening a known file only has to unpickle them.
+
+The frames of an HKE binary file are stored one after the other, so
+reading one register means reading a little out of every frame, i.e.
+most of the file. ColumnStore keeps a transposed copy of the frames,
+with each field of the frame dtype in its own contiguous .npy file, so
+that reading a register touches only that register's bytes.
+
+Example usage:
+    None; used by HKEBinaryFile.py instead.
+"""
+
+import os
+import hashlib
+import shutil
+import tempfile
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+
+def default_cache_dir():
+    """
+    Return the directory used for cached HKE file information.
+
+    This is $HKEBINARY_CACHE_DIR if it is set, otherwise the
+    hkebinary directory in $XDG_CACHE_HOME (or ~/.cache).
+    """
+    d = os.environ.get('HKEBINARY_CACHE_DIR')
+    if d:
+        return d
+    base = os.environ.get('XDG_CACHE_HOME')
+    if not base:
+        base = os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'hkebinary')
+
+
+def header_hash(rawheader):
+    """
+    Return a hex digest identifying a raw HKE header.
+    """
+    return hashlib.sha1(rawheader).hexdigest()
+
+
+class HeaderCache(object):
+    """
+    A persistent cache of parsed HKE binary file headers and dtypes.
+
+    Each file gets one .hkeidx entry in the cache directory, named by
+    a hash of its absolute path. An entry records the size and
+    modification time of the file, the length and hash of its raw
+    header, the parsed Header object and the frame dtype.
+
+    An entry is used as-is if the size and mtime of the file still
+    match. If they do not (e.g. because frames were appended to the
+    file), the raw header is reread from the file and compared
+    against the stored hash; if it still matches, the entry is
+    refreshed, otherwise it is discarded.
+
+    Entries are touched whenever they are used, and the least recently
+    used entries are evicted once there are more than maxentries of
+    them.
+
+    The cache is strictly best effort: an unwritable cache directory or
+    a corrupt entry simply results in a cache miss.
+
+    Arguments:
+        directory - (str) cache directory. Defaults to
+            default_cache_dir().
+        maxentries - (int) maximum number of entries kept.
+    """
+    version = 4
+    extension = '.hkeidx'
+
+    def __init__(self, directory=None, maxentries=4096):
+        if directory is None:
+            directory = default_cache_dir()
+        self.directory = directory
+        self.maxentries = maxentries
+
+    def _entrypath(self, filename):
+        key = os.path.abspath(filename)
+        if not isinstance(key, bytes):
+            key = key.encode('utf-8')
+        name = hashlib.sha1(key).hexdigest() + self.extension
+        return os.path.join(self.directory, name)
+
+    def load(self, filename):
+        """
+        Return the cached (header, dt) pair for filename, or None if
+        there is no valid entry.
+        """
+        entrypath = self._entrypath(filename)
+        try:
+            with open(entrypath, 'rb') as f:
+                entry = pickle.load(f)
+            st = os.stat(filename)
+        except Exception:
+            return None
+
+        if ((entry.get('version') != self.version) or
+                (entry.get('path') != os.path.abspath(filename))):
+            self._remove(entrypath)
+            return None
+
+        if (entry['size'], entry['mtime']) != (st.st_size, st.st_mtime):
+            try:
+                with open(filename, 'rb') as f:
+                    rawheader = f.read(entry['headerlength'])
+            except (IOError, OSError):
+                return None
+            if header_hash(rawheader) != entry['headerhash']:
+                self._remove(entrypath)
+                return None
+            entry['size'] = st.st_size
+            entry['mtime'] = st.st_mtime
+            self._write(entrypath, entry)
+        else:
+            self._touch(entrypath)
+
+        return entry['header'], entry['dtype']
+
+    def store(self, filename, header, dt):
+        """
+        Store the parsed header and frame dtype of filename.
+        """
+        try:
+            st = os.stat(filename)
+        except OSError:
+            return
+        entry = {'version': self.version,
+                 'path': os.path.abspath(filename),
+                 'size': st.st_size,
+                 'mtime': st.st_mtime,
+                 'headerlength': len(header.rawheader),
+                 'headerhash': header_hash(header.rawheader),
+                 'header': header,
+                 'dtype': dt}
+        if self._write(self._entrypath(filename), entry):
+            self.evict()
+
+    def invalidate(self, filename):
+        """
+        Remove the entry for filename, if there is one.
+        """
+        self._remove(self._entrypath(filename))
+
+    def clear(self):
+        """
+        Remove all entries from the cache.
+        """
+        for path in self._entries():
+            self._remove(path)
+
+    def evict(self):
+        """
+        Remove the least recently used entries until at most
+        self.maxentries remain.
+        """
+        entries = self._entries()
+        if len(entries) <= self.maxentries:
+            return
+        aged = []
+        for path in entries:
+            try:
+                aged.append((os.path.getmtime(path), path))
+            except OSError:
+                pass
+        aged.sort()
+        for mtime, path in aged[:len(aged) - self.maxentries]:
+            self._remove(path)
+
+    def _entries(self):
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return []
+        return [os.path.join(self.directory, name) for name in names
+                if name.endswith(self.extension)]
+
+    def _write(self, entrypath, entry):
+        """
+        Atomically write entry to entrypath. Returns True on success.
+        """
+        tmppath = None
+        try:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+            fd, tmppath = tempfile.mkstemp(dir=self.directory,
+                                           suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(entry, f, pickle.HIGHEST_PROTOCOL)
+            os.rename(tmppath, entrypath)
+        except Exception:
+            if tmppath is not None:
+                self._remove(tmppath)
+            return False
+        return True
+
+    def _touch(self, entrypath):
+        try:
+            os.utime(entrypath, None)
+        except OSError:
+            pass
+
+    def _remove(self, entrypath):
+        try:
+            os.remove(entrypath)
+        except OSError:
+            pass
+
+
+class ColumnStore(object):
+    """
+    A transposed, memory-mappable copy of the frames of an HKE binary
+    file.
+
+    The store is a directory holding one .npy file per field of the
+    frame dtype (i.e. per register, plus the framecount and
+    framereceivedms counters), in the native dtype of the field, and
+    a pickled manifest. The manifest records the size and modification
+    time of the HKE file, the hash of its raw header and the number of
+    frames copied. The store is used if the file is unchanged, or if
+    frames were only appended to it (see self.fresh), so a rewritten
+    file is not served stale data. Frames appended to the file after
+    the store was built are not in the store, and are read from the
+    file itself.
+
+    The store is built explicitly (see self.build or
+    HKEBinaryFile.build_columns), and is used transparently by
+    HKEBinaryFile from then on.
+
+    Arguments:
+        filename - (str) the HKE binary file
+        directory - (str) directory holding the stores of all
+            files. Defaults to the columns directory in
+            default_cache_dir(). Each file gets a subdirectory named
+            by a hash of its absolute path.
+    """
+    version = 1
+    manifestname = 'manifest.pkl'
+
+    def __init__(self, filename, directory=None):
+        if directory is None:
+            directory = os.path.join(default_cache_dir(), 'columns')
+        self.filename = filename
+        self.directory = directory
+        key = os.path.abspath(filename)
+        if not isinstance(key, bytes):
+            key = key.encode('utf-8')
+        self.path = os.path.join(directory, hashlib.sha1(key).hexdigest())
+        self.manifest = None
+        self._columns = {}
+
+    def _load_manifest(self):
+        try:
+            with open(os.path.join(self.path, self.manifestname),
+                      'rb') as f:
+                return pickle.load(f)
+        except Exception:
+            return None
+
+    def fresh(self, rawheader, data=None):
+        """
+        Return True if the store exists and was built from the file,
+        whose raw header is rawheader and whose frames are data (the
+        structured array of frames, see HKEBinaryLibrary.Data).
+
+        As in HeaderCache.load, a store whose recorded size and mtime
+        still match the file is used as is. Otherwise (e.g. frames
+        were appended to the file) it is still used if the header is
+        unchanged, the file still has at least as many frames as the
+        store, and the counters of the last frame in the store match
+        the file. The frames after that are then read from the file
+        itself. Without data, only an unchanged file is accepted.
+        """
+        manifest = self._load_manifest()
+        try:
+            st = os.stat(self.filename)
+        except OSError:
+            return False
+        if ((manifest is None) or
+                (manifest.get('version') != self.version) or
+                (manifest.get('path') != os.path.abspath(self.filename)) or
+                (manifest['headerhash'] != header_hash(rawheader))):
+            return False
+        self.manifest = manifest
+        self._columns = {}
+        if (manifest['size'], manifest['mtime']) == (st.st_size,
+                                                     st.st_mtime):
+            return True
+
+        datanum = manifest['datanum']
+        if (data is not None) and (len(data) >= datanum):
+            last = datanum - 1
+            try:
+                if all(self[name][last] == data[name][last]
+                       for name in ('framecount', 'framereceivedms')):
+                    return True
+            except Exception:
+                pass
+        self.manifest = None
+        self._columns = {}
+        return False
+
+    @property
+    def datanum(self):
+        """
+        The number of frames in the store.
+        """
+        if self.manifest is None:
+            return 0
+        return self.manifest['datanum']
+
+    def __contains__(self, name):
+        return (self.manifest is not None) and \
+            (name in self.manifest['fields'])
+
+    def __getitem__(self, name):
+        """
+        Return the field name of the frames as a read-only memmap of
+        shape (self.datanum,) + field shape.
+        """
+        try:
+            return self._columns[name]
+        except KeyError:
+            pass
+        import numpy
+        fname = os.path.join(self.path, self.manifest['fields'][name])
+        column = numpy.load(fname, mmap_mode='r')
+        self._columns[name] = column
+        return column
+
+    def build(self, data, rawheader, chunksize=65536):
+        """
+        (Re)build the store from data, the structured array of frames
+        of the file (see HKEBinaryLibrary.Data), whose raw header is
+        rawheader.
+
+        The frames are read once, chunksize frames at a time, and each
+        chunk is scattered into the columns, so memory use is bounded
+        by the chunk size. The store is written to a temporary
+        directory and moved into place once complete.
+
+        Returns True on success. Like HeaderCache, this is best
+        effort: if the store cannot be written, False is returned and
+        the file is simply read directly.
+        """
+        from numpy.lib.format import open_memmap
+
+        if len(data) == 0:
+            return False
+        try:
+            st = os.stat(self.filename)
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+            tmppath = tempfile.mkdtemp(dir=self.directory, suffix='.tmp')
+        except (IOError, OSError):
+            return False
+
+        try:
+            datanum = len(data)
+            names = data.dtype.names
+            fields = {}
+            columns = []
+            for i, name in enumerate(names):
+                fname = 'field{0:04d}.npy'.format(i)
+                fields[name] = fname
+                ft = data.dtype.fields[name][0]
+                columns.append(open_memmap(os.path.join(tmppath, fname),
+                                           mode='w+', dtype=ft.base,
+                                           shape=(datanum,) + ft.shape))
+            chunksize = max(int(chunksize), 1)
+            for start in range(0, datanum, chunksize):
+                chunk = data[start:start + chunksize]
+                for name, column in zip(names, columns):
+                    column[start:start + len(chunk)] = chunk[name]
+            for column in columns:
+                column.flush()
+            del columns
+
+            manifest = {'version': self.version,
+                        'path': os.path.abspath(self.filename),
+                        'size': st.st_size,
+                        'mtime': st.st_mtime,
+                        'headerhash': header_hash(rawheader),
+                        'datanum': datanum,
+                        'fields': fields}
+            with open(os.path.join(tmppath, self.manifestname),
+                      'wb') as f:
+                pickle.dump(manifest, f, pickle.HIGHEST_PROTOCOL)
+
+            self.remove()
+            os.rename(tmppath, self.path)
+        except Exception:
+            shutil.rmtree(tmppath, ignore_errors=True)
+            return False
+
+        self.manifest = manifest
+        self._columns = {}
+        return True
+
+    def remove(self):
+        """
+        Remove the store, if there is one.
+        """
+        self.manifest = None
+        self._columns = {}
+        shutil.rmtree(self.path, ignore_errors=True)
@@ -15,9 +15,17 @@ June 25, 2012
 """
 
 import os
+import time
 
-from HKEBinaryLibrary import HKEBinaryReader, Header, Data, \
-                             HKEBinaryError, HKEInvalidRegisterError
+from HKEBinaryLibrary import load_header, Data, GapIndex, \
+                             HKEBinaryError, HKEInvalidRegisterError, \
+                             HKECalibrationError
+from HKEBinaryCache import HeaderCache, ColumnStore, header_hash
+from HKEPyramid import Pyramid, pyramid_path
+from HKECalibration import Calibration, load_calibration, \
+                           find_calibration
+from HKEReduction import ReductionCache, reduce_samples
+from HKEInstrument import stage
 from numpy import *
 
 
@@ -28,6 +36,28 @@ class HKEBinaryFile:
 
     Arguments:
         filename - (str) filename of HKE binary file
+        mmap - (bool) if True, memory-map the frame data instead of
+            reading it all into memory. Opening the file then costs
+            only the header parse, and only the registers and frames
+            that are actually requested are read from disk. Useful
+            for very large files. Default is False.
+        cache - (bool or HKEBinaryCache.HeaderCache) on-disk cache
+            for the parsed header and frame dtype, so that reopening a
+            known file does not reparse its header. True (default)
+            uses a HeaderCache in the default cache directory, False
+            disables the on-disk cache. Either way, a header already
+            in use by another file open in the process is shared
+            rather than parsed again (see HKEBinaryLibrary.load_header).
+        columns - (bool or str) if True (default), the column store
+            of the file (see self.build_columns) in the default cache
+            directory is used when it is present and fresh. A str is
+            taken as the directory holding the column stores. False
+            never uses a column store.
+        cachebytes - (int) memory budget, in bytes, of the cache of
+            results of self.get_data (see
+            HKEReduction.ReductionCache), so that repeated requests
+            for the same data are not extracted and reduced again. 0
+            disables the cache.
 
     Example usage:
     f = HKEBinaryFile('hke_20120624_001.dat')
@@ -35,36 +65,125 @@ class HKEBinaryFile:
     RTs = f.get_data(0).flatten()
     Rs = f.get_data(-6)[...,1]
     """
-    def __init__(self, filename):
+    def __init__(self, filename, mmap=False, cache=True, columns=True,
+                 cachebytes=64*2**20):
         self.filename = filename
         self.filesize = os.path.getsize(self.filename)
-        self.reader = HKEBinaryReader(filename=self.filename)
-        self.header = Header(self.reader)
-        self.data = Data(self.header)
+        if cache is True:
+            cache = HeaderCache()
+        self.headercache = cache or None
+
+        self.header = load_header(self.filename, self.headercache)
+        self.data = Data(self.header, self.filename, mmap=mmap)
         self.dtsize = self.data.dt.itemsize
         self.datanum = (self.filesize - (self.header.length-1)/8)/self.dtsize
         self._make_board_list()
         self._make_register_list()
+        self._times = None
+        self._gaps = None
+        self.results = ReductionCache(cachebytes)
+        self._pyramids = {}
+        self.calibrations = {}
+        self.calibrationpath = [os.path.dirname(os.path.abspath(filename)),
+                                os.curdir]
+
+        self.columns = None
+        if columns:
+            directory = None if (columns is True) else columns
+            store = ColumnStore(self.filename, directory=directory)
+            if store.fresh(self.header.rawheader, self.data.data):
+                self.columns = store
+
+    def build_columns(self, directory=None, chunksize=65536):
+        """
+        Build the column store of the file: a transposed copy of the
+        frames with each register in its own contiguous,
+        memory-mappable array (see HKEBinaryCache.ColumnStore).
+
+        The frames are stored one after the other in the file, so
+        extracting a register otherwise means reading a little out of
+        every frame. Once the store is built, extracting a register
+        reads only that register's bytes. The store is used
+        automatically by this and later HKEBinaryFile instances for as
+        long as the file is unchanged; frames appended later are read
+        from the file itself.
+
+        directory is the directory holding the column stores, by
+        default the columns directory in the cache directory. Returns
+        True if the store was built.
+        """
+        store = ColumnStore(self.filename, directory=directory)
+        if not store.build(self.data.data, self.header.rawheader,
+                           chunksize=chunksize):
+            return False
+        self.columns = store
+        return True
+
+    def _read_field(self, rname, start=None, stop=None, step=None):
+        """
+        Returns frames start through stop (every step-th frame) of the
+        field rname of the frame dtype, i.e.
+        self.data.data[rname][start:stop:step], reading it from the
+        column store as far as it covers those frames.
+        """
+        store = self.columns
+        if (store is not None) and (rname in store):
+            start, stop, step = slice(start, stop,
+                                      step).indices(self.datanum)
+            n = store.datanum
+            if max(start, stop) <= n:
+                return store[rname][start:stop:step]
+            if (step > 0) and (start < n):
+                # the store holds the first frames, the file the rest
+                tail = start + -(-(n - start)//step)*step
+                return concatenate([store[rname][start:n:step],
+                                    self.data.data[rname][tail:stop:step]])
+        return self.data.data[rname][start:stop:step]
+
+    def refresh(self):
+        """
+        Pick up frames appended to the file since it was opened or
+        last refreshed, without rereading the header or the frames
+        already read. Only whole frames are picked up; a partially
+        written trailing frame is held back until it is complete.
+
+        Returns a slice selecting the new frames, e.g.
+
+            new = f.refresh()
+            newframes = f.data.data[new]
+        """
+        old = self.datanum
+        self.data.refresh()
+        self.filesize = os.path.getsize(self.filename)
+        self.datanum = len(self.data.data)
+        return slice(old, self.datanum)
+
+    def follow(self, interval=1., timeout=None):
+        """
+        Generator that watches the file for appended frames, e.g. for
+        a live monitoring plot of a file that is still being written.
+
+        Every interval seconds the file is refreshed (see
+        self.refresh) and, if any new frames have arrived, a slice
+        selecting them is yielded. If timeout is not None, the
+        generator stops after timeout seconds without new frames.
+        """
+        last = time.time()
+        while True:
+            new = self.refresh()
+            if new.stop > new.start:
+                last = time.time()
+                yield new
+            elif (timeout is not None) and (time.time() - last > timeout):
+                return
+            time.sleep(interval)
 
     def _make_board_list(self):
         """
         A helper function to make a list of boards available in the
         file and create the necessary attributes.
         """
-        self.boardlist = []
-        self._boarddict = {}
-        self._boarddictbyaddress = {}
-
-        for bd in self.header.boarddescriptions:
-            address = bd.address
-            btype = bd.boardtype
-            desc = bd.description
-            toadd = '{desc} ({a}-{btype})'.format(a=address,
-                                                  btype=btype,
-                                                  desc=desc)
-            self.boardlist.append(toadd)
-            self._boarddict[toadd] = bd
-            self._boarddictbyaddress[address] = bd
+        self.boardlist = list(self.header.boardlist)
 
     def list_boards(self):
         """
@@ -88,20 +207,20 @@ class HKEBinaryFile:
         keyword argument to pass an address integer.
         """
         if isinstance(identifier, int):
-            return self._boarddict[self.boardlist[identifier]]
+            return self.header.boarddescriptions[identifier]
         elif isinstance(identifier, (str, unicode)):
-            return self._boarddict[identifier]
+            return self.header._bkeydict[identifier]
 
         if address is not None:
-            return self._boarddictbyaddress[address]
+            return self.header._baddressdict[address]
 
     def _make_register_list(self):
         """
         A helper function to make a list of registers available in the
         file and create the necessary attributes.
         """
-        self.registerlist = self.header._rkeylist
-        self.registerdescriptionlist = self.header._rdlist
+        self.registerlist = list(self.header._rkeylist)
+        self.registerdescriptionlist = list(self.header._rdlist)
 
     def list_registers(self):
         """
@@ -111,40 +230,49 @@ class HKEBinaryFile:
         """
         return self.registerlist
 
+    def _register_index(self, identifier):
+        """
+        A helper function that returns the index of the register
+        specified by identifier: an index, a full register name (as in
+        self.list_registers) or a column name ('<address>-<register
+        description>').
+        """
+        if isinstance(identifier, (int, long, integer)):
+            n = len(self.registerlist)
+            if -n <= identifier < n:
+                return int(identifier % n)
+        elif isinstance(identifier, (str, unicode)):
+            try:
+                return self.header._rkeyindex[identifier]
+            except KeyError:
+                pass
+            try:
+                return self.header._rcolumnindex[identifier]
+            except KeyError:
+                pass
+        raise HKEInvalidRegisterError(identifier)
+
     def get_register_description(self, identifier):
         """
         Return the register description object specified by
         identifier.
         """
-        if isinstance(identifier, int):
-            try:
-                return self.header._rdlist[identifier]
-            except IndexError:
-                raise HKEInvalidRegisterError(identifier)
-        elif isinstance(identifier, (str, unicode)):
-            try:
-                identifier = self.header._rkeylist.index(identifier)
-                return self.header._rdlist[identifier]
-            except ValueError:
-                raise HKEInvalidRegisterError(identifier)
+        return self.header._rdlist[self._register_index(identifier)]
 
     def get_register_name(self, identifier):
         """
         Return the name of the register specified by the identifier.
         """
-        if isinstance(identifier, int):
-            return self.registerlist[identifier]
-        elif isinstance(identifier, (str, unicode)):
-            if identifier in self.registerlist:
-                return identifier
-            else:
-                raise HKEBinaryError
+        return self.registerlist[self._register_index(identifier)]
 
     def _get_single_data(self, identifier, reduced=None,
-                         reductionfunction=None):
+                         reductionfunction=None, start=None, stop=None):
         """
         Extracts data from a single register specified by identifier.
 
+        Only frames start through stop (not including stop) are
+        extracted, as in self.data.data[start:stop].
+
         The reduced flag specifies whether to extract the reduced data
         or the raw data. In most cases, only the reduced data is
         interesting, so reduced=True is the default setting.
@@ -159,9 +287,13 @@ class HKEBinaryFile:
         admits a function to reduce those multiple data points to a
         single data point, reductionfunction.
 
-        reductionfunction defaults to average, which simply averages
-        the points. An arbitrary reductionfunction is allowed, subject
-        to the following constraints:
+        reductionfunction may be the name of one of the built-in
+        reducers of HKEReduction ('mean', 'median', 'std', 'min',
+        'max', 'first', 'last' or 'decimate'), which reduce the data
+        in blocks without large temporaries. It defaults to 'mean',
+        which simply averages the points. An arbitrary
+        reductionfunction is also allowed, subject to the following
+        constraints:
 
             - it must accept a 3D ndarray
             - it must accept an axis keyword argument, such that
@@ -174,14 +306,24 @@ class HKEBinaryFile:
         a float can be converted to this form, though it may take some
         work.
         """
-        #WRITEME
-        #HERE
+        field = self._get_field(identifier, reduced=reduced)
+        return self._extract(field, reductionfunction=reductionfunction,
+                             start=start, stop=stop)
+
+    def _get_field(self, identifier, reduced=None):
+        """
+        Works out where the data of the register specified by
+        identifier is stored in the frame dtype.
+
+        Returns a tuple (rd, rname, linreduced), where rd is the
+        register description, rname is the name of the frame dtype
+        field to read and linreduced indicates whether the linear
+        calibration of the register must be applied to it. See
+        self._get_single_data for the meaning of reduced.
+        """
         if reduced is None:
             reduced = True
 
-        if reductionfunction is None:
-            reductionfunction = average
-
         rd = self.get_register_description(identifier)
         rname = self.get_register_name(identifier)
         linreduced = True if (rd.flags == 2) else False
@@ -195,34 +337,239 @@ data. Extracting raw data.".format(rname=rd.fullname)
         # if reduced == True:
         if reduced and (not linreduced):
             rname += ' (reduced)'
-        try:
-            data = self.data.data[rname]
-        except ValueError:
+        if rname not in self.data.dt.names:
             rname = rname[:-10]
             errmsg = "Register {rname} incorrectly flagged as having" \
                      " reduced data. Returning raw data instead."
             errmsg = errmsg.format(rname=rname)
             print errmsg
-            data = self.data.data[rname]
 
-        if linreduced:
-            slope = rd.linslope
-            offset = rd.linoffset
-            data = slope*data + offset
+        return rd, rname, linreduced
 
-        nch = rd.nch
-        nreg = len(data)
+    # reducers that pick a single sample: the index of that sample
+    # given nsamples
+    _samplereducers = {'first': lambda n: 0,
+                       'last': lambda n: n - 1,
+                       'decimate': lambda n: n//2}
 
-        data = data.reshape(nreg, nch, -1)
-        if data.shape[-1] == 1:
-            data = data.reshape(nreg, nch)
-        else:
-            data = reductionfunction(data, axis=2)
+    def _extract(self, field, reductionfunction=None, start=None,
+                 stop=None, step=None, channels=None):
+        """
+        Extracts, calibrates and reduces frames start through stop
+        (every step-th frame) of the field specified by field, a tuple
+        as returned by self._get_field. See self._get_single_data for
+        the meaning of reductionfunction.
+
+        If channels (a list or array of channel indices) is given,
+        only those channels are extracted. The frames, channels and,
+        for the 'first', 'last' and 'decimate' reducers, the one
+        sample needed are selected before the data are calibrated and
+        reduced, so the work done is proportional to the size of the
+        result.
+        """
+        if reductionfunction is None:
+            reductionfunction = 'mean'
+
+        rd, rname, linreduced = field
+        with stage('extract', label=rd.columnname) as s:
+            data = self._read_field(rname, start, stop, step)
+            nreg = len(data)
+            data = data.reshape(nreg, rd.nch, rd.nsamples)
+
+            if channels is not None:
+                data = data[:, channels]
+            if isinstance(reductionfunction, (str, unicode)):
+                sample = self._samplereducers.get(reductionfunction)
+                if (sample is not None) and (rd.nsamples > 1):
+                    sample = sample(rd.nsamples)
+                    data = data[:, :, sample:sample + 1]
+            s.nbytes = data.nbytes
+
+            if linreduced:
+                with stage('calibrate'):
+                    slope = rd.linslope
+                    offset = rd.linoffset
+                    data = slope*data + offset
+
+            nch = data.shape[1]
+            if data.shape[-1] == 1:
+                data = data.reshape(nreg, nch)
+            else:
+                with stage('reduce'):
+                    data = reduce_samples(data, reductionfunction)
 
         return data
 
+    def get_times(self):
+        """
+        Returns the time of each frame, in milliseconds since the
+        first frame of the file, as a 1D int64 array.
+
+        The times are reconstructed from the framereceivedms counter
+        of the frames. The counter is a free-running 32-bit
+        millisecond counter, so it may wrap around and, depending on
+        the hardware, may count down rather than up; both are
+        accounted for. If the counter jumps backwards (e.g. the
+        acquisition system was restarted), the true time between the
+        two frames is unknown and the nominal frame interval is used
+        instead. The frames at which this happened are listed in
+        self.timerestarts.
+
+        The returned times are therefore always non-decreasing, so
+        frame ranges can be found from them by binary search (see
+        self.frames_for_time). They are computed once and then only
+        extended as frames are appended to the file (see
+        self.refresh).
+        """
+        if (self._times is None) or (len(self._times) < 2):
+            self._make_time_index()
+        elif len(self._times) < self.datanum:
+            self._extend_time_index()
+        return self._times[:self.datanum]
+
+    def _time_steps(self, raw):
+        """
+        A helper function that returns the time steps between
+        consecutive framereceivedms values in raw, undoing 32-bit
+        wraparound and the counting direction of the counter, with
+        backwards jumps replaced by the nominal frame interval. Also
+        returns the positions in raw (minus one) of the backwards
+        jumps.
+        """
+        steps = diff(raw.astype(int64))
+        steps = (steps + 2**31) % 2**32 - 2**31
+        steps *= self._timedirection
+        restarts = nonzero(steps < 0)[0]
+        steps[restarts] = self._timeinterval
+        return steps, restarts
+
+    def _make_time_index(self):
+        """
+        A helper function to build the time index. See
+        self.get_times.
+        """
+        raw = self._read_field('framereceivedms')
+        steps = diff(raw.astype(int64))
+        steps = (steps + 2**31) % 2**32 - 2**31
+        if len(steps) and (median(steps) < 0):
+            self._timedirection = -1
+        else:
+            self._timedirection = 1
+        forward = steps*self._timedirection
+        forward = forward[forward > 0]
+        if len(forward):
+            self._timeinterval = int(median(forward))
+        else:
+            self._timeinterval = 0
+
+        steps, restarts = self._time_steps(raw)
+        self._times = concatenate([[0], cumsum(steps)]).astype(int64)
+        self.timerestarts = restarts + 1
+
+    def _extend_time_index(self):
+        """
+        A helper function to extend the time index to frames appended
+        since it was built.
+        """
+        old = len(self._times)
+        raw = self._read_field('framereceivedms', old - 1, self.datanum)
+        steps, restarts = self._time_steps(raw)
+        newtimes = self._times[-1] + cumsum(steps)
+        self._times = concatenate([self._times, newtimes])
+        self.timerestarts = concatenate([self.timerestarts,
+                                         restarts + old])
+
+    def frames_for_time(self, t_start=None, t_stop=None):
+        """
+        Returns a tuple (start, stop) of the frames whose times (see
+        self.get_times) t satisfy t_start <= t < t_stop, i.e. such
+        that self.data.data[start:stop] are the frames in that time
+        range. t_start and t_stop are in milliseconds since the first
+        frame of the file; None means the start or end of the file,
+        respectively.
+
+        The frames are found by binary search, so this costs
+        O(log(self.datanum)) once the time index exists.
+        """
+        times = self.get_times()
+        start = 0
+        stop = len(times)
+        if t_start is not None:
+            start = int(searchsorted(times, t_start, side='left'))
+        if t_stop is not None:
+            stop = int(searchsorted(times, t_stop, side='left'))
+        return start, stop
+
+    def get_gaps(self, chunksize=1048576):
+        """
+        Returns a GapIndex (see HKEBinaryLibrary.GapIndex) of the
+        dropped frames, duplicated frames, frame counter resets and
+        time jumps in the file.
+
+        The index is built from the framecount and framereceivedms
+        fields chunksize frames at a time, cached, and only extended
+        as frames are appended to the file (see self.refresh).
+        """
+        self.get_times()
+        if self._gaps is None:
+            self._gaps = GapIndex(timedirection=self._timedirection,
+                                  timeinterval=self._timeinterval)
+        for cstart in range(self._gaps.datanum, self.datanum, chunksize):
+            cstop = min(cstart + chunksize, self.datanum)
+            self._gaps.update(self._read_field('framecount', cstart, cstop),
+                              self._read_field('framereceivedms', cstart,
+                                               cstop))
+        return self._gaps
+
+    def _apply_gaps(self, a, start, stop, gaps):
+        """
+        A helper function that handles the gaps argument of
+        self.get_data for the data a of frames start through stop.
+        """
+        if gaps == 'split':
+            segments = self.get_gaps().segments(start, stop)
+            return [a[s - start:e - start] for s, e in segments]
+        elif gaps == 'nan':
+            index = self.get_gaps()
+            mask = index._mask(GapIndex.GAP, start, stop)
+            where = index.frames[mask] - start
+            shift = zeros(len(a), dtype=int64)
+            shift[where] = index.sizes[mask]
+            shift = cumsum(shift)
+            total = int(shift[-1]) if len(shift) else 0
+            out = empty((len(a) + total,) + a.shape[1:],
+                        dtype=promote_types(a.dtype, float32))
+            out.fill(nan)
+            out[arange(len(a)) + shift] = a
+            return out
+        else:
+            raise HKEBinaryError("Invalid gaps option: {0}".format(gaps))
+
+    def _frame_range(self, t_start=None, t_stop=None, frames=None):
+        """
+        A helper function that returns the (start, stop, step) of the
+        frames selected by the t_start, t_stop and frames arguments of
+        self.get_data.
+        """
+        if frames is not None:
+            if (t_start is not None) or (t_stop is not None):
+                raise HKEBinaryError("frames may not be combined with "
+                                     "t_start and t_stop.")
+            if not isinstance(frames, slice):
+                raise HKEBinaryError("frames must be a slice.")
+            start, stop, step = frames.indices(self.datanum)
+            if step < 1:
+                raise HKEBinaryError("frames must have a positive step.")
+            return start, max(start, stop), step
+        start = 0
+        stop = self.datanum
+        if (t_start is not None) or (t_stop is not None):
+            start, stop = self.frames_for_time(t_start, t_stop)
+        return start, stop, 1
+
     def get_data(self, identifier=None, reduced=None,
-                 reductionfunction=None, channels=None):
+                 reductionfunction=None, channels=None, t_start=None,
+                 t_stop=None, gaps=None, frames=None, calibrate=False):
         """
         Extracts data from the registers and returns them as a NumPy
         structured array.
@@ -231,6 +578,11 @@ data. Extracting raw data.".format(rname=rd.fullname)
         self.get_registers. It returns a 1D array of the data
         specified by the identifier.
 
+        identifier may also be a list of integers and/or strings, in
+        which case a structured array with one field per register is
+        returned (see self.get_many, which this calls with
+        structured=True). gaps may not be used in this case.
+
         The reduced flag indicates whether to extract the reduced data
         or the raw data. Since normally only the reduced data is of
         any interest, by default the reduced data is
@@ -241,48 +593,536 @@ data. Extracting raw data.".format(rname=rd.fullname)
 
         The reductionfunction is used to handle registers with
         nsamples > 1 and reduces these multiple data points in the
-        register to a single data point. It defaults to average.
+        register to a single data point. It may be the name of a
+        built-in reducer or a function (see self._get_single_data),
+        and defaults to 'mean'.
+
+        Results obtained with a built-in reducer are kept in
+        self.results, so repeating a request returns the earlier
+        result instead of extracting the data again. Such results are
+        read-only arrays shared between requests; copy them before
+        modifying them.
+
+        t_start and t_stop select the frames in a time range, in
+        milliseconds since the first frame of the file (see
+        self.frames_for_time). Only the frames in that range are
+        read.
+
+        frames may instead select the frames by frame number, as a
+        slice (e.g. frames=slice(1000, 5000) or frames=slice(None,
+        None, 10) for every tenth frame); it may not be combined with
+        t_start and t_stop.
+
+        Only the selected frames and channels are read, calibrated and
+        reduced, so the cost of a request scales with the size of its
+        result.
+
+        gaps specifies how discontinuities in the frames (see
+        self.get_gaps) are handled. If None (default), they are
+        ignored. If 'split', a list of arrays is returned, one for
+        each continuous segment of frames. If 'nan', a row of NaNs is
+        inserted for each dropped frame, so that rows are evenly
+        spaced in frame count. gaps may not be combined with a frames
+        slice with a step.
+
+        If calibrate is True, the data of a single register are
+        converted with the calibration curves of its channels (see
+        self.get_calibration), e.g. from resistance to temperature,
+        and returned as float64. The data are extracted and converted
+        a chunk of frames at a time, straight into the output.
         """
         listtypes = (list, tuple, ndarray)
         if isinstance(identifier, (int, str, unicode)):
             rd = self.get_register_description(identifier)
             if channels is None:
-                ch = range(rd.nch)
+                ch = None
+                chkey = None
             elif isinstance(channels, int):
                 ch = [channels]
+                chkey = (channels,)
             elif isinstance(channels, listtypes):
                 ch = array(channels).flatten()
+                chkey = tuple(int(c) for c in ch)
             else:
                 raise HKEBinaryError
-            a = self._get_single_data(identifier, reduced=reduced,
-                                      reductionfunction=reductionfunction)
+            start, stop, step = self._frame_range(t_start, t_stop, frames)
+            if (gaps is not None) and (step != 1):
+                raise HKEBinaryError("gaps may not be used with a frames "
+                                     "step.")
+            field = self._get_field(identifier, reduced=reduced)
+            cals = None
+            if calibrate:
+                cals = self.get_calibration(identifier)
+                if ch is not None:
+                    cals = [cals[c] for c in ch]
+                if None in cals:
+                    raise HKECalibrationError(
+                        "No calibration for some channels of register "
+                        "{0}".format(rd.fullname))
+                cals = tuple(cals)
 
-            return a[..., ch]
+            a = None
+            key = None
+            if ((reductionfunction is None) or
+                    isinstance(reductionfunction, (str, unicode))):
+                key = (field[1], field[2], reductionfunction or 'mean',
+                       chkey, start, stop, step, cals)
+                a = self.results.get(key)
+            if a is None:
+                if cals is None:
+                    a = self._extract(field,
+                                      reductionfunction=reductionfunction,
+                                      start=start, stop=stop, step=step,
+                                      channels=ch)
+                else:
+                    a = self._calibrated(field, cals, reductionfunction,
+                                         start, stop, step, ch)
+                if key is not None:
+                    a = self.results.put(key, a)
+            if gaps is not None:
+                a = self._apply_gaps(a, start, stop, gaps)
+            return a
+        elif (isinstance(identifier, listtypes) and (gaps is None) and
+              not calibrate):
+            if channels is not None:
+                channels = [channels]*len(identifier)
+            return self.get_many(identifier, reduced=reduced,
+                                 reductionfunction=reductionfunction,
+                                 channels=channels, t_start=t_start,
+                                 t_stop=t_stop, frames=frames,
+                                 structured=True)
         else:
             raise HKEBinaryError
 
+    def _calibrated(self, field, cals, reductionfunction, start, stop, step,
+                    channels, chunksize=65536):
+        """
+        A helper function that extracts frames start through stop
+        (every step-th frame) of the channels channels of field, as
+        in self._extract, and converts each channel with the
+        corresponding calibration in cals, chunksize frames at a time.
+        """
+        nframes = len(range(start, stop, step))
+        out = empty((nframes, len(cals)), dtype=float64)
+        for i in range(0, nframes, chunksize):
+            j = min(i + chunksize, nframes)
+            a = self._extract(field, reductionfunction=reductionfunction,
+                              start=start + i*step,
+                              stop=start + (j - 1)*step + 1, step=step,
+                              channels=channels)
+            with stage('calibrate'):
+                for k, cal in enumerate(cals):
+                    cal(a[:, k], out=out[i:j, k])
+        return out
+
+    def get_calibration(self, identifier):
+        """
+        Returns a list of the calibration curves (see
+        HKECalibration.Calibration) of the channels of the register
+        specified by identifier, with None for channels without one.
+
+        Curves set with self.set_calibration are used if there are
+        any. Otherwise the calibration table of each channel is looked
+        up by its channel tag, as <chtag>.txt in the directories in
+        self.calibrationpath (by default the directory of the file and
+        the current directory).
+        """
+        rd = self.get_register_description(identifier)
+        rname = self.get_register_name(identifier)
+        if rname not in self.calibrations:
+            cals = []
+            for chtag in rd.chtags:
+                path = find_calibration(chtag, self.calibrationpath)
+                cals.append(None if (path is None)
+                            else load_calibration(path))
+            self.calibrations[rname] = cals
+        return list(self.calibrations[rname])
+
+    def set_calibration(self, identifier, calibration, channel=None):
+        """
+        Attach a calibration curve to the register specified by
+        identifier, for use by self.get_data(..., calibrate=True).
+
+        calibration may be a HKECalibration.Calibration (or
+        PolynomialCalibration), the name of a calibration table file,
+        or None to remove the calibration. It is attached to channel
+        channel of the register, or to all of its channels if channel
+        is None.
+        """
+        rd = self.get_register_description(identifier)
+        rname = self.get_register_name(identifier)
+        if not isinstance(calibration, (Calibration, type(None))):
+            calibration = load_calibration(calibration)
+        cals = self.get_calibration(identifier)
+        if channel is None:
+            cals = [calibration]*rd.nch
+        else:
+            cals[channel] = calibration
+        self.calibrations[rname] = cals
+
+    def get_many(self, identifiers, reduced=None, reductionfunction=None,
+                 channels=None, t_start=None, t_stop=None, frames=None,
+                 structured=False, dtype=float64, chunksize=16384):
+        """
+        Extracts data from many registers at once.
+
+        identifiers is a list of register identifiers, as in
+        self.get_data. reduced may be a single value or a list of
+        values matching identifiers, and reductionfunction, t_start,
+        t_stop and frames are as in self.get_data. channels may be None (all
+        channels of every register) or a list matching identifiers,
+        with each entry being a channel selection as in
+        self.get_data.
+
+        If structured is False (default), returns a 2D array of dtype
+        dtype with one row per frame and the selected channels of each
+        register in consecutive columns, in the order of
+        identifiers. If structured is True, returns a structured array
+        with one field of dtype dtype per register, named by
+        self.get_register_name and holding the selected channels of
+        that register.
+
+        The output is allocated once and filled chunksize frames at a
+        time, extracting every register for a chunk before moving on
+        to the next, so the temporaries stay small and the frames of a
+        chunk stay in cache.
+        """
+        n = len(identifiers)
+        if not isinstance(reduced, (list, tuple, ndarray)):
+            reduced = [reduced]*n
+        if channels is None:
+            channels = [None]*n
+        if (len(reduced) != n) or (len(channels) != n):
+            raise HKEBinaryError("reduced and channels must match "
+                                 "identifiers.")
+
+        fields = []
+        chlist = []
+        for identifier, red, ch in zip(identifiers, reduced, channels):
+            field = self._get_field(identifier, reduced=red)
+            nch = field[0].nch
+            if ch is None:
+                ch = arange(nch)
+            elif isinstance(ch, int):
+                ch = array([ch])
+            else:
+                ch = array(ch).flatten()
+            fields.append(field)
+            chlist.append(ch)
+
+        start, stop, step = self._frame_range(t_start, t_stop, frames)
+        nframes = len(range(start, stop, step))
+
+        if structured:
+            names = [self.get_register_name(i) for i in identifiers]
+            if len(set(names)) != len(names):
+                raise HKEBinaryError("Registers may only be requested "
+                                     "once in a structured array.")
+            dta = [(name, dtype, (len(ch),)) if len(ch) > 1
+                   else (name, dtype)
+                   for name, ch in zip(names, chlist)]
+            out = empty(nframes, dtype=dta)
+            targets = [out[name].reshape(nframes, -1) for name in names]
+        else:
+            ncols = [len(ch) for ch in chlist]
+            edges = concatenate([[0], cumsum(ncols)])
+            out = empty((nframes, int(edges[-1])), dtype=dtype)
+            targets = [out[:, a:b] for a, b in zip(edges[:-1], edges[1:])]
+
+        chunksize = max(int(chunksize), 1)
+        for i in range(0, nframes, chunksize):
+            j = min(i + chunksize, nframes)
+            cstart = start + i*step
+            cstop = start + (j - 1)*step + 1
+            for field, ch, target in zip(fields, chlist, targets):
+                target[i:j] = self._extract(
+                    field, reductionfunction=reductionfunction,
+                    start=cstart, stop=cstop, step=step, channels=ch)
+        return out
+
+    def iter_chunks(self, frames_per_chunk=65536, registers=None,
+                    reduced=None, reductionfunction=None, channels=None,
+                    start=0, stop=None):
+        """
+        Generator that extracts data chunk by chunk, for processing
+        files that are too large to extract in one go.
+
+        Each chunk covers (at most) frames_per_chunk consecutive
+        frames, from frame start up to frame stop (not including
+        stop; None means the end of the file). Only the frames of one
+        chunk are held in memory at a time, so combined with mmap=True
+        the memory used is bounded by the chunk size.
+
+        registers may be a single identifier (as in self.get_data),
+        in which case each chunk is a single array with the same
+        shape and meaning as the corresponding rows of
+        self.get_data(registers, ...). It may also be a list of
+        identifiers, or None for all registers, in which case each
+        chunk is a list of such arrays, one per register.
+
+        reduced and reductionfunction are as in self.get_data and
+        reduced may be a list matching a list of registers. channels
+        is as in self.get_data, and may only be used with a single
+        register.
+        """
+        single = isinstance(registers, (int, str, unicode))
+        if registers is None:
+            registers = range(len(self.registerlist))
+        elif single:
+            registers = [registers]
+        if not isinstance(reduced, (list, tuple, ndarray)):
+            reduced = [reduced]*len(registers)
+        if (channels is not None) and (not single):
+            raise HKEBinaryError("channels may only be selected for a "
+                                 "single register.")
+        if isinstance(channels, int):
+            channels = [channels]
+
+        fields = [self._get_field(r, reduced=red)
+                  for r, red in zip(registers, reduced)]
+
+        start, stop, _ = slice(start, stop).indices(self.datanum)
+        frames_per_chunk = max(int(frames_per_chunk), 1)
+        for cstart in range(start, stop, frames_per_chunk):
+            cstop = min(cstart + frames_per_chunk, stop)
+            chunk = [self._extract(field,
+                                   reductionfunction=reductionfunction,
+                                   start=cstart, stop=cstop,
+                                   channels=channels)
+                     for field in fields]
+            if single:
+                yield chunk[0]
+            else:
+                yield chunk
+
+    def get_pyramid(self, identifier, reduced=None, persist=False):
+        """
+        Returns the min/max/mean decimation pyramid (see
+        HKEPyramid.Pyramid) of the data of the register specified by
+        identifier, reduced as by self.get_data with the default
+        reductionfunction.
+
+        The pyramid is built on first use with one pass over the
+        register, kept, and only extended as frames are appended to
+        the file (see self.refresh). If persist is True, it is also
+        saved in the pyramids directory of the cache directory and
+        reloaded from there by later HKEBinaryFile instances, as long
+        as the header of the file is unchanged and the frames it
+        covers are still there.
+        """
+        field = self._get_field(identifier, reduced=reduced)
+        key = (field[1], field[2])
+        path = pyramid_path(self.filename, '{0}|{1}'.format(*key))
+        pyramid = self._pyramids.get(key)
+        if (pyramid is None) and persist:
+            pyramid = self._load_pyramid(path)
+        if pyramid is None:
+            pyramid = Pyramid()
+        self._pyramids[key] = pyramid
+
+        old = pyramid.datanum
+        pyramid.update(lambda s, e: self._extract(field, start=s, stop=e),
+                       self.datanum)
+        if persist and ((pyramid.datanum != old) or
+                        not os.path.exists(path)):
+            last = self._read_field('framecount', pyramid.datanum - 1,
+                                    pyramid.datanum)
+            try:
+                pyramid.save(path,
+                             headerhash=header_hash(self.header.rawheader),
+                             framecount=int(last[0]) if len(last) else -1)
+            except (IOError, OSError):
+                pass
+        return pyramid
+
+    def _load_pyramid(self, path):
+        """
+        A helper function that loads the persisted pyramid at path,
+        returning None if there is none or it does not belong to the
+        current contents of the file.
+        """
+        try:
+            pyramid, meta = Pyramid.load(path)
+        except Exception:
+            return None
+        n = pyramid.datanum
+        if ((str(meta.get('headerhash')) !=
+                header_hash(self.header.rawheader)) or (n > self.datanum)):
+            return None
+        last = self._read_field('framecount', n - 1, n)
+        if int(meta.get('framecount', -1)) != \
+                (int(last[0]) if (n > 0) else -1):
+            return None
+        return pyramid
+
+    def get_plot_data(self, identifier, t_start=None, t_stop=None,
+                      max_points=2000, reduced=None, persist=False):
+        """
+        Returns data of the register specified by identifier in the
+        time range t_start through t_stop (see self.frames_for_time),
+        decimated to at most max_points points for plotting.
+
+        Returns a tuple (t, lo, hi, mean). If the time range holds at
+        most max_points frames, t is the time of each frame and lo, hi
+        and mean are all the data of each frame, as returned by
+        self.get_data. Otherwise the frames are grouped into bins of
+        2**k frames, the smallest k giving at most max_points bins, t
+        is the time of the first frame of each bin and lo, hi and mean
+        are the minimum, maximum and mean of each channel over each
+        bin. Plotting lo and hi (e.g. with fill_between) shows every
+        extreme of the data.
+
+        The bins come from the pyramid of the register (see
+        self.get_pyramid; persist is passed on to it), so once the
+        pyramid is built the cost depends on max_points only, not on
+        the length of the file or of the time range.
+        """
+        start, stop = self.frames_for_time(t_start, t_stop)
+        times = self.get_times()
+        max_points = max(int(max_points), 1)
+        size = 1
+        while (stop > start) and \
+                ((stop - 1)//size - start//size + 1 > max_points):
+            size *= 2
+
+        field = self._get_field(identifier, reduced=reduced)
+        if size == 1:
+            data = self._extract(field, start=start, stop=stop)
+            return times[start:stop], data, data, data.astype(float64)
+
+        pyramid = self.get_pyramid(identifier, reduced=reduced,
+                                   persist=persist)
+        level = int(log2(size))
+        b0 = start//size
+        b1 = (stop - 1)//size + 1
+        lo, hi, mean = pyramid.query(
+            level, b0, b1, lambda s, e: self._extract(field, start=s, stop=e),
+            self.datanum)
+        t = times[arange(b0, b0 + len(lo))*size]
+        return t, lo, hi, mean
+
     def sarray_to_array(self, sarray):
         """
         Convert a structured array (e.g. the output of
         self.get_data([0,1])) to a regular 2D Numpy array. Note that
         this creates a view of the structured array, so the values in
         the structured array and resulting 2D ndarray are linked.
+
+        All of the fields must have the same base dtype, as is the case
+        for the output of self.get_data and self.get_many.
         """
-        columns = len(sarray.dtype.names)
-        a = sarray.view().reshape(-1, columns)
+        base = sarray.dtype[0].base
+        a = sarray.view(base).reshape(len(sarray), -1)
         return a
 
-    def split_file(self, newfname, start=0, end=-1):
+    def export(self, outname=None, fmt='hdf5', **kwargs):
+        """
+        Export the file to outname in a columnar format, with each
+        register in its own chunked, compressed column. fmt may be
+        'hdf5', 'parquet' or 'npz'. See to_columnar.export for the
+        other keyword arguments. Returns the name of the output.
+        """
+        import to_columnar
+        return to_columnar.export(self, outname, fmt=fmt, **kwargs)
+
+    def split_file(self, newfname, start=0, end=None, t_start=None,
+                   t_stop=None):
         """
         Saves a subset of an hkebinary file to `newfname`.
 
         The full file header is always saved.
 
         Saves data from frame `start` to frame `end`, not including the
-        endpoint, i.e. saves self.data.data[start:end].
+        endpoint, i.e. saves self.data.data[start:end]. By default
+        (end=None) all frames from `start` on are saved.
+
+        Alternatively, the frames may be selected by time with
+        `t_start` and `t_stop`, in milliseconds since the first frame
+        of the file (see self.frames_for_time). If either is given,
+        `start` and `end` are ignored.
+
+        The frames are copied byte for byte from the file, a buffer at
+        a time (see _copy_range), without being decoded.
+        """
+        if (t_start is not None) or (t_stop is not None):
+            start, end = self.frames_for_time(t_start, t_stop)
+        start, end, _ = slice(start, end).indices(self.datanum)
+        end = max(start, end)
+        offset = len(self.header.rawheader)
+        with open(self.filename, 'rb') as fsrc:
+            with open(newfname, 'wb') as fdst:
+                fdst.write(self.header.rawheader)
+                _copy_range(fsrc, fdst, offset + start*self.dtsize,
+                            (end - start)*self.dtsize)
+        return newfname
+
+    def split_into(self, pattern=None, pieces=None, duration=None,
+                   frames=None, workers=4):
+        """
+        Splits the file into consecutive pieces, each saved as a
+        complete hkebinary file (see self.split_file). Exactly one of
+        the following selects the pieces:
+
+            pieces - (int) the number of pieces, of (nearly) equal
+                numbers of frames
+            duration - (number) the duration of each piece, in
+                milliseconds (see self.get_times)
+            frames - (int) the number of frames in each piece
+
+        pattern is a format string for the names of the pieces, given
+        the index of the piece, e.g. 'hke_20120615_001_{0:03d}.dat',
+        which is also the default (derived from the name of the
+        file). The pieces are written workers at a time.
+
+        Returns the list of the names of the pieces.
         """
-        start = int(start)
-        end = int(end)
-        with open(newfname, 'wb') as f:
-            f.write(self.header.rawheader)
-            self.data.data[start:end].tofile(f)
+        if [pieces, duration, frames].count(None) != 2:
+            raise HKEBinaryError("Exactly one of pieces, duration and "
+                                 "frames must be given.")
+        if pattern is None:
+            base, ext = os.path.splitext(self.filename)
+            pattern = base + '_{0:03d}' + ext
+
+        if pieces is not None:
+            edges = linspace(0, self.datanum, int(pieces) + 1)
+            edges = edges.round().astype(int64)
+        elif frames is not None:
+            edges = arange(0, self.datanum, int(frames))
+            edges = concatenate([edges, [self.datanum]])
+        else:
+            times = self.get_times()
+            tend = times[-1] + 1 if len(times) else 0
+            bounds = arange(0, tend, duration)
+            edges = searchsorted(times, bounds, side='left')
+            edges = concatenate([edges, [self.datanum]])
+        edges = [int(e) for e in edges]
+        tasks = [(pattern.format(i), a, b)
+                 for i, (a, b) in enumerate(zip(edges[:-1], edges[1:]))]
+
+        def split(task):
+            return self.split_file(task[0], start=task[1], end=task[2])
+
+        if (workers <= 1) or (len(tasks) <= 1):
+            return [split(task) for task in tasks]
+        from multiprocessing.pool import ThreadPool
+        pool = ThreadPool(min(workers, len(tasks)))
+        try:
+            return pool.map(split, tasks)
+        finally:
+            pool.close()
+            pool.join()
+
+
+def _copy_range(fsrc, fdst, offset, count, bufsize=1048576):
+    """
+    Copy count bytes starting at offset in the open file fsrc to the
+    current position of the open file fdst, through a buffer of
+    bufsize bytes, so that memory use does not depend on count.
+    """
+    fsrc.seek(offset)
+    while count > 0:
+        buf = fsrc.read(min(bufsize, count))
+        if not buf:
+            break
+        fdst.write(buf)
+        count -= len(buf)
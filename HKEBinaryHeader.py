@@ -0,0 +1,613 @@
+#!/bin/env python
+"""
+HKEBinaryHeader.py - Parsing of the HKE binary file header.
+
+Everything needed to read a file header and work out the layout of
+its frames, without importing NumPy or bitstring, so that tools that
+only look at headers (e.g. inspect_headers.py) start quickly. NumPy
+is imported only when a header field is read as an array.
+
+Example usage:
+    None; used by HKEBinaryLibrary.py and inspect_headers.py instead.
+"""
+
+import weakref
+from struct import Struct
+
+
+class FrozenDict(dict):
+    """
+    A read-only dict, for the lookup tables of the (shared, immutable)
+    header descriptions.
+    """
+    def _readonly(self, *args, **kwargs):
+        raise TypeError("{0} objects are "
+                        "read-only".format(type(self).__name__))
+
+    __setitem__ = __delitem__ = _readonly
+    clear = pop = popitem = setdefault = update = _readonly
+
+    def __reduce__(self):
+        return (type(self), (dict(self),))
+
+
+class _Description(object):
+    """
+    Base class of the header description objects.
+
+    Descriptions are immutable once their header has been parsed (see
+    Header), and hold their lists as tuples and their lookup tables as
+    FrozenDicts, so that one parsed header can safely be shared
+    between all the files with the same configuration (see
+    intern_header).
+    They hold no references to the reader they were parsed with or to
+    the descriptions containing them, so a parsed header neither keeps
+    the file contents alive nor drags them along when it is pickled
+    (e.g. by HKEBinaryCache.HeaderCache).
+    """
+    __slots__ = ('_frozen',)
+
+    def __setattr__(self, name, value):
+        if getattr(self, '_frozen', False):
+            raise AttributeError("{0} objects are "
+                                 "immutable".format(type(self).__name__))
+        object.__setattr__(self, name, value)
+
+    @classmethod
+    def _allslots(cls):
+        return [name for c in cls.__mro__
+                for name in c.__dict__.get('__slots__', ())
+                if name != '__weakref__']
+
+    def _freeze(self):
+        object.__setattr__(self, '_frozen', True)
+
+    def __getstate__(self):
+        return dict((name, getattr(self, name))
+                    for name in self._allslots() if hasattr(self, name))
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            object.__setattr__(self, name, value)
+
+
+class RegisterFrameDescription(_Description):
+    """
+    The boards and registers of a file, in frame order, with
+    dictionaries for looking them up:
+
+        boards - board description: BoardDescription
+        _bkeydict - board name (see BoardDescription): BoardDescription
+        _baddressdict - board address: BoardDescription
+        _rkeyindex - register full name: register index
+        _rcolumnindex - register column name: register index
+    """
+    __slots__ = ('startpos', 'magic', 'version', 'timestamp', 'boardcount',
+                 'boarddescriptions', 'boards', 'boardlist', '_bkeydict',
+                 '_baddressdict', '_rkeylist', '_rdlist', '_rkeyindex',
+                 '_rcolumnindex', 'endpos', 'length')
+
+    def __init__(self, hkebreader):
+        # This check slows down the read considerably, so just enforce
+        # that hkebreader is actually a HKEBinaryReader object.
+        # if isinstance(hkebreader, HKEBinaryReader):
+        #     h = hkebreader
+        # else:
+        #     h = HKEBinaryReader(bitstream=hkebreader)
+        h = hkebreader
+
+        h.pos = 0
+        self.startpos = h.pos + 0
+        self.magic = h.char()
+        if self.magic != 'F':
+            raise HKEMagicError
+        self.version = h.ushort()
+        self.timestamp = h.string()
+        self.boardcount = h.ushort()
+        self.boarddescriptions = tuple(BoardDescription(h)
+                                       for i in range(self.boardcount))
+        self.boards = FrozenDict((bd.description, bd)
+                                 for bd in self.boarddescriptions)
+        self.boardlist = tuple(bd.name for bd in self.boarddescriptions)
+        self._bkeydict = FrozenDict((bd.name, bd)
+                                    for bd in self.boarddescriptions)
+        self._baddressdict = FrozenDict((bd.address, bd)
+                                        for bd in self.boarddescriptions)
+
+        self._rdlist = tuple(rd for bd in self.boarddescriptions
+                             for rd in bd.registerdescriptions)
+        self._rkeylist = tuple(rd.fullname for rd in self._rdlist)
+        self._rkeyindex = FrozenDict((key, i)
+                                     for i, key in enumerate(self._rkeylist))
+        self._rcolumnindex = FrozenDict((rd.columnname, i)
+                                        for i, rd in enumerate(self._rdlist))
+        for i, rd in enumerate(self._rdlist):
+            rd.index = i
+        self.endpos = h.pos + 0
+        self.length = self.endpos - self.startpos + 1
+
+    def _freeze(self):
+        for bd in self.boarddescriptions:
+            bd._freeze()
+        _Description._freeze(self)
+
+
+class BoardDescription(_Description):
+    """
+    A board of a file. name is the board name used by
+    HKEBinaryFile.list_boards, '<description> (<address>-<board
+    type>)'.
+    """
+    __slots__ = ('startpos', 'magic', 'boardtype', 'address', 'description',
+                 'name', 'registercount', 'registerdescriptions',
+                 'registers', 'endpos', 'length')
+
+    def __init__(self, hkebreader):
+        h = hkebreader
+        self.startpos = h.pos + 0.
+        self.magic = h.char()
+        if self.magic != 'B':
+            raise HKEMagicError
+        self.boardtype = h.string()
+        self.address = h.byte()
+        self.description = h.string()
+        self.name = '{desc} ({address}-{type})'.format(
+            desc=self.description, address=self.address,
+            type=self.boardtype)
+        self.registercount = h.ushort()
+        self.registerdescriptions = tuple(RegisterDescription(h, self)
+                                          for i in
+                                          range(self.registercount))
+        self.registers = FrozenDict((rd.name, rd)
+                                    for rd in self.registerdescriptions)
+        self.endpos = h.pos + 0
+        self.length = self.endpos - self.startpos + 1
+
+    def _freeze(self):
+        for rd in self.registerdescriptions:
+            rd._freeze()
+        _Description._freeze(self)
+
+
+class RegisterDescription(_Description):
+    """
+    A register of a file. The board the register is on is given by
+    its address, boardtype and boardname (the board description), and
+    index is its position in the list of all registers of the file.
+    """
+    __slots__ = ('startpos', 'magic', 'address', 'boardtype', 'boardname',
+                 'index', 'name', 'fullname', 'columnname', 'registertype',
+                 'registertypename', 'registertypelength', 'nch',
+                 'nsamples', 'chtags', 'flags', 'units', 'linslope',
+                 'linoffset', 'endpos', 'length')
+
+    _rtypenamedict = {0: 'uint8', 1: 'uint16', 2: 'uint32',
+                      3: 'float', 4: 'int16', 5: 'int32'}
+    _rtypelengthdict = {0: 1, 1: 2, 2: 4, 3: 4, 4: 2, 5: 4,
+                        'uint8': 1, 'uint16': 2, 'uint32': 4,
+                        'float': 4, 'int16': 2, 'int32': 4}
+
+    def __init__(self, hkebreader, bd):
+        h = hkebreader
+        self.address = bd.address
+        self.boardtype = bd.boardtype
+        self.boardname = bd.description
+        self.index = None
+
+        self.startpos = h.pos + 0
+        self.magic = h.char()
+        if self.magic != 'R':
+            raise HKEMagicError
+        self.name = h.string()
+        self.fullname = '{desc} ({address}-{type}): {name}\
+'.format(desc=self.boardname, address=self.address,
+         type=self.boardtype, name=self.name)
+        self.columnname = '{address}-{name}'.format(address=self.address,
+                                                    name=self.name)
+        self.registertype = h.byte()
+        self.registertypename = self._rtypenamedict[self.registertype]
+        self.registertypelength = self._rtypelengthdict[self.registertype]
+        self.nch = h.ushort()
+        self.nsamples = h.ushort()
+        self.chtags = tuple(h.stringarray(length=self.nch))
+        self.flags = h.byte()
+        if self.flags == 0:
+            self.units = None
+            self.linslope = None
+            self.linoffset = None
+            return
+        self.units = h.string()
+        if self.flags == 2:
+            self.linslope = h.float()
+            self.linoffset = h.float()
+        else:
+            self.linslope = None
+            self.linoffset = None
+        self.endpos = h.pos + 0
+        self.length = self.endpos - self.startpos + 1
+
+
+class HKEBufferReader(object):
+    """
+    A fast reader for the HKE binary file header.
+
+    HKEBinaryReader pulls every field through bitstring, which is by
+    far the most expensive part of opening a file. HKEBufferReader
+    instead reads the raw bytes of the file in large blocks (normally
+    the whole header in a single read) and decodes each field with
+    struct at an offset into that buffer.
+
+    It provides the same reading methods as HKEBinaryReader, so it may
+    be passed to Header in place of one. pos is measured in bits, as
+    in HKEBinaryReader, so that header positions and lengths are
+    unchanged.
+
+    Arguments:
+        filename - (str) filename of HKE binary file
+    """
+    blocksize = 65536
+
+    _uint8 = Struct('<B')
+    _uint16 = Struct('<H')
+    _uint32 = Struct('<I')
+    _int16 = Struct('<h')
+    _int32 = Struct('<i')
+    _float = Struct('<f')
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.buffer = b''
+        self.offset = 0
+        self._file = open(filename, 'rb')
+
+    @property
+    def pos(self):
+        """
+        The current position in the buffer, in bits.
+        """
+        return 8*self.offset
+
+    @pos.setter
+    def pos(self, value):
+        self.offset = value//8
+
+    def close(self):
+        """
+        Close the underlying file. The bytes read so far remain
+        available in self.buffer.
+        """
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _require(self, num):
+        """
+        Make sure the next num bytes are in the buffer, reading more
+        of the file if necessary, and return the offset just past
+        them.
+        """
+        end = self.offset + num
+        if end > len(self.buffer):
+            if self._file is None:
+                raise HKEBitstreamError
+            toread = max(self.blocksize, end - len(self.buffer))
+            self.buffer += self._file.read(toread)
+            if end > len(self.buffer):
+                raise HKEBitstreamError("Unexpected end of file "
+                                        "in {0}".format(self.filename))
+        return end
+
+    def _unpack(self, struct):
+        end = self._require(struct.size)
+        value, = struct.unpack_from(self.buffer, self.offset)
+        self.offset = end
+        return value
+
+    def char(self):
+        """
+        Read a character. Returns a string object containing the
+        single read character.
+        """
+        return chr(self._unpack(self._uint8))
+
+    def string(self):
+        """
+        Read a HKE string. See HKEBinaryReader.string for info.
+        """
+        num = self._unpack(self._uint8)
+        start = self.offset
+        self.offset = self._require(num)
+        return _decode(self.buffer[start:self.offset])
+
+    def byte(self):
+        """
+        Read a HKE byte. See HKEBinaryReader.byte for info.
+        """
+        return self._unpack(self._uint8)
+
+    def uint8(self):
+        """
+        Read a uint8. See HKEBinaryReader.uint8 for info.
+        """
+        return self._unpack(self._uint8)
+
+    def ushort(self):
+        """
+        Read an unsigned short. See HKEBinaryReader.ushort for info.
+        """
+        return self._unpack(self._uint16)
+
+    def uint16(self):
+        """
+        Read a uint16. See HKEBinaryReader.uint16 for info.
+        """
+        return self._unpack(self._uint16)
+
+    def uint32(self):
+        """
+        Read a uint32. See HKEBinaryReader.uint32 for info.
+        """
+        return self._unpack(self._uint32)
+
+    def int16(self):
+        """
+        Read an int16. See HKEBinaryReader.int16 for info.
+        """
+        return self._unpack(self._int16)
+
+    def int32(self):
+        """
+        Read an int32. See HKEBinaryReader.int32 for info.
+        """
+        return self._unpack(self._int32)
+
+    def float(self):
+        """
+        Read a 32-bit float. See HKEBinaryReader.float for info.
+        """
+        return self._unpack(self._float)
+
+    def raw(self, num):
+        """
+        Returns the first num bytes of the file.
+        """
+        pos = self.offset
+        self.offset = 0
+        self._require(num)
+        self.offset = pos
+        return self.buffer[:num]
+
+    def stringarray(self, length):
+        """
+        Read an array of HKE strings. Returns the read strings in a
+        list of specified length.
+        """
+        return [self.string() for i in range(length)]
+
+    def _typedarray(self, length, dt):
+        """
+        Decode length little-endian values of dtype dt with a single
+        numpy.frombuffer call. The returned array is a read-only view
+        into self.buffer; no bytes are copied.
+        """
+        from numpy import dtype, frombuffer
+        dt = dtype(dt)
+        end = self._require(length*dt.itemsize)
+        a = frombuffer(self.buffer, dtype=dt, count=length,
+                       offset=self.offset)
+        self.offset = end
+        return a
+
+    def bytearray(self, length):
+        """
+        Read an array of HKE bytes. Returns a 1D uint8 NumPy array.
+        """
+        return self._typedarray(length, '<u1')
+
+    def floatarray(self, length):
+        """
+        Read an array of 32-bit floats. Returns a 1D float32 NumPy
+        array.
+        """
+        return self._typedarray(length, '<f4')
+
+    def uint8array(self, length):
+        """
+        Read an array of uint8s. Returns a 1D uint8 NumPy array.
+        """
+        return self._typedarray(length, '<u1')
+
+    def uint16array(self, length):
+        """
+        Read an array of uint16s. Returns a 1D uint16 NumPy array.
+        """
+        return self._typedarray(length, '<u2')
+
+    def uint32array(self, length):
+        """
+        Read an array of uint32s. Returns a 1D uint32 NumPy array.
+        """
+        return self._typedarray(length, '<u4')
+
+    def int16array(self, length):
+        """
+        Read an array of int16s. Returns a 1D int16 NumPy array.
+        """
+        return self._typedarray(length, '<i2')
+
+    def int32array(self, length):
+        """
+        Read an array of int32s. Returns a 1D int32 NumPy array.
+        """
+        return self._typedarray(length, '<i4')
+
+    def array(self, length, type):
+        """
+        Reads an array of the specified type, given either as a
+        register type number or name (see
+        RegisterDescription._rtypenamedict). Returns the read values
+        in a 1D NumPy array of the specified length.
+        """
+        try:
+            dt = _arraydtypedict[type]
+        except KeyError:
+            raise HKEBinaryError("Invalid array type: {0}".format(type))
+        return self._typedarray(length, dt)
+
+
+_arraydtypedict = {'uint8': '<u1', 'uint16': '<u2', 'uint32': '<u4',
+                   'float': '<f4', 'int16': '<i2', 'int32': '<i4',
+                   0: '<u1', 1: '<u2', 2: '<u4', 3: '<f4', 4: '<i2',
+                   5: '<i4'}
+
+
+def _decode(b):
+    """
+    Convert bytes read from a file to a native string.
+    """
+    if isinstance(b, str):
+        return b
+    return b.decode('latin-1')
+
+
+class Header(RegisterFrameDescription):
+    """
+    The HKE binary data file header.
+
+    Besides the RegisterFrameDescription, this holds the raw bytes of
+    the header (rawheader), which identify the configuration it
+    describes, and, once interned (see intern_header), the frame
+    dtype of that configuration (dtype).
+
+    A Header is immutable once parsed, and holds nothing specific to
+    the file it was read from, so it may be shared by every file with
+    the same configuration.
+    """
+    __slots__ = ('rawheader', 'dtype', '__weakref__')
+
+    def __init__(self, hkebreader):
+        RegisterFrameDescription.__init__(self, hkebreader)
+        self.rawheader = hkebreader.raw(self.endpos//8)
+        self.dtype = None
+        self._freeze()
+
+
+# rawheader: Header, of every Header in use in the process
+_headers = weakref.WeakValueDictionary()
+
+
+def intern_header(header, dt=None):
+    """
+    Return the shared Header of the configuration described by
+    header: the already interned Header with the same rawheader if
+    there is one, otherwise header itself, which is interned with the
+    frame dtype dt.
+
+    Interned headers are only weakly referenced, so they are dropped
+    once no open file uses them.
+    """
+    shared = _headers.get(header.rawheader)
+    if shared is not None:
+        return shared
+    object.__setattr__(header, 'dtype', dt)
+    _headers[header.rawheader] = header
+    return header
+
+
+def clear_headers():
+    """
+    Forget all interned headers, so that the next file opened parses
+    (or loads) its header again. Files already open keep theirs.
+    """
+    _headers.clear()
+
+
+def find_header(prefix):
+    """
+    Return the interned Header whose rawheader begins the bytes
+    prefix (e.g. the first block of a file), or None. Parsing a file
+    whose header is already interned would give the same Header, so
+    this saves parsing it again.
+    """
+    for rawheader, header in list(_headers.items()):
+        if prefix.startswith(rawheader):
+            return header
+    return None
+
+
+# The frame header: magic character, framecount and framereceivedms.
+frameheadersize = 9
+# Offset of framereceivedms within a frame.
+framereceivedmsoffset = 5
+
+
+def frame_size(rfd):
+    """
+    Return the size in bytes of one frame of a file with the
+    RegisterFrameDescription (or Header) rfd, i.e. the itemsize of the
+    frame dtype HKEBinaryLibrary.Data builds, without building it.
+    """
+    size = frameheadersize
+    for rd in rfd._rdlist:
+        n = rd.nch*rd.nsamples
+        size += n*rd.registertypelength
+        if rd.flags == 4:
+            # the reduced data are stored as float32s
+            size += 4*n
+    return size
+
+
+class HKEBinaryError(Exception):
+    """
+    Exception class for handling errors unique to working with the HKE
+    binary files.
+    """
+    pass
+
+
+class HKEMagicError(HKEBinaryError):
+    """
+    An incorrect magic character was encountered.
+    """
+    pass
+
+
+class HKEBitstreamError(HKEBinaryError):
+    """
+    There was an error in the bitstream to be read.
+    """
+    pass
+
+
+class HKEInvalidRegisterError(HKEBinaryError):
+    """
+    User tried to access an invalid register.
+    """
+    def __init__(self, rname):
+        self.rname = rname
+        self.msg = ("Invalid register specifier:"
+                    " {0}".format(self.rname))
+
+    def __str__(self):
+        return self.msg
+
+
+class HKEIncompatibleFilesError(HKEBinaryError):
+    """
+    User tried to combine files whose frame layouts differ.
+    """
+    def __init__(self, fname, reference):
+        self.fname = fname
+        self.reference = reference
+        self.msg = ("File {0} is not compatible with"
+                    " {1}".format(self.fname, self.reference))
+
+    def __str__(self):
+        return self.msg
+
+
+class HKECalibrationError(HKEBinaryError):
+    """
+    A calibration table is invalid, missing, or cannot be applied.
+    """
+    pass
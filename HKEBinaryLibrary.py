@@ -10,135 +10,17 @@ jlazear@pha.jhu.edu
 June 25, 2012
 """
 
-from bitstring import BitStream
-from numpy import *
+import os
 
+from numpy import *
 
-class RegisterFrameDescription(object):
-    def __init__(self, hkebreader):
-        # This check slows down the read considerably, so just enforce
-        # that hkebreader is actually a HKEBinaryReader object.
-        # if isinstance(hkebreader, HKEBinaryReader):
-        #     h = hkebreader
-        # else:
-        #     h = HKEBinaryReader(bitstream=hkebreader)
-        h = hkebreader
-        self.reader = hkebreader
-        self.filename = self.reader.filename
-
-        h.bitstream.pos = 0
-        self.startpos = h.bitstream.pos + 0
-        self.magic = h.char()
-        if self.magic is not 'F':
-            raise HKEMagicError
-        self.version = h.ushort()
-        self.timestamp = h.string()
-        self.boardcount = h.ushort()
-        self.boarddescriptions = []
-        self.boards = {}
-        for i in range(self.boardcount):
-            bd = BoardDescription(self)
-            self.boarddescriptions.append(bd)
-            self.boards[bd.description] = bd
-
-        self._rkeylist = []
-        self._rdlist = []
-        for bd in self.boarddescriptions:
-            btype = bd.boardtype
-            baddress = bd.address
-            bdesc = bd.description
-            prefixstr = '{desc} ({address}-{type}): '
-            prefix = prefixstr.format(desc=bdesc,
-                                      type=btype,
-                                      address=baddress)
-            for rd in bd.registerdescriptions:
-                rname = rd.name
-                key = prefix + rname
-                self._rkeylist.append(key)
-                self._rdlist.append(rd)
-        self.endpos = h.bitstream.pos + 0
-        self.length = self.endpos - self.startpos + 1
-
-
-class BoardDescription(object):
-    def __init__(self, rfd):
-        # This check slows down the read considerably, so just enforce
-        # that hkebreader is actually a HKEBinaryReader object.
-        # if isinstance(hkebreader, HKEBinaryReader):
-        #     h = hkebreader
-        # else:
-        #     h = HKEBinaryReader(bitstream=hkebreader)
-        self.rfd = rfd
-        self.registerframedescription = self.rfd
-        self.reader = self.rfd.reader
-
-        self.startpos = self.reader.bitstream.pos + 0.
-        self.magic = self.reader.char()
-        if self.magic is not 'B':
-            raise HKEMagicError
-        self.boardtype = self.reader.string()
-        self.address = self.reader.byte()
-        self.description = self.reader.string()
-        self.registercount = self.reader.ushort()
-        self.registerdescriptions = []
-        self.registers = {}
-        for i in range(self.registercount):
-            rd = RegisterDescription(self)
-            self.registerdescriptions.append(rd)
-            self.registers[rd.name] = rd
-        self.endpos = self.reader.bitstream.pos + 0
-        self.length = self.endpos - self.startpos + 1
-
-
-class RegisterDescription(object):
-    _rtypenamedict = {0: 'uint8', 1: 'uint16', 2: 'uint32',
-                      3: 'float', 4: 'int16', 5: 'int32'}
-    _rtypelengthdict = {0: 1, 1: 2, 2: 4, 3: 4, 4: 2, 5: 4,
-                        'uint8': 1, 'uint16': 2, 'uint32': 4,
-                        'float': 4, 'int16': 2, 'int32': 4}
-
-    def __init__(self, bd):
-        # This check slows down the read considerably, so just enforce
-        # that hkebreader is actually a HKEBinaryReader object.
-        # if isinstance(hkebreader, HKEBinaryReader):
-        #     h = hkebreader
-        # else:
-        #     h = HKEBinaryReader(bitstream=hkebreader)
-        self.bd = bd
-        self.boarddescription = self.bd
-        self.reader = self.bd.reader
-
-        self.startpos = self.reader.bitstream.pos + 0
-        self.magic = self.reader.char()
-        if self.magic is not 'R':
-            raise HKEMagicError
-        self.name = self.reader.string()
-        self.fullname = '{desc} ({address}-{type}): {name}\
-'.format(desc=self.bd.description, address=self.bd.address,
-         type=self.bd.boardtype, name=self.name)
-        self.columnname = '{address}-{name}'.format(address=self.bd.address,
-                                                    name=self.name)
-        self.registertype = self.reader.byte()
-        self.registertypename = self._rtypenamedict[self.registertype]
-        self.registertypelength = self._rtypelengthdict[self.registertype]
-        self.nch = self.reader.ushort()
-        self.nsamples = self.reader.ushort()
-        self.chtags = self.reader.stringarray(length=self.nch)
-        self.flags = self.reader.byte()
-        if self.flags is 0:
-            self.units = None
-            self.linslope = None
-            self.linoffset = None
-            return
-        self.units = self.reader.string()
-        if self.flags is 2:
-            self.linslope = self.reader.float()
-            self.linoffset = self.reader.float()
-        else:
-            self.linslope = None
-            self.linoffset = None
-        self.endpos = self.reader.bitstream.pos + 0
-        self.length = self.endpos - self.startpos + 1
+from HKEBinaryHeader import (RegisterFrameDescription, BoardDescription,
+                             RegisterDescription, HKEBufferReader, Header,
+                             frame_size, intern_header, find_header,
+                             HKEBinaryError, HKEMagicError,
+                             HKEBitstreamError, HKEInvalidRegisterError,
+                             HKEIncompatibleFilesError, HKECalibrationError)
+from HKEInstrument import stage
 
 
 class HKEBinaryReader(object):
@@ -159,10 +41,29 @@ class HKEBinaryReader(object):
                           4: self.int16array,
                           5: self.int32array}
 
+        # bitstring is slow to import, so it is only imported when a
+        # HKEBinaryReader is actually used
+        try:
+            from bitstring import BitStream
+        except ImportError:
+            raise HKEBitstreamError("HKEBinaryReader requires the "
+                                    "bitstring package. Use "
+                                    "HKEBufferReader instead.")
         self.filename = filename
         self.bitstream = BitStream(filename=filename)
         self.bitstream.pos = 0
 
+    @property
+    def pos(self):
+        """
+        The current position in the stored bitstream, in bits.
+        """
+        return self.bitstream.pos
+
+    @pos.setter
+    def pos(self, value):
+        self.bitstream.pos = value
+
     def char(self, bitstream=None):
         """
         Read a character from the specified bitstream or stored
@@ -335,6 +236,19 @@ class HKEBinaryReader(object):
         int32 = bitstream.read('intle:32')
         return int32
 
+    def raw(self, num, bitstream=None):
+        """
+        Returns the first num bytes of the specified bitstream or
+        stored bitstream if none is given.
+        """
+        if bitstream is None:
+            bitstream = self.bitstream
+
+        if bitstream is None:
+            raise HKEBitstreamError
+
+        return bitstream[:8*num].bytes
+
     def stringarray(self, length, bitstream=None):
         """
         Read an array of strings from the specified bitstream or
@@ -375,155 +289,96 @@ class HKEBinaryReader(object):
     def bytearray(self, length, bitstream=None):
         """
         Read an array of bytes from the specified bitstream or stored
-        bitstream if none is given. Returns the read bytes in a list
-        of specified length.
+        bitstream if none is given. Returns the read bytes in a 1D
+        NumPy array of specified length.
 
         A byte is the HKE byte. See HKEBinaryReader.byte for info.
         """
-        if bitstream is None:
-            bitstream = self.bitstream
-
-        if bitstream is None:
-            raise HKEBitstreamError
-
-        bytearray = []
-        for i in range(length):
-            byte = self.byte(bitstream)
-            bytearray.append(byte)
-
-        return bytearray
+        return self._typedarray(length, '<u1', bitstream)
 
     def floatarray(self, length, bitstream=None):
         """
         Read an array of floats from the specified bitstream or stored
-        bitstream if none is given. Returns the read floats in a list
-        of specified length.
+        bitstream if none is given. Returns the read floats in a 1D
+        NumPy array of specified length.
 
         A float is the HKE float. See HKEBinaryReader.float for info.
         """
-        if bitstream is None:
-            bitstream = self.bitstream
-
-        if bitstream is None:
-            raise HKEBitstreamError
-
-        floatarray = []
-        for i in range(length):
-            float = self.float(bitstream)
-            floatarray.append(float)
-
-        return floatarray
+        return self._typedarray(length, '<f4', bitstream)
 
     def uint8array(self, length, bitstream=None):
         """
         Read an array of uint8s from the specified bitstream or stored
-        bitstream if none is given. Returns the read uint8s in a list
-        of specified length.
+        bitstream if none is given. Returns the read uint8s in a 1D
+        NumPy array of specified length.
 
         A uint8 is the HKE uint8. See HKEBinaryReader.uint8 for info.
         """
-        if bitstream is None:
-            bitstream = self.bitstream
-
-        if bitstream is None:
-            raise HKEBitstreamError
-
-        uint8array = []
-        for i in range(length):
-            uint8 = self.uint8(bitstream)
-            uint8array.append(uint8)
-
-        return uint8array
+        return self._typedarray(length, '<u1', bitstream)
 
     def uint16array(self, length, bitstream=None):
         """
         Read an array of uint16s from the specified bitstream or stored
-        bitstream if none is given. Returns the read uint16s in a list
-        of specified length.
+        bitstream if none is given. Returns the read uint16s in a 1D
+        NumPy array of specified length.
 
         A uint16 is the HKE uint16. See HKEBinaryReader.uint16 for info.
         """
-        if bitstream is None:
-            bitstream = self.bitstream
-
-        if bitstream is None:
-            raise HKEBitstreamError
-
-        uint16array = []
-        for i in range(length):
-            uint16 = self.uint16(bitstream)
-            uint16array.append(uint16)
-
-        return uint16array
+        return self._typedarray(length, '<u2', bitstream)
 
     def uint32array(self, length, bitstream=None):
         """
         Read an array of uint32s from the specified bitstream or stored
-        bitstream if none is given. Returns the read uint32s in a list
-        of specified length.
+        bitstream if none is given. Returns the read uint32s in a 1D
+        NumPy array of specified length.
 
         A uint32 is the HKE uint32. See HKEBinaryReader.uint32 for info.
         """
-        if bitstream is None:
-            bitstream = self.bitstream
-
-        if bitstream is None:
-            raise HKEBitstreamError
-
-        uint32array = []
-        for i in range(length):
-            uint32 = self.uint32(bitstream)
-            uint32array.append(uint32)
-
-        return uint32array
+        return self._typedarray(length, '<u4', bitstream)
 
     def int16array(self, length, bitstream=None):
         """
         Read an array of int16s from the specified bitstream or stored
-        bitstream if none is given. Returns the read int16s in a list
-        of specified length.
+        bitstream if none is given. Returns the read int16s in a 1D
+        NumPy array of specified length.
 
         A int16 is the HKE int16. See HKEBinaryReader.int16 for info.
         """
-        if bitstream is None:
-            bitstream = self.bitstream
-
-        if bitstream is None:
-            raise HKEBitstreamError
-
-        int16array = []
-        for i in range(length):
-            int16 = self.int16(bitstream)
-            int16array.append(int16)
-
-        return int16array
+        return self._typedarray(length, '<i2', bitstream)
 
     def int32array(self, length, bitstream=None):
         """
         Read an array of int32s from the specified bitstream or stored
-        bitstream if none is given. Returns the read int32s in a list
-        of specified length.
+        bitstream if none is given. Returns the read int32s in a 1D
+        NumPy array of specified length.
 
         A int32 is the HKE int32. See HKEBinaryReader.int32 for info.
         """
+        return self._typedarray(length, '<i4', bitstream)
+
+    def _typedarray(self, length, dt, bitstream=None):
+        """
+        Read length little-endian values of dtype dt from the
+        specified bitstream or stored bitstream if none is given, and
+        decode them with a single numpy.frombuffer call. The returned
+        array is a read-only view of the bytes read.
+        """
         if bitstream is None:
             bitstream = self.bitstream
 
         if bitstream is None:
             raise HKEBitstreamError
 
-        int32array = []
-        for i in range(length):
-            int32 = self.int32(bitstream)
-            int32array.append(int32)
-
-        return int32array
+        dt = dtype(dt)
+        nbytes = length*dt.itemsize
+        raw = bitstream.read('bytes:{nbytes}'.format(nbytes=nbytes))
+        return frombuffer(raw, dtype=dt, count=length)
 
     def array(self, length, type, bitstream=None):
         """
         Reads an array of the specified type from the specified
         bitstream or stored bitstream if none is given. Returns the
-        read values in a list of the specified length.
+        read values in a 1D NumPy array of the specified length.
         """
         if bitstream is None:
             bitstream = self.bitstream
@@ -541,51 +396,112 @@ class HKEBinaryReader(object):
         return a
 
 
-class Header(RegisterFrameDescription):
-    """
-    The HKE binary data file header.
-
-    Currently this contains only the RegisterFrameDescription. As
-    such, it's being made transparent. If other objects are added to
-    the header, this class should be rewritten.
-    """
-    def __init__(self, hkebreader):
-        RegisterFrameDescription.__init__(self, hkebreader)
-
-
 class Data(object):
     """
     The HKE binary data file data.
 
     Contains a series of RegisterFrames.
-    """
-    def __init__(self, header):
-        self.filename = header.filename
-        self.header = header
-        f = open(self.filename, 'rb')
-        # This is a HUGE hack. Should really do this in RegFrameDesc...
-        self.header.rawheader = f.read(self.header.endpos/8)
-        # f.seek(self.header.endpos/8)
 
-        self.dt = self.dtype_from_rfd(self.header)
-        self.data = fromfile(f, self.dt)
+    If mmap is True, the frames are not read into memory. Instead
+    self.data is a read-only numpy.memmap over the frame section of
+    the file, so only the pages backing the registers and frames that
+    are actually accessed are ever read from disk.
 
-    def dtype_from_rfd(self, rfd):
+    dt may be given to reuse an already built frame dtype (e.g. one
+    loaded from a HKEBinaryCache.HeaderCache) instead of building it
+    from the header. It defaults to header.dtype, which headers shared
+    through intern_header carry.
+    """
+    def __init__(self, header, filename, mmap=False, dt=None):
+        self.filename = filename
+        self.header = header
+        self.mmap = mmap
+
+        if dt is None:
+            dt = header.dtype
+        if dt is None:
+            with stage('dtype_build'):
+                dt = self.dtype_from_rfd(self.header)
+        self.dt = dt
+        self._buffer = None
+        with stage('data_load') as s:
+            if self.mmap:
+                self.data = self.map_frames()
+            else:
+                with open(self.filename, 'rb') as f:
+                    f.seek(len(self.header.rawheader))
+                    self.data = fromfile(f, self.dt)
+                s.nbytes = self.data.nbytes
+
+    def map_frames(self):
+        """
+        Return a read-only numpy.memmap of all of the whole frames in
+        the file. A trailing partial frame is not mapped.
+        """
+        offset = len(self.header.rawheader)
+        filesize = os.path.getsize(self.filename)
+        datanum = (filesize - offset)//self.dt.itemsize
+        if datanum <= 0:
+            # mmap refuses to map zero bytes
+            return zeros(0, dtype=self.dt)
+        return memmap(self.filename, dtype=self.dt, mode='r',
+                      offset=offset, shape=(datanum,))
+
+    def refresh(self):
+        """
+        Pick up whole frames that have been appended to the file since
+        it was last read, e.g. while the HKE acquisition system is
+        still writing it. A trailing partial frame is left alone until
+        it is complete. Returns the number of new frames.
+
+        In mmap mode the file is simply remapped. Otherwise only the
+        new frames are read, into a buffer that grows geometrically so
+        that repeated refreshes cost time proportional to the new data
+        only. self.data is always replaced rather than modified, so
+        arrays previously taken from it remain valid.
+        """
+        offset = len(self.header.rawheader)
+        itemsize = self.dt.itemsize
+        filesize = os.path.getsize(self.filename)
+        datanum = (filesize - offset)//itemsize
+        old = len(self.data)
+        if datanum <= old:
+            return 0
+
+        if self.mmap:
+            self.data = self.map_frames()
+            return len(self.data) - old
+
+        if (self._buffer is None) or (len(self._buffer) < datanum):
+            buf = empty(max(datanum, 2*old), dtype=self.dt)
+            buf[:old] = self.data
+            self._buffer = buf
+        with open(self.filename, 'rb') as f:
+            f.seek(offset + old*itemsize)
+            new = fromfile(f, self.dt, count=datanum - old)
+        self._buffer[old:old + len(new)] = new
+        self.data = self._buffer[:old + len(new)]
+        return len(new)
+
+    @classmethod
+    def dtype_from_rfd(cls, rfd):
         dta = [('magic', 'S1'), ('framecount', 'u4'),
                ('framereceivedms', 'u4')]
         for bd in rfd.boarddescriptions:
-            toadd = self.dtype_from_bd(bd)
+            toadd = cls.dtype_from_bd(bd)
             dta.extend(toadd)
         return dtype(dta)
 
-    def dtype_from_bd(self, bd):
+    @classmethod
+    def dtype_from_bd(cls, bd):
         dta = []
         for rd in bd.registerdescriptions:
-            toadd = self.dtype_from_rd(rd)
+            toadd = cls.dtype_from_rd(rd)
             dta.extend(toadd)
         return dta
 
-    def dtype_from_rd(self, rd):
+    @classmethod
+    def dtype_from_rd(cls, rd):
         rtypedict = {0: 'u1', 1: 'u2', 2: 'u4', 3: 'f4', 4: 'i2',
                      5: 'i4'}
 
@@ -604,65 +520,212 @@ class Data(object):
 
 
 
-class HKEBinaryError(Exception):
+def load_header(filename, cache=None):
     """
-    Exception class for handling errors unique to working with the HKE
-    binary files.
+    Return the Header of the HKE binary file filename, with its frame
+    dtype, shared with every other file with the same configuration
+    (see HKEBinaryHeader.intern_header).
+
+    A header already in use in the process is recognized from the
+    first bytes of the file without parsing it. Otherwise it is taken
+    from cache (a HKEBinaryCache.HeaderCache) if given and it has an
+    entry, or else parsed, and then interned.
     """
-    pass
-
-
-class HKEMagicError(HKEBinaryError):
+    with open(filename, 'rb') as f:
+        prefix = f.read(HKEBufferReader.blocksize)
+    header = find_header(prefix)
+    if header is not None:
+        return header
+
+    cached = None
+    if cache is not None:
+        cached = cache.load(filename)
+    if cached is not None:
+        header, dt = cached
+        return intern_header(header, dt)
+
+    with stage('header_parse') as s:
+        reader = HKEBufferReader(filename=filename)
+        header = Header(reader)
+        reader.close()
+        s.nbytes = len(header.rawheader)
+    with stage('dtype_build'):
+        dt = Data.dtype_from_rfd(header)
+    header = intern_header(header, dt)
+    if cache is not None:
+        cache.store(filename, header, header.dtype)
+    return header
+
+
+class GapIndex(object):
     """
-    An incorrect magic character was encountered.
+    An index of the discontinuities in a series of HKE frames.
+
+    Discontinuities are found from the framecount and framereceivedms
+    fields of consecutive frames. Four kinds are recognized:
+
+        GAP - framecount skipped ahead; frames were dropped
+        DUPLICATE - framecount did not change; a frame was repeated
+        RESET - framecount went backwards; the counter was reset,
+            e.g. because the acquisition system restarted
+        TIMEJUMP - the time between the frames was more than
+            timejumpfactor times the nominal frame interval, or
+            negative
+
+    The index is built incrementally with self.update, one chunk of
+    consecutive frames at a time, so it can be built in bounded memory
+    and extended as frames are appended to a file.
+
+    Attributes:
+        frames - (int64 array) the frame just after each
+            discontinuity, in increasing order
+        kinds - (int8 array) the kind of each discontinuity
+        sizes - (int64 array) for a GAP, the number of dropped frames;
+            for a TIMEJUMP, the time step in milliseconds; otherwise 0
+        datanum - (int) number of frames indexed so far
+
+    Arguments:
+        timedirection - (int) 1 if the framereceivedms counter counts
+            up, -1 if it counts down.
+        timeinterval - (int) nominal frame interval, in milliseconds.
+            If 0, only negative time steps are treated as jumps.
+        timejumpfactor - (float) see TIMEJUMP above.
     """
-    pass
-
-
-class HKEBitstreamError(HKEBinaryError):
-    """
-    There was an error in the bitstream to be read.
-    """
-    pass
-
-
-class HKEInvalidRegisterError(HKEBinaryError):
-    """
-    User tried to access an invalid register.
-    """
-    def __init__(self, rname):
-        self.rname = rname
-        self.msg = ("Invalid register specifier:"
-                    " {0}".format(self.rname))
-
-    def __str__(self):
-        return self.msg
-
-
-# def entrypoint():
-#     s = BitStream(filename='hke_20120323_000.dat')
-
-#     header = Header(s)
-#     data = Data(s, header)
-
-# def entrypoint2():
-#     s = BitStream(filename='hke_20120323_000.dat')
-#     h = HKEBinaryReader(bitstream=s)
-#     header = Header(h)
-#     data = Data(h, header)
-#     return s, h, header, data
-
-# def runprofiling(entrypoint):
-#     import cProfile
-#     import pstats
-#     name = entrypoint.__name__
-#     tocall = name + '()'
-#     cProfile.run(tocall, 'tempprof')
-#     p = pstats.Stats('tempprof')
-#     p.strip_dirs()
-#     p.sort_stats('time')
-#     p.print_stats(15)
-#     return p
-
-# # if __name__ == '__main__':
-# #     p = runprofiling(entrypoint2)
+    GAP = 1
+    DUPLICATE = 2
+    RESET = 3
+    TIMEJUMP = 4
+    kindnames = {GAP: 'gap', DUPLICATE: 'duplicate', RESET: 'reset',
+                 TIMEJUMP: 'timejump'}
+
+    def __init__(self, timedirection=1, timeinterval=0,
+                 timejumpfactor=2.):
+        self.timedirection = timedirection
+        self.timeinterval = timeinterval
+        self.timejumpfactor = timejumpfactor
+        self.frames = zeros(0, dtype=int64)
+        self.kinds = zeros(0, dtype=int8)
+        self.sizes = zeros(0, dtype=int64)
+        self.datanum = 0
+        self._last = None
+
+    def __len__(self):
+        return len(self.frames)
+
+    def __iter__(self):
+        for frame, kind, size in zip(self.frames, self.kinds, self.sizes):
+            yield int(frame), self.kindnames[kind], int(size)
+
+    def update(self, framecount, framereceivedms):
+        """
+        Index the next chunk of frames, given their framecount and
+        framereceivedms fields. The chunk must directly follow the
+        frames already indexed.
+        """
+        framecount = asarray(framecount).astype(int64)
+        received = asarray(framereceivedms).astype(int64)
+        if len(framecount) == 0:
+            return
+        offset = self.datanum - 1
+        if self._last is not None:
+            framecount = concatenate([[self._last[0]], framecount])
+            received = concatenate([[self._last[1]], received])
+        else:
+            offset += 1
+        self.datanum += len(framecount) - (self._last is not None)
+        self._last = (framecount[-1], received[-1])
+
+        dcount = (diff(framecount) + 2**31) % 2**32 - 2**31
+        dtime = (diff(received) + 2**31) % 2**32 - 2**31
+        dtime *= self.timedirection
+
+        frames = []
+        kinds = []
+        sizes = []
+
+        def add(mask, kind, size):
+            where = nonzero(mask)[0]
+            frames.append(where + offset + 1)
+            kinds.append(full(len(where), kind, dtype=int8))
+            sizes.append(size[where])
+
+        nosize = zeros(len(dcount), dtype=int64)
+        add(dcount > 1, self.GAP, dcount - 1)
+        add(dcount == 0, self.DUPLICATE, nosize)
+        add(dcount < 0, self.RESET, nosize)
+        if self.timeinterval > 0:
+            jumps = ((dtime < 0) |
+                     (dtime > self.timejumpfactor*self.timeinterval))
+        else:
+            jumps = dtime < 0
+        add(jumps, self.TIMEJUMP, dtime)
+
+        frames = concatenate(frames)
+        order = argsort(frames, kind='mergesort')
+        self.frames = concatenate([self.frames, frames[order]])
+        self.kinds = concatenate([self.kinds, concatenate(kinds)[order]])
+        self.sizes = concatenate([self.sizes, concatenate(sizes)[order]])
+
+    def select(self, kind=None, start=None, stop=None):
+        """
+        Returns the frames (see the class docstring) of the
+        discontinuities of the given kind (all kinds if None) that
+        lie between frames start and stop, i.e. start < frame < stop.
+        kind may be a kind constant or name, or a list of them.
+        """
+        mask = self._mask(kind, start, stop)
+        return self.frames[mask]
+
+    def _mask(self, kind=None, start=None, stop=None):
+        mask = ones(len(self.frames), dtype=bool)
+        if kind is not None:
+            if not isinstance(kind, (list, tuple)):
+                kind = [kind]
+            codes = [self._kindcode(k) for k in kind]
+            mask &= in1d(self.kinds, codes)
+        if start is not None:
+            mask &= self.frames > start
+        if stop is not None:
+            mask &= self.frames < stop
+        return mask
+
+    def _kindcode(self, kind):
+        for code, name in self.kindnames.items():
+            if kind in (code, name):
+                return code
+        raise HKEBinaryError("Invalid discontinuity kind: "
+                             "{0}".format(kind))
+
+    def dropped(self, start=None, stop=None):
+        """
+        Returns the total number of frames dropped between frames
+        start and stop.
+        """
+        mask = self._mask(self.GAP, start, stop)
+        return int(self.sizes[mask].sum())
+
+    def segments(self, start=None, stop=None,
+                 kinds=(GAP, RESET, TIMEJUMP)):
+        """
+        Returns a list of (segstart, segstop) tuples splitting frames
+        start through stop (not including stop) into continuous
+        segments, broken at the discontinuities of the given kinds.
+        """
+        if start is None:
+            start = 0
+        if stop is None:
+            stop = self.datanum
+        breaks = unique(self.select(kinds, start, stop))
+        edges = concatenate([[start], breaks, [stop]])
+        return [(int(a), int(b)) for a, b in zip(edges[:-1], edges[1:])
+                if b > a]
+
+    def summary(self):
+        """
+        Returns a dictionary with the number of discontinuities of
+        each kind and the total number of dropped frames.
+        """
+        summary = dict((name, int((self.kinds == code).sum()))
+                       for code, name in self.kindnames.items())
+        summary['dropped'] = self.dropped()
+        return summary
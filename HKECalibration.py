@@ -0,0 +1,236 @@
+#!/bin/env python
+"""
+HKECalibration.py - Calibration curves (e.g. thermometer T-R tables)
+for converting HKE register data to physical units.
+
+A calibration table is a text file with two columns, the calibrated
+value (e.g. temperature) and the raw value (e.g. resistance), one
+point per line, with '#' comment lines. A '#UNITS = <units>' comment
+gives the units of the calibrated value. Tables are named after the
+channel tag of the channel they calibrate, e.g. U02728.txt.
+
+Tables are parsed and validated once per process and then shared.
+Calibration objects interpolate linearly between the points of the
+table, a block of values at a time, by binary search.
+PolynomialCalibration objects evaluate a fitted polynomial instead.
+
+Example usage:
+    cal = load_calibration('U02728.txt')
+    Ts = cal(Rs)
+
+    f = HKEBinaryFile('hke_20120615_001.dat')
+    Ts = f.get_data(0, calibrate=True)
+"""
+
+import os
+
+from HKEBinaryLibrary import HKECalibrationError
+from numpy import *
+
+
+class Calibration(object):
+    """
+    A calibration curve mapping raw values x to calibrated values y by
+    piecewise linear interpolation.
+
+    Arguments:
+        x, y - (array-like) the points of the curve. They are sorted
+            by x, and x may not contain duplicates.
+        bounds - (str) what to do with raw values outside the range of
+            x: 'nan' (default) returns NaN, 'clip' returns the value at
+            the nearest end of the curve, 'extrapolate' extends the end
+            segments of the curve and 'error' raises
+            HKECalibrationError.
+        name - (str) name of the curve, e.g. the channel tag.
+        units - (str) units of the calibrated values.
+    """
+    boundsoptions = ('nan', 'clip', 'extrapolate', 'error')
+
+    def __init__(self, x, y, bounds='nan', name=None, units=None):
+        x = asarray(x, dtype=float64)
+        y = asarray(y, dtype=float64)
+        label = '' if (name is None) else ' ' + name
+        if (x.ndim != 1) or (x.shape != y.shape) or (len(x) < 2):
+            raise HKECalibrationError("A calibration curve needs two "
+                                      "1D arrays of at least 2 points.")
+        if not (isfinite(x).all() and isfinite(y).all()):
+            raise HKECalibrationError("Calibration curve{0} has "
+                                      "non-finite points.".format(label))
+        if bounds not in self.boundsoptions:
+            raise HKECalibrationError("Invalid bounds option: "
+                                      "{0}".format(bounds))
+        order = argsort(x, kind='mergesort')
+        x = x[order]
+        y = y[order]
+        if (diff(x) <= 0).any():
+            raise HKECalibrationError("Calibration curve{0} has "
+                                      "duplicate points.".format(label))
+        self.x = x
+        self.y = y
+        self.slopes = diff(y)/diff(x)
+        self.bounds = bounds
+        self.name = name
+        self.units = units
+
+    def __call__(self, values, out=None, blocksize=65536):
+        """
+        Return the calibrated values of the array values, as a float64
+        array of the same shape. If out is given, the result is
+        written to it instead.
+
+        values are converted blocksize rows at a time, so the
+        temporaries are bounded by the block size.
+        """
+        values = asarray(values)
+        if out is None:
+            out = empty(values.shape, dtype=float64)
+        if values.ndim == 0:
+            out[()] = self._interpolate(values.reshape(1))[0]
+            return out
+        blocksize = max(int(blocksize), 1)
+        for start in range(0, len(values), blocksize):
+            stop = start + blocksize
+            out[start:stop] = self._interpolate(values[start:stop])
+        return out
+
+    def _interpolate(self, v):
+        """
+        Interpolate a block of values.
+        """
+        x = self.x
+        v = v.astype(float64)
+        outside = (v < x[0]) | (v > x[-1])
+        if outside.any():
+            if self.bounds == 'error':
+                raise HKECalibrationError("Values outside the range of "
+                                          "calibration curve "
+                                          "{0}.".format(self.name))
+            elif self.bounds == 'clip':
+                clip(v, x[0], x[-1], out=v)
+        i = searchsorted(x, v, side='right') - 1
+        clip(i, 0, len(x) - 2, out=i)
+        result = self.y[i] + (v - x[i])*self.slopes[i]
+        if self.bounds == 'nan':
+            result[outside] = nan
+        return result
+
+
+class PolynomialCalibration(Calibration):
+    """
+    A calibration curve given by a polynomial in the raw values x,
+    e.g. a fit to the points of a thermometer table.
+
+    Arguments:
+        coefficients - (array-like) the coefficients of the
+            polynomial, highest power first, as for numpy.polyval.
+        domain - (pair) the range of raw values over which the
+            polynomial is valid. Defaults to all values.
+        bounds - (str) what to do with raw values outside domain, as
+            for Calibration. 'extrapolate' evaluates the polynomial
+            anyway.
+        name, units - as for Calibration.
+    """
+    def __init__(self, coefficients, domain=None, bounds='nan', name=None,
+                 units=None):
+        coefficients = asarray(coefficients, dtype=float64)
+        label = '' if (name is None) else ' ' + name
+        if (coefficients.ndim != 1) or (len(coefficients) < 1):
+            raise HKECalibrationError("A polynomial calibration needs a "
+                                      "1D array of coefficients.")
+        if domain is None:
+            domain = (-inf, inf)
+        domain = asarray(domain, dtype=float64)
+        if not (isfinite(coefficients).all() and (domain.shape == (2,)) and
+                (domain[0] < domain[1])):
+            raise HKECalibrationError("Polynomial calibration{0} has "
+                                      "invalid coefficients or "
+                                      "domain.".format(label))
+        if bounds not in self.boundsoptions:
+            raise HKECalibrationError("Invalid bounds option: "
+                                      "{0}".format(bounds))
+        self.coefficients = coefficients
+        self.domain = domain
+        self.bounds = bounds
+        self.name = name
+        self.units = units
+
+    def _interpolate(self, v):
+        """
+        Evaluate the polynomial for a block of values.
+        """
+        lo, hi = self.domain
+        v = v.astype(float64)
+        outside = (v < lo) | (v > hi)
+        if outside.any():
+            if self.bounds == 'error':
+                raise HKECalibrationError("Values outside the domain of "
+                                          "calibration curve "
+                                          "{0}.".format(self.name))
+            elif self.bounds == 'clip':
+                clip(v, lo, hi, out=v)
+        result = polyval(self.coefficients, v)
+        if self.bounds == 'nan':
+            result[outside] = nan
+        return result
+
+
+# (absolute path, size, mtime, bounds): Calibration
+_calibrations = {}
+
+
+def load_calibration(path, bounds='nan'):
+    """
+    Load, validate and return the calibration table in the file path
+    as a Calibration (see the module docstring for the format and
+    Calibration for bounds).
+
+    Parsed tables are kept for the rest of the process, so loading the
+    same unchanged file again costs only a stat.
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        raise HKECalibrationError("No calibration table "
+                                  "{0}".format(path))
+    key = (os.path.abspath(path), st.st_size, st.st_mtime, bounds)
+    try:
+        return _calibrations[key]
+    except KeyError:
+        pass
+
+    units = None
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if line.startswith('#') and ('=' in line):
+                name, value = line[1:].split('=', 1)
+                if name.strip().upper() == 'UNITS':
+                    units = value.strip()
+    try:
+        table = loadtxt(path, ndmin=2)
+    except ValueError as e:
+        raise HKECalibrationError("Invalid calibration table "
+                                  "{0}: {1}".format(path, e))
+    if table.shape[1] != 2:
+        raise HKECalibrationError("Calibration table {0} must have 2 "
+                                  "columns.".format(path))
+    name = os.path.splitext(os.path.basename(path))[0]
+    y, x = table.T
+    calibration = Calibration(x, y, bounds=bounds, name=name, units=units)
+    _calibrations[key] = calibration
+    return calibration
+
+
+def find_calibration(chtag, directories, extension='.txt'):
+    """
+    Return the path of the calibration table for the channel tag
+    chtag, i.e. the first file named <chtag><extension> in
+    directories, or None if there is none.
+    """
+    if not chtag:
+        return None
+    for directory in directories:
+        path = os.path.join(directory, chtag + extension)
+        if os.path.isfile(path):
+            return path
+    return None
@@ -0,0 +1,430 @@
+#!/bin/env python
+"""
+HKECatalog.py - A SQLite catalog of an archive of HKE binary files.
+
+The catalog records, for every file in a directory tree, its size and
+modification time, the hash of its header, the boards and registers
+in it (stored once per distinct header), its start and stop times,
+the framereceivedms counters of its first and last frames, its number
+of frames and a summary of its gaps (see HKEBinaryFile.get_gaps).
+
+Updating the catalog only indexes files that are new or whose size or
+modification time changed, so keeping it current is cheap. Queries
+find the files holding a register in a time window from the catalog
+alone, and then the exact frame ranges from the time index of only
+those files.
+
+Times in the catalog are seconds since the epoch, taken from the
+timestamp in the header of each file (with no time zone conversion)
+plus the time of each frame since the first frame of the file.
+
+Example usage:
+    c = Catalog('archive.db')
+    c.update('/data/hke')
+    for fname, start, stop in c.find('ADR Root coil (1-DSPID): Demod',
+                                     '2012-06-15 12:30:00',
+                                     '2012-06-15 13:00:00'):
+        f = HKEBinaryFile(fname, mmap=True)
+        Rs = f.get_data(0, frames=slice(start, stop))
+
+    python HKECatalog.py update archive.db /data/hke
+    python HKECatalog.py query archive.db 1-Demod --t-start \
+        '2012-06-15 12:30:00' --t-stop '2012-06-15 13:00:00'
+"""
+
+import sys
+import os
+import json
+import fnmatch
+import sqlite3
+import argparse
+import calendar
+from datetime import datetime
+from multiprocessing import Pool, cpu_count
+
+from HKEBinaryFile import HKEBinaryFile
+from HKEBinaryCache import header_hash
+from HKEBinaryLibrary import HKEBinaryError
+
+_schema = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    size INTEGER,
+    mtime REAL,
+    headerhash TEXT,
+    timestamp TEXT,
+    start REAL,
+    stop REAL,
+    frames INTEGER,
+    firstms INTEGER,
+    lastms INTEGER,
+    dropped INTEGER,
+    gaps TEXT,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS files_time ON files (start, stop);
+CREATE INDEX IF NOT EXISTS files_header ON files (headerhash);
+CREATE TABLE IF NOT EXISTS headers (
+    hash TEXT PRIMARY KEY,
+    boards TEXT
+);
+CREATE TABLE IF NOT EXISTS registers (
+    headerhash TEXT,
+    idx INTEGER,
+    name TEXT,
+    columnname TEXT,
+    PRIMARY KEY (headerhash, idx)
+);
+CREATE INDEX IF NOT EXISTS registers_name ON registers (name);
+CREATE INDEX IF NOT EXISTS registers_columnname ON registers (columnname);
+"""
+
+_timeformats = ('%Y-%m-%d %H:%M:%S.%f', '%Y-%m-%d %H:%M:%S')
+
+
+def to_seconds(t):
+    """
+    Convert the time t to seconds since the epoch. t may be a number
+    (taken to be seconds since the epoch already), a datetime, or a
+    str in the format of the header timestamps, e.g. '2012-06-15
+    12:23:18.615'. None is returned as is.
+    """
+    if (t is None) or isinstance(t, (int, long, float)):
+        return t
+    if isinstance(t, (str, unicode)):
+        for fmt in _timeformats:
+            try:
+                t = datetime.strptime(t, fmt)
+                break
+            except ValueError:
+                pass
+        else:
+            raise HKEBinaryError("Invalid time: {0}".format(t))
+    return calendar.timegm(t.timetuple()) + t.microsecond/1e6
+
+
+def index_file(fname, cache=True):
+    """
+    Read the catalog information of the HKE binary file fname. Returns
+    a dict of the columns of its row in the files table, plus its
+    boards and registers (a list of (name, columnname) pairs). cache
+    is passed on to HKEBinaryFile.
+    """
+    st = os.stat(fname)
+    f = HKEBinaryFile(fname, mmap=True, cache=cache, columns=False,
+                      cachebytes=0)
+    info = {'path': fname, 'size': st.st_size, 'mtime': st.st_mtime,
+            'headerhash': header_hash(f.header.rawheader),
+            'timestamp': f.header.timestamp, 'frames': f.datanum,
+            'boards': list(f.list_boards()),
+            'registers': [(name, rd.columnname) for name, rd
+                          in zip(f.list_registers(),
+                                 f.registerdescriptionlist)],
+            'error': None}
+    try:
+        start = to_seconds(f.header.timestamp)
+    except HKEBinaryError:
+        start = None
+    info['start'] = info['stop'] = start
+    info['firstms'] = info['lastms'] = None
+    info['dropped'] = 0
+    info['gaps'] = None
+    if f.datanum:
+        ms = f._read_field('framereceivedms', 0, 1)
+        info['firstms'] = int(ms[0])
+        info['lastms'] = int(f._read_field('framereceivedms',
+                                           f.datanum - 1, f.datanum)[0])
+        if start is not None:
+            info['stop'] = start + f.get_times()[-1]/1e3
+        gaps = f.get_gaps().summary()
+        info['dropped'] = gaps['dropped']
+        info['gaps'] = json.dumps(gaps, sort_keys=True)
+    return info
+
+
+def _index(task):
+    """
+    index_file for the worker processes, given a tuple (fname,
+    cache): errors are returned in the info instead of raised, so
+    that one bad file does not stop an update.
+    """
+    fname, cache = task
+    try:
+        return index_file(fname, cache)
+    except (HKEBinaryError, IOError, OSError, ValueError) as e:
+        try:
+            st = os.stat(fname)
+            size, mtime = st.st_size, st.st_mtime
+        except OSError:
+            size = mtime = None
+        return {'path': fname, 'size': size, 'mtime': mtime,
+                'error': str(e) or type(e).__name__}
+
+
+class Catalog(object):
+    """
+    A SQLite catalog of HKE binary files (see the module docstring).
+
+    Arguments:
+        path - (str) the catalog database file; created if it does
+            not exist. ':memory:' gives a temporary in-memory catalog.
+        fileoptions - (dict) keyword arguments passed to HKEBinaryFile
+            when files are opened to answer queries. Defaults to
+            mmap=True.
+    """
+    def __init__(self, path, fileoptions=None):
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.executescript(_schema)
+        self.fileoptions = {'mmap': True}
+        if fileoptions:
+            self.fileoptions.update(fileoptions)
+
+    def close(self):
+        self.db.close()
+
+    def update(self, root, pattern='hke_*.dat', workers=None, prune=True,
+               cache=True):
+        """
+        Bring the catalog up to date with the files matching pattern
+        in the directory tree root: index the files that are not in
+        the catalog or whose size or modification time changed, on a
+        pool of workers processes (default: the number of CPUs). If
+        prune, files under root that no longer exist are removed from
+        the catalog. cache is passed on to HKEBinaryFile when the
+        files are indexed; False keeps their headers out of the
+        on-disk header cache.
+
+        Files that cannot be read are recorded with their error (see
+        self.errors) and retried once they change.
+
+        Returns a tuple (indexed, removed) of the number of files
+        indexed and removed.
+        """
+        root = os.path.abspath(root)
+        # The paths under root are those between root + sep and
+        # root + the character after sep, compared byte for byte, so
+        # that no other directory whose name starts with that of root
+        # is included.
+        prefix = os.path.join(root, '')
+        known = dict((row[0], (row[1], row[2])) for row in self.db.execute(
+            "SELECT path, size, mtime FROM files WHERE path = ? OR "
+            "(path > ? AND path < ?)",
+            (root, prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1))))
+        found = set()
+        todo = []
+        for dirpath, dirnames, filenames in os.walk(root):
+            for name in fnmatch.filter(filenames, pattern):
+                fname = os.path.join(dirpath, name)
+                found.add(fname)
+                try:
+                    st = os.stat(fname)
+                except OSError:
+                    continue
+                if known.get(fname) != (st.st_size, st.st_mtime):
+                    todo.append(fname)
+        todo.sort()
+        tasks = [(fname, cache) for fname in todo]
+
+        if workers is None:
+            workers = cpu_count()
+        if (workers > 1) and (len(todo) > 1):
+            pool = Pool(min(workers, len(todo)))
+            infos = pool.imap_unordered(_index, tasks, chunksize=4)
+        else:
+            pool = None
+            infos = (_index(task) for task in tasks)
+        try:
+            with self.db:
+                for info in infos:
+                    self._store(info)
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+
+        removed = 0
+        if prune:
+            gone = [(path,) for path in known if path not in found]
+            with self.db:
+                self.db.executemany("DELETE FROM files WHERE path = ?", gone)
+                self._prune_headers()
+            removed = len(gone)
+        return len(todo), removed
+
+    def _store(self, info):
+        """
+        Store the info of one file, as returned by index_file.
+        """
+        if info.get('error') is None:
+            h = info['headerhash']
+            known = self.db.execute("SELECT 1 FROM headers WHERE hash = ?",
+                                    (h,)).fetchone()
+            if known is None:
+                self.db.execute("INSERT INTO headers VALUES (?, ?)",
+                                (h, json.dumps(info['boards'])))
+                self.db.executemany(
+                    "INSERT INTO registers VALUES (?, ?, ?, ?)",
+                    [(h, i, name, columnname) for i, (name, columnname)
+                     in enumerate(info['registers'])])
+        columns = ('path', 'size', 'mtime', 'headerhash', 'timestamp',
+                   'start', 'stop', 'frames', 'firstms', 'lastms',
+                   'dropped', 'gaps', 'error')
+        self.db.execute(
+            "INSERT OR REPLACE INTO files VALUES ({0})".format(
+                ', '.join('?'*len(columns))),
+            [info.get(c) for c in columns])
+
+    def _prune_headers(self):
+        """
+        Remove the headers no file refers to any more.
+        """
+        self.db.execute("DELETE FROM registers WHERE headerhash NOT IN "
+                        "(SELECT headerhash FROM files)")
+        self.db.execute("DELETE FROM headers WHERE hash NOT IN "
+                        "(SELECT headerhash FROM files)")
+
+    def files(self, register=None, t_start=None, t_stop=None):
+        """
+        Returns a list of dicts of the catalog rows of the files that
+        contain register (a full register name, as in
+        HKEBinaryFile.list_registers, or a column name, e.g.
+        '1-Demod'; None matches every file) and overlap the time
+        window t_start <= t < t_stop (see to_seconds; None means
+        unbounded), in order of start time. Each dict also holds the
+        full name of the register in the file, under the key
+        'register'.
+        """
+        t_start = to_seconds(t_start)
+        t_stop = to_seconds(t_stop)
+        if register is None:
+            sql = "SELECT f.*, NULL FROM files f WHERE f.error IS NULL"
+            args = []
+        else:
+            sql = ("SELECT f.*, r.name FROM files f JOIN registers r ON "
+                   "r.headerhash = f.headerhash WHERE f.error IS NULL AND "
+                   "(r.name = ? OR r.columnname = ?)")
+            args = [register, register]
+        if t_start is not None:
+            sql += " AND f.stop >= ?"
+            args.append(t_start)
+        if t_stop is not None:
+            sql += " AND f.start < ?"
+            args.append(t_stop)
+        sql += " ORDER BY f.start, f.path"
+        cursor = self.db.execute(sql, args)
+        names = [d[0] for d in cursor.description[:-1]] + ['register']
+        return [dict(zip(names, row)) for row in cursor]
+
+    def _ranges(self, register, t_start, t_stop):
+        """
+        A helper function that yields a tuple (row, f, start, stop)
+        for every file holding frames of register in the time window,
+        with its catalog row (see self.files), the opened file f and
+        the frame range start through stop.
+        """
+        t_start = to_seconds(t_start)
+        t_stop = to_seconds(t_stop)
+        for row in self.files(register, t_start, t_stop):
+            f = self.open(row['path'])
+            start, stop = f.frames_for_time(
+                None if t_start is None else (t_start - row['start'])*1e3,
+                None if t_stop is None else (t_stop - row['start'])*1e3)
+            if stop > start:
+                yield row, f, start, stop
+
+    def find(self, register, t_start=None, t_stop=None):
+        """
+        Returns a list of tuples (filename, start, stop) of the files
+        containing register and the frames start through stop (not
+        including stop) of each that fall in the time window t_start
+        <= t < t_stop (see self.files), e.g. to be read with
+        HKEBinaryFile.get_data(..., frames=slice(start, stop)).
+
+        The frame ranges are exact: they are found with
+        HKEBinaryFile.frames_for_time, for which only the candidate
+        files are opened.
+        """
+        return [(row['path'], start, stop) for row, f, start, stop
+                in self._ranges(register, t_start, t_stop)]
+
+    def open(self, fname):
+        """
+        Open the file fname of the catalog as an HKEBinaryFile, with
+        self.fileoptions.
+        """
+        return HKEBinaryFile(fname, **self.fileoptions)
+
+    def get_data(self, register, t_start=None, t_stop=None, **kwargs):
+        """
+        Returns a list of tuples (filename, data) of the data of
+        register in the time window t_start <= t < t_stop from every
+        file holding some (see self.find). kwargs are passed on to
+        HKEBinaryFile.get_data.
+        """
+        return [(row['path'], f.get_data(row['register'],
+                                         frames=slice(start, stop),
+                                         **kwargs))
+                for row, f, start, stop
+                in self._ranges(register, t_start, t_stop)]
+
+    def registers(self):
+        """
+        Returns a sorted list of the full names of all the registers in
+        the catalog.
+        """
+        return [row[0] for row in self.db.execute(
+            "SELECT DISTINCT name FROM registers ORDER BY name")]
+
+    def errors(self):
+        """
+        Returns a list of (path, error) of the files that could not be
+        indexed.
+        """
+        return list(self.db.execute(
+            "SELECT path, error FROM files WHERE error IS NOT NULL "
+            "ORDER BY path"))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Maintain and query a catalog of HKE binary files.")
+    sub = parser.add_subparsers(dest='command')
+    p = sub.add_parser('update', help="index new and changed files")
+    p.add_argument('catalog', help="catalog database file")
+    p.add_argument('root', help="directory tree of HKE binary files")
+    p.add_argument('-p', '--pattern', default='hke_*.dat',
+                   help="file name pattern (default: hke_*.dat)")
+    p.add_argument('-j', '--workers', type=int, default=None,
+                   help="worker processes (default: # of CPUs)")
+    p.add_argument('--no-cache', action='store_false', dest='cache',
+                   help="do not use the on-disk header cache")
+    p = sub.add_parser('query', help="find the frames of a register in a "
+                                     "time window")
+    p.add_argument('catalog', help="catalog database file")
+    p.add_argument('register', help="full register name or column name")
+    p.add_argument('--t-start', default=None,
+                   help="start time, e.g. '2012-06-15 12:30:00'")
+    p.add_argument('--t-stop', default=None,
+                   help="stop time, e.g. '2012-06-15 13:00:00'")
+    args = parser.parse_args(argv)
+
+    c = Catalog(args.catalog)
+    try:
+        if args.command == 'update':
+            indexed, removed = c.update(args.root, args.pattern,
+                                        args.workers, cache=args.cache)
+            sys.stdout.write('{0} files indexed, {1} removed\n'.format(
+                indexed, removed))
+            for path, error in c.errors():
+                sys.stdout.write('ERROR {0}: {1}\n'.format(path, error))
+        else:
+            for fname, start, stop in c.find(args.register, args.t_start,
+                                             args.t_stop):
+                sys.stdout.write('{0} {1} {2}\n'.format(fname, start, stop))
+    finally:
+        c.close()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
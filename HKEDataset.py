@@ -0,0 +1,324 @@
+#!/bin/env python
+"""
+HKEDataset.py - Tools for working with runs of many sequential HKE
+binary files (e.g. hke_20120615_001.dat, hke_20120615_002.dat, ...):
+a class that presents them as a single dataset, and a parallel bulk
+loader.
+
+Example usage:
+    d = HKEDataset('hke_20120615_*.dat')
+    d.list_registers()
+    RTs = d.get_data(0).flatten()
+    Rs = d.get_data(-6, start=1000, stop=5000)[...,1]
+
+    RTs = load_many('hke_201206*.dat', 0, workers=8)
+"""
+
+import glob
+from multiprocessing import Pool, cpu_count
+from multiprocessing.pool import ThreadPool
+
+from HKEBinaryFile import HKEBinaryFile
+from HKEBinaryLibrary import HKEBinaryError, HKEIncompatibleFilesError
+from numpy import *
+
+
+class HKEDataset:
+    """
+    A class representing a sequence of HKE binary files with the same
+    frame layout as one long series of frames.
+
+    The files are opened memory-mapped and are never concatenated.
+    Frames are numbered globally, from 0 in the first frame of the
+    first file to self.datanum - 1 in the last frame of the last file,
+    and requests are served by reading only the relevant frame ranges
+    of the relevant files straight into the output array.
+
+    Arguments:
+        files - (str or list) a glob pattern matching the files (which
+            are then taken in sorted order), or a list of filenames in
+            the order they should be concatenated.
+        mmap - (bool) passed on to HKEBinaryFile. Default is True.
+        cache - passed on to HKEBinaryFile.
+
+    Raises HKEIncompatibleFilesError if the files do not all have the
+    same frame dtype and registers.
+
+    Example usage:
+    d = HKEDataset('hke_20120615_*.dat')
+    d.list_registers()
+    RTs = d.get_data(0).flatten()
+    """
+    def __init__(self, files, mmap=True, cache=True):
+        if isinstance(files, (str, unicode)):
+            pattern = files
+            files = sorted(glob.glob(pattern))
+            if not files:
+                raise HKEBinaryError("No files match "
+                                     "{0}".format(pattern))
+        if len(files) == 0:
+            raise HKEBinaryError("No files given.")
+
+        self.filenames = list(files)
+        self.files = [HKEBinaryFile(fname, mmap=mmap, cache=cache)
+                      for fname in self.filenames]
+        self._check_compatible()
+        self._make_frame_index()
+
+        self.reference = self.files[0]
+        self.dt = self.reference.data.dt
+        self.registerlist = self.reference.registerlist
+        self.boardlist = self.reference.boardlist
+
+    def _check_compatible(self):
+        """
+        A helper function to check that all of the files share the
+        frame layout of the first one.
+        """
+        first = self.files[0]
+        for f in self.files[1:]:
+            if ((f.data.dt != first.data.dt) or
+                    (f.registerlist != first.registerlist)):
+                raise HKEIncompatibleFilesError(f.filename,
+                                                first.filename)
+
+    def _make_frame_index(self):
+        """
+        A helper function to build the global frame index.
+        self.offsets[i] is the global index of the first frame of
+        self.files[i], and self.offsets[-1] is the total number of
+        frames.
+        """
+        datanums = [f.datanum for f in self.files]
+        self.offsets = concatenate([[0], cumsum(datanums)]).astype(int64)
+        self.datanum = int(self.offsets[-1])
+
+    def __len__(self):
+        return self.datanum
+
+    def _spans(self, start, stop):
+        """
+        Returns a list of (file, localstart, localstop, outstart)
+        tuples covering global frames start through stop (not
+        including stop), where outstart is the position of localstart
+        relative to start.
+        """
+        spans = []
+        if stop <= start:
+            return spans
+        first = searchsorted(self.offsets, start, side='right') - 1
+        last = searchsorted(self.offsets, stop, side='left')
+        for i in range(first, last):
+            offset = int(self.offsets[i])
+            lstart = max(start - offset, 0)
+            lstop = min(stop - offset, self.files[i].datanum)
+            if lstop > lstart:
+                spans.append((self.files[i], lstart, lstop,
+                              offset + lstart - start))
+        return spans
+
+    def locate(self, frame):
+        """
+        Returns a tuple (file, localframe) giving the HKEBinaryFile
+        containing the global frame number frame and its index in that
+        file.
+        """
+        frame = int(frame)
+        if frame < 0:
+            frame += self.datanum
+        if not (0 <= frame < self.datanum):
+            raise IndexError("Frame {0} out of range".format(frame))
+        i = searchsorted(self.offsets, frame, side='right') - 1
+        return self.files[i], frame - int(self.offsets[i])
+
+    def __getitem__(self, key):
+        """
+        Index the raw frame records of the dataset. An integer returns
+        a single frame record, a slice returns a structured array of
+        the selected frame records (as in HKEBinaryFile.data.data).
+        """
+        if not isinstance(key, slice):
+            f, i = self.locate(key)
+            return f.data.data[i]
+
+        start, stop, step = key.indices(self.datanum)
+        if step != 1:
+            frames = arange(start, stop, step)
+            if len(frames) == 0:
+                return empty(0, dtype=self.dt)
+            first = int(frames.min())
+            return self[first:int(frames.max()) + 1][frames - first]
+        out = empty(max(stop - start, 0), dtype=self.dt)
+        for f, lstart, lstop, ostart in self._spans(start, stop):
+            out[ostart:ostart + lstop - lstart] = f.data.data[lstart:lstop]
+        return out
+
+    def list_boards(self):
+        """
+        Returns a list of the boards in the files. See
+        HKEBinaryFile.list_boards.
+        """
+        return self.boardlist
+
+    def list_registers(self):
+        """
+        Returns a list of the registers in the files. See
+        HKEBinaryFile.list_registers.
+        """
+        return self.registerlist
+
+    def get_register_description(self, identifier):
+        """
+        Return the register description object specified by
+        identifier. See HKEBinaryFile.get_register_description.
+        """
+        return self.reference.get_register_description(identifier)
+
+    def get_register_name(self, identifier):
+        """
+        Return the name of the register specified by the identifier.
+        See HKEBinaryFile.get_register_name.
+        """
+        return self.reference.get_register_name(identifier)
+
+    def get_data(self, identifier=None, reduced=None,
+                 reductionfunction=None, channels=None, start=None,
+                 stop=None):
+        """
+        Extracts data from a single register across all of the files.
+
+        identifier, reduced, reductionfunction and channels are as in
+        HKEBinaryFile.get_data. Only global frames start through stop
+        (not including stop) are extracted; by default all frames
+        are.
+
+        The output array is allocated once and filled file by file,
+        so the peak memory use is the size of the output plus that of
+        the part extracted from a single file.
+        """
+        if not isinstance(identifier, (int, str, unicode)):
+            raise HKEBinaryError
+        if isinstance(channels, int):
+            channels = [channels]
+        elif channels is not None:
+            channels = array(channels).flatten()
+
+        start, stop, _ = slice(start, stop).indices(self.datanum)
+        field = self.reference._get_field(identifier, reduced=reduced)
+
+        out = None
+        spans = self._spans(start, stop)
+        for f, lstart, lstop, ostart in spans:
+            a = f._extract(field, reductionfunction=reductionfunction,
+                           start=lstart, stop=lstop, channels=channels)
+            if out is None:
+                out = empty((stop - start,) + a.shape[1:], dtype=a.dtype)
+            out[ostart:ostart + len(a)] = a
+        if out is None:
+            out = self._empty_data(field, reductionfunction, channels)
+        return out
+
+    def _empty_data(self, field, reductionfunction, channels=None):
+        """
+        Returns a 0-frame array with the shape and dtype that
+        extracting field would give.
+        """
+        for f in self.files:
+            if f.datanum > 0:
+                return f._extract(field,
+                                  reductionfunction=reductionfunction,
+                                  start=0, stop=1, channels=channels)[:0]
+        if channels is None:
+            return empty((0, field[0].nch))
+        return empty((0, len(channels)))
+
+    def iter_chunks(self, frames_per_chunk=65536, registers=None,
+                    reduced=None, reductionfunction=None, channels=None,
+                    start=0, stop=None):
+        """
+        Generator that extracts data chunk by chunk across all of the
+        files. The arguments and chunks are as in
+        HKEBinaryFile.iter_chunks, with start and stop being global
+        frame numbers. Chunks do not straddle file boundaries, so a
+        chunk may be shorter than frames_per_chunk at the end of each
+        file.
+        """
+        start, stop, _ = slice(start, stop).indices(self.datanum)
+        for f, lstart, lstop, _ in self._spans(start, stop):
+            for chunk in f.iter_chunks(frames_per_chunk,
+                                       registers=registers,
+                                       reduced=reduced,
+                                       reductionfunction=reductionfunction,
+                                       channels=channels,
+                                       start=lstart, stop=lstop):
+                yield chunk
+
+
+def load_many(files, registers, workers=None, executor='process',
+              reduced=None, reductionfunction=None, channels=None,
+              mmap=True, cache=True):
+    """
+    Opens many HKE binary files and extracts the same registers from
+    each of them in parallel.
+
+    Arguments:
+        files - (str or list) a glob pattern (taken in sorted order)
+            or a list of filenames.
+        registers - a single identifier or a list of identifiers, as in
+            HKEBinaryFile.get_data.
+        workers - (int) number of worker processes or threads.
+            Defaults to the number of CPUs. workers=1 loads the files
+            one after another in this process.
+        executor - (str) 'process' to use a pool of processes,
+            'thread' to use a pool of threads.
+        reduced, reductionfunction, channels - as in
+            HKEBinaryFile.get_data. reductionfunction must be
+            picklable to be used with executor='process'.
+        mmap, cache - passed on to HKEBinaryFile.
+
+    Returns a list with one entry per file, in file order. Each entry
+    is the array returned by get_data if registers is a single
+    identifier, otherwise a list of such arrays.
+    """
+    if isinstance(files, (str, unicode)):
+        files = sorted(glob.glob(files))
+    if workers is None:
+        workers = cpu_count()
+    tasks = [(fname, registers, reduced, reductionfunction, channels,
+              mmap, cache) for fname in files]
+
+    if (workers <= 1) or (len(tasks) <= 1):
+        return [_load_one(task) for task in tasks]
+
+    if executor == 'process':
+        pool = Pool(min(workers, len(tasks)))
+    elif executor == 'thread':
+        pool = ThreadPool(min(workers, len(tasks)))
+    else:
+        raise HKEBinaryError("Invalid executor: {0}".format(executor))
+    try:
+        results = pool.map(_load_one, tasks)
+    finally:
+        pool.close()
+        pool.join()
+    return results
+
+
+def _load_one(task):
+    """
+    Worker for load_many. Extracts the requested registers from a
+    single file.
+    """
+    fname, registers, reduced, reductionfunction, channels, mmap, cache = task
+    f = HKEBinaryFile(fname, mmap=mmap, cache=cache)
+    single = isinstance(registers, (int, str, unicode))
+    if single:
+        registers = [registers]
+    if not isinstance(reduced, (list, tuple, ndarray)):
+        reduced = [reduced]*len(registers)
+    result = [f.get_data(r, reduced=red,
+                         reductionfunction=reductionfunction,
+                         channels=channels)
+              for r, red in zip(registers, reduced)]
+    return result[0] if single else result
+
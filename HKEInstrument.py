@@ -0,0 +1,316 @@
+#!/bin/env python
+"""
+HKEInstrument.py - Optional instrumentation of the hot paths of the
+HKE binary file tools.
+
+When enabled, the main stages of opening and reading a file record
+their wall time, the number of bytes they read and (optionally) the
+peak memory they allocated:
+
+    header_parse  - parsing the file header
+    dtype_build   - building the frame dtype from the header
+    data_load     - reading (or memory-mapping) the frames
+    extract       - extracting a register, including the stages below
+                    (also recorded per register, as
+                    extract:<address>-<name>)
+    calibrate     - applying linear calibrations and calibration
+                    curves
+    reduce        - reducing the samples of a register
+
+Instrumentation is off by default and costs next to nothing then. It
+is enabled for the whole process by the HKEBINARY_PROFILE environment
+variable, a comma separated list of options:
+
+    1 (or on)  - collect statistics in HKEInstrument.stats
+    memory     - also record peak allocations: with tracemalloc where
+                 it is available (Python 3; this slows everything
+                 down), and otherwise from the peak resident set size
+                 of the process (see max_rss)
+    log        - also emit a log record per stage on the
+                 'hkebinary.profile' logger, with the measurements in
+                 the stage, seconds, nbytes and peak attributes of the
+                 record
+
+or temporarily with the profiling context manager.
+
+Example usage:
+    with profiling() as stats:
+        f = HKEBinaryFile('hke_20120615_001.dat')
+        f.get_data(0)
+    print stats.report()
+    json.dump(stats.as_dict(), open('stats.json', 'w'))
+
+    HKEBINARY_PROFILE=memory,log python myscript.py
+"""
+
+import sys
+import os
+import time
+import logging
+import threading
+from contextlib import contextmanager
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+try:
+    import resource
+except ImportError:
+    resource = None
+
+logger = logging.getLogger('hkebinary.profile')
+timer = getattr(time, 'perf_counter', time.time)
+
+
+class StageStats(object):
+    """
+    The accumulated measurements of one stage: the number of times it
+    ran (count), the total wall time (seconds), the total number of
+    bytes read (nbytes) and the largest peak allocation of a single
+    run in bytes (peak, None if memory is not recorded). Without
+    tracemalloc, the peak of a run is how much it raised the peak
+    resident set size of the process, so only runs that set a new
+    high-water mark have a nonzero peak.
+    """
+    __slots__ = ('count', 'seconds', 'nbytes', 'peak')
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.
+        self.nbytes = 0
+        self.peak = None
+
+    def as_dict(self):
+        return {'count': self.count, 'seconds': self.seconds,
+                'nbytes': self.nbytes, 'peak': self.peak}
+
+
+class Stats(object):
+    """
+    Measurements of the instrumented stages, keyed by stage name.
+    Safe to update from several threads.
+    """
+    def __init__(self):
+        self.stages = {}
+        self._lock = threading.Lock()
+
+    def record(self, name, seconds, nbytes=0, peak=None):
+        """
+        Add one run of stage name to the statistics.
+        """
+        with self._lock:
+            s = self.stages.get(name)
+            if s is None:
+                s = self.stages[name] = StageStats()
+            s.count += 1
+            s.seconds += seconds
+            s.nbytes += nbytes
+            if (peak is not None) and ((s.peak is None) or (peak > s.peak)):
+                s.peak = peak
+
+    def reset(self):
+        """
+        Discard all measurements.
+        """
+        with self._lock:
+            self.stages.clear()
+
+    def as_dict(self):
+        """
+        Returns the measurements as a dict of dicts (see StageStats),
+        e.g. for export as JSON.
+        """
+        with self._lock:
+            return dict((name, s.as_dict())
+                        for name, s in self.stages.items())
+
+    def report(self):
+        """
+        Returns the measurements as a human-readable table.
+        """
+        lines = ['{0:<40s} {1:>8s} {2:>12s} {3:>14s} {4:>12s}'.format(
+            'stage', 'count', 'seconds', 'bytes', 'peak')]
+        for name, s in sorted(self.as_dict().items()):
+            peak = '-' if s['peak'] is None else str(s['peak'])
+            lines.append('{0:<40s} {1:>8d} {2:>12.6f} {3:>14d} '
+                         '{4:>12s}'.format(name, s['count'], s['seconds'],
+                                           s['nbytes'], peak))
+        return '\n'.join(lines)
+
+
+# The process-wide statistics and settings.
+stats = Stats()
+_settings = {'enabled': False, 'memory': False, 'log': False}
+
+
+def max_rss():
+    """
+    Returns the peak resident set size of the process so far, in
+    bytes, or None where it is not available.
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    return peak if sys.platform == 'darwin' else 1024*peak
+
+
+def _tracing():
+    return (tracemalloc is not None) and tracemalloc.is_tracing()
+
+
+# The stages being traced with tracemalloc in each thread, innermost
+# last.
+_local = threading.local()
+
+
+def _traced_stages():
+    stages = getattr(_local, 'stages', None)
+    if stages is None:
+        stages = _local.stages = []
+    return stages
+
+
+def _configure(value):
+    options = set(o.strip().lower() for o in (value or '').split(','))
+    options.discard('')
+    options.discard('0')
+    options.discard('off')
+    _settings['enabled'] = bool(options)
+    _settings['memory'] = 'memory' in options
+    _settings['log'] = 'log' in options
+    if _settings['memory'] and (tracemalloc is not None) and \
+            not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+
+_configure(os.environ.get('HKEBINARY_PROFILE'))
+
+
+def enabled():
+    """
+    Returns True if instrumentation is enabled.
+    """
+    return _settings['enabled']
+
+
+class stage(object):
+    """
+    Context manager measuring one run of the stage name, e.g.
+
+        with stage('reduce') as s:
+            ...
+            s.nbytes = data.nbytes
+
+    nbytes (which may also be set on the object inside the with
+    block) is the number of bytes read by the stage. If label is
+    given, the run is recorded under both name and name:label. Does
+    nothing if instrumentation is disabled.
+
+    Stages may be nested. A stage traced with tracemalloc resets its
+    peak on entry, so the peak the enclosing stage had reached is
+    carried over to it on exit.
+    """
+    __slots__ = ('name', 'label', 'nbytes', '_start', '_memory',
+                 '_traced', '_peak', '_outerpeak')
+
+    def __init__(self, name, nbytes=0, label=None):
+        self.name = name
+        self.label = label
+        self.nbytes = nbytes
+        self._start = None
+
+    def __enter__(self):
+        if _settings['enabled']:
+            self._memory = None
+            self._traced = False
+            if _settings['memory'] and _tracing():
+                current, self._outerpeak = tracemalloc.get_traced_memory()
+                if hasattr(tracemalloc, 'reset_peak'):
+                    tracemalloc.reset_peak()
+                self._memory = current
+                self._peak = 0
+                self._traced = True
+                _traced_stages().append(self)
+            elif _settings['memory']:
+                self._memory = max_rss()
+            self._start = timer()
+        return self
+
+    def __exit__(self, *exc):
+        if self._start is None:
+            return False
+        seconds = timer() - self._start
+        peak = None
+        if self._traced:
+            stages = _traced_stages()
+            stages.pop()
+            top = max(tracemalloc.get_traced_memory()[1], self._peak)
+            peak = max(top - self._memory, 0)
+            if stages:
+                outer = stages[-1]
+                outer._peak = max(outer._peak, self._outerpeak, top)
+        elif self._memory is not None:
+            peak = max(max_rss() - self._memory, 0)
+        names = [self.name]
+        if self.label is not None:
+            names.append('{0}:{1}'.format(self.name, self.label))
+        for name in names:
+            stats.record(name, seconds, self.nbytes, peak)
+        if _settings['log']:
+            logger.info('%s %.6f s %d bytes', names[-1], seconds,
+                        self.nbytes,
+                        extra={'stage': names[-1], 'seconds': seconds,
+                               'nbytes': self.nbytes, 'peak': peak})
+        return False
+
+
+@contextmanager
+def profiling(memory=False, log=False):
+    """
+    Context manager enabling instrumentation for the duration of the
+    with block, with fresh statistics. Yields the Stats object the
+    measurements are recorded in; the process-wide statistics and
+    settings are restored afterwards.
+
+    The process-wide stats object stays the same object throughout,
+    so references to it remain valid: its measurements are set aside
+    and it records into the yielded object until the block ends.
+    """
+    profiled = Stats()
+    profiled._lock = stats._lock
+    with stats._lock:
+        saved = stats.stages
+        stats.stages = profiled.stages
+    settings = dict(_settings)
+    started = False
+    _settings.update(enabled=True, memory=memory, log=log)
+    if memory and (tracemalloc is not None) and \
+            not tracemalloc.is_tracing():
+        tracemalloc.start()
+        started = True
+    try:
+        yield profiled
+    finally:
+        if started:
+            tracemalloc.stop()
+        with stats._lock:
+            stats.stages = saved
+        _settings.update(settings)
+
+
+def cprofile(function, *args, **kwargs):
+    """
+    Run function(*args, **kwargs) under cProfile and return the
+    resulting pstats.Stats, sorted by internal time, for a
+    function-level view of where the time goes.
+    """
+    import cProfile
+    import pstats
+    profiler = cProfile.Profile()
+    profiler.runcall(function, *args, **kwargs)
+    p = pstats.Stats(profiler)
+    p.strip_dirs()
+    p.sort_stats('time')
+    return p
@@ -0,0 +1,193 @@
+#!/bin/env python
+"""
+HKEPyramid.py - Multi-resolution min/max/mean summaries of register
+data, for plotting long runs.
+
+A Pyramid holds, for levels k = minlevel, minlevel + 1, ..., the
+minimum, maximum and mean of every channel over consecutive bins of
+2**k frames. Bins are aligned to multiples of 2**k frames from the
+start of the file, and each level is built from the one below it, so
+the whole pyramid costs about 2/2**minlevel times the size of the
+data. Plotting any time range then needs only a bounded number of
+bins from the right level, whatever the length of the file.
+
+Example usage:
+    None; used by HKEBinaryFile.py instead.
+"""
+
+import os
+import hashlib
+
+from HKEBinaryCache import default_cache_dir
+from numpy import *
+
+
+def bin_frames(data, size):
+    """
+    Returns the (min, max, mean) over consecutive bins of size frames
+    of data, a 2D array of shape (nframes, nch), as three arrays of
+    shape (nbins, nch). A last, partial bin covers the remaining
+    frames.
+    """
+    nframes, nch = data.shape
+    nfull = nframes//size
+    full = data[:nfull*size].reshape(nfull, size, nch)
+    lo = full.min(axis=1)
+    hi = full.max(axis=1)
+    mean = full.mean(axis=1, dtype=float64)
+    if nframes > nfull*size:
+        rest = data[nfull*size:]
+        lo = concatenate([lo, rest.min(axis=0)[newaxis]])
+        hi = concatenate([hi, rest.max(axis=0)[newaxis]])
+        mean = concatenate([mean,
+                            rest.mean(axis=0, dtype=float64)[newaxis]])
+    return lo, hi, mean
+
+
+def pyramid_path(filename, key, directory=None):
+    """
+    Return the path a persisted pyramid of filename is stored at. key
+    is a str identifying the pyramid within the file.
+    """
+    if directory is None:
+        directory = os.path.join(default_cache_dir(), 'pyramids')
+    name = '{0}\0{1}'.format(os.path.abspath(filename), key)
+    if not isinstance(name, bytes):
+        name = name.encode('utf-8')
+    return os.path.join(directory,
+                        hashlib.sha1(name).hexdigest() + '.npz')
+
+
+class Pyramid(object):
+    """
+    A min/max/mean decimation pyramid of the reduced data of one
+    register.
+
+    The pyramid is filled and extended with self.update, which reads
+    the frames through a function read(start, stop) returning the
+    register data of frames start through stop as an array of shape
+    (stop - start, nch). Only complete bins are stored, so frames
+    appended later simply extend the pyramid.
+
+    Arguments:
+        minlevel - (int) the finest level stored, i.e. the smallest
+            bins stored are 2**minlevel frames long. Finer levels are
+            computed on the fly by self.query.
+        maxlevel - (int) the coarsest level stored.
+    """
+    def __init__(self, minlevel=4, maxlevel=40):
+        self.minlevel = minlevel
+        self.maxlevel = maxlevel
+        self.datanum = 0
+        # one [lo, hi, mean] list of arrays per stored level, finest
+        # first
+        self.levels = []
+
+    def nbins(self, level):
+        """
+        Returns the number of complete bins stored at level.
+        """
+        i = level - self.minlevel
+        if (i < 0) or (i >= len(self.levels)):
+            return 0
+        return len(self.levels[i][0])
+
+    def update(self, read, datanum, chunksize=1048576):
+        """
+        Extend the pyramid to cover the complete bins among the first
+        datanum frames, reading the new frames chunksize frames (or
+        so) at a time with read (see the class docstring).
+        """
+        size = 2**self.minlevel
+        chunksize = max(chunksize//size, 1)*size
+        stop = (datanum//size)*size
+        for cstart in range(self.nbins(self.minlevel)*size, stop,
+                            chunksize):
+            cstop = min(cstart + chunksize, stop)
+            self._append(0, bin_frames(read(cstart, cstop), size))
+
+        for i in range(1, self.maxlevel - self.minlevel + 1):
+            if i > len(self.levels):
+                break
+            done = self.nbins(self.minlevel + i)
+            navail = len(self.levels[i - 1][0])//2
+            if navail <= done:
+                break
+            lo, hi, mean = [a[2*done:2*navail]
+                            for a in self.levels[i - 1]]
+            self._append(i, (minimum(lo[0::2], lo[1::2]),
+                             maximum(hi[0::2], hi[1::2]),
+                             (mean[0::2] + mean[1::2])/2.))
+        self.datanum = max(self.datanum, stop)
+
+    def _append(self, i, bins):
+        if i == len(self.levels):
+            self.levels.append(list(bins))
+        else:
+            self.levels[i] = [concatenate([old, new])
+                              for old, new in zip(self.levels[i], bins)]
+
+    def query(self, level, b0, b1, read, datanum):
+        """
+        Returns the (min, max, mean) of bins b0 through b1 (not
+        including b1) of level, as in bin_frames. Bins that are not
+        stored (levels below self.minlevel, or bins at the end of the
+        data that are not yet complete) are computed from the frames,
+        read with read; the last bin may be partial. datanum is the
+        number of frames in the data.
+        """
+        size = 2**level
+        b1 = min(b1, -(-datanum//size))
+        if b1 <= b0:
+            none = read(0, 0)
+            return none, none, none.astype(float64)
+
+        nstored = self.nbins(level)
+        parts = []
+        if b0 < nstored:
+            i = level - self.minlevel
+            parts.append([a[b0:min(b1, nstored)] for a in self.levels[i]])
+        if b1 > nstored:
+            fstart = max(b0, nstored)*size
+            fstop = min(b1*size, datanum)
+            parts.append(bin_frames(read(fstart, fstop), size))
+        if len(parts) == 1:
+            return tuple(parts[0])
+        return tuple(concatenate(p) for p in zip(*parts))
+
+    def save(self, path, **meta):
+        """
+        Save the pyramid to path (an .npz file) together with the
+        metadata in meta, which must be convertible to arrays.
+        """
+        arrays = dict(('meta_' + k, v) for k, v in meta.items())
+        arrays['minlevel'] = self.minlevel
+        arrays['maxlevel'] = self.maxlevel
+        arrays['datanum'] = self.datanum
+        for i, level in enumerate(self.levels):
+            for name, a in zip(('lo', 'hi', 'mean'), level):
+                arrays['{0}_{1}'.format(name, i)] = a
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        tmppath = path + '.tmp.npz'
+        savez(tmppath, **arrays)
+        os.rename(tmppath, path)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Load a pyramid saved with self.save. Returns the pyramid and a
+        dict of its metadata.
+        """
+        with load(path) as npz:
+            self = cls(int(npz['minlevel']), int(npz['maxlevel']))
+            self.datanum = int(npz['datanum'])
+            i = 0
+            while 'lo_{0}'.format(i) in npz.files:
+                self.levels.append([npz['{0}_{1}'.format(name, i)]
+                                    for name in ('lo', 'hi', 'mean')])
+                i += 1
+            meta = dict((k[5:], npz[k][()]) for k in npz.files
+                        if k.startswith('meta_'))
+        return self, meta
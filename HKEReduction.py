@@ -0,0 +1,176 @@
+#!/bin/env python
+"""
+HKEReduction.py - Reduction of the multiple samples per channel of HKE
+registers, and a memory-bounded cache of extracted results.
+
+Registers with nsamples > 1 store several samples per channel in each
+frame, which HKEBinaryFile.get_data reduces to a single value per
+channel. The named reducers here do this in blocks of frames, writing
+straight into the output array, so the temporaries stay small no
+matter how many frames are reduced:
+
+    mean      - average of the samples (the default)
+    median    - median of the samples
+    std       - standard deviation of the samples
+    min, max  - smallest and largest sample
+    first     - first sample
+    last      - last sample
+    decimate  - the middle sample
+
+mean, median and std return float64 for integer registers and the
+register's own dtype for float registers, as numpy.average does. The
+other reducers return the register's own dtype.
+
+Example usage:
+    None; used by HKEBinaryFile.py instead.
+"""
+
+from collections import OrderedDict
+
+from HKEBinaryLibrary import HKEBinaryError
+from numpy import *
+
+
+def _mean(block, out):
+    add.reduce(block, axis=2, dtype=out.dtype, out=out)
+    out /= block.shape[2]
+
+
+def _median(block, out):
+    median(block, axis=2, out=out)
+
+
+def _std(block, out):
+    block.std(axis=2, dtype=out.dtype, out=out)
+
+
+def _min(block, out):
+    block.min(axis=2, out=out)
+
+
+def _max(block, out):
+    block.max(axis=2, out=out)
+
+
+def _first(block, out):
+    out[...] = block[..., 0]
+
+
+def _last(block, out):
+    out[...] = block[..., -1]
+
+
+def _decimate(block, out):
+    out[...] = block[..., block.shape[2]//2]
+
+
+# reducer name: (function reducing one block, True if the result is
+# floating point)
+reducers = {'mean': (_mean, True),
+            'median': (_median, True),
+            'std': (_std, True),
+            'min': (_min, False),
+            'max': (_max, False),
+            'first': (_first, False),
+            'last': (_last, False),
+            'decimate': (_decimate, False)}
+
+
+def reduce_samples(data, reducer='mean', blockelements=1048576):
+    """
+    Reduce the samples of register data to one value per channel.
+
+    Arguments:
+        data - 3D array of shape (nframes, nch, nsamples)
+        reducer - the name of one of the reducers (see the module
+            docstring), or a function called as reducer(data, axis=2)
+            as described in HKEBinaryFile._get_single_data.
+        blockelements - (int) approximate number of samples reduced
+            at a time by the named reducers.
+
+    Returns a 2D array of shape (nframes, nch).
+    """
+    if not isinstance(reducer, (str, unicode)):
+        return reducer(data, axis=2)
+    try:
+        function, isfloat = reducers[reducer]
+    except KeyError:
+        raise HKEBinaryError("Unknown reducer: {0}".format(reducer))
+
+    nframes, nch, nsamples = data.shape
+    outdtype = data.dtype
+    if isfloat and (outdtype.kind != 'f'):
+        outdtype = dtype(float64)
+    out = empty((nframes, nch), dtype=outdtype)
+    blocksize = blockelements//(nch*nsamples or 1) or 1
+    for start in range(0, nframes, blocksize):
+        stop = start + blocksize
+        function(data[start:stop], out[start:stop])
+    return out
+
+
+class ReductionCache(object):
+    """
+    A least recently used cache of extracted register data, bounded by
+    the total size of the cached arrays.
+
+    Each array is copied once, when it is stored, and the copy is
+    made read-only and handed out as it is on every hit, so a hit
+    costs no copy. Callers that need to modify the data must copy it
+    themselves.
+
+    Arguments:
+        maxbytes - (int) memory budget in bytes. Arrays larger than
+            the budget are never cached, and the least recently used
+            arrays are evicted to stay within it. 0 disables the
+            cache.
+    """
+    def __init__(self, maxbytes=64*2**20):
+        self.maxbytes = maxbytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """
+        Return the (read-only) array stored under key, or None.
+        """
+        try:
+            a = self._entries.pop(key)
+        except KeyError:
+            self.misses += 1
+            return None
+        self._entries[key] = a
+        self.hits += 1
+        return a
+
+    def put(self, key, a):
+        """
+        Store a read-only copy of the array a under key, evicting the
+        least recently used arrays as needed, and return the copy (or
+        a itself if it is not cached).
+        """
+        if (not self.maxbytes) or (a.nbytes > self.maxbytes):
+            return a
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self.nbytes -= old.nbytes
+        a = a.copy()
+        a.flags.writeable = False
+        self._entries[key] = a
+        self.nbytes += a.nbytes
+        while self.nbytes > self.maxbytes:
+            key, old = self._entries.popitem(last=False)
+            self.nbytes -= old.nbytes
+        return a
+
+    def clear(self):
+        """
+        Remove all arrays from the cache.
+        """
+        self._entries.clear()
+        self.nbytes = 0
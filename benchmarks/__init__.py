@@ -0,0 +1,8 @@
+"""
+benchmarks - Timing and memory benchmarks of the hot paths of the HKE
+binary file tools, run on synthetic files of configurable size.
+
+Example usage:
+    python -m benchmarks.run --frames 1000000 --save baseline.json
+    python -m benchmarks.run --frames 1000000 --compare baseline.json
+"""
@@ -0,0 +1,378 @@
+"""
+run.py - Run timed, repeatable benchmarks of the hot paths of the HKE
+binary file tools, and compare them against a saved baseline.
+
+Each benchmark is run --repeat times on the same synthetic (or given)
+file. The best wall time is reported, together with the throughput in
+bytes of file data processed per second and the peak memory allocated
+while it ran. The peak is measured with tracemalloc where available
+(Python 3), and is otherwise the peak resident set size of the whole
+process, which only ever grows.
+
+Example usage:
+    python -m benchmarks.run --frames 1000000 --save baseline.json
+    python -m benchmarks.run --frames 1000000 --compare baseline.json
+    python -m benchmarks.run --file hke_20120615_001.dat --only get_data
+"""
+
+import sys
+import os
+import gc
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+import numpy as np
+
+from HKEBinaryLibrary import HKEBufferReader, Header
+from HKEBinaryHeader import clear_headers
+from HKEBinaryCache import HeaderCache
+from HKEBinaryFile import HKEBinaryFile
+from HKEReduction import reducers
+from HKEInstrument import max_rss
+import to_csv
+
+from benchmarks import synthetic
+
+timer = getattr(time, 'perf_counter', time.time)
+
+
+class Context(object):
+    """
+    The file a benchmark run works on, and a scratch directory for
+    caches and outputs.
+    """
+    def __init__(self, filename, workdir):
+        self.filename = filename
+        self.workdir = workdir
+        self.filesize = os.path.getsize(filename)
+        self.cachedir = os.path.join(workdir, 'cache')
+        self.columndir = os.path.join(workdir, 'columns')
+        self.file = self.open()
+        self.headersize = len(self.file.header.rawheader)
+        self.reduced = [rd.flags != 0
+                        for rd in self.file.registerdescriptionlist]
+
+    def open(self, **kwargs):
+        """
+        Open the file uncached, without a column store or result
+        cache, unless kwargs say otherwise.
+        """
+        options = dict(mmap=True, cache=False, columns=False, cachebytes=0)
+        options.update(kwargs)
+        return HKEBinaryFile(self.filename, **options)
+
+    def multisample_register(self):
+        """
+        Returns the index of the register with the most samples per
+        frame, for the reduction benchmarks.
+        """
+        rds = self.file.registerdescriptionlist
+        sizes = [rd.nch*rd.nsamples if rd.nsamples > 1 else 0
+                 for rd in rds]
+        return int(np.argmax(sizes)) if max(sizes) else None
+
+
+# name: (setup, benchmark). setup(ctx) runs once, untimed, and
+# returns the argument of benchmark, which runs timed and returns the
+# number of bytes of file data it processed.
+benchmarks = {}
+order = []
+
+
+def benchmark(name, setup=None):
+    def register(function):
+        benchmarks[name] = (setup or (lambda ctx: ctx), function)
+        order.append(name)
+        return function
+    return register
+
+
+@benchmark('header_parse')
+def _header_parse(ctx):
+    reader = HKEBufferReader(ctx.filename)
+    Header(reader)
+    reader.close()
+    return ctx.headersize
+
+
+@benchmark('dtype_build')
+def _dtype_build(ctx):
+    data = ctx.file.data
+    data.dtype_from_rfd(ctx.file.header)
+    return ctx.headersize
+
+
+# Headers already in use in the process are shared rather than parsed
+# again (see HKEBinaryHeader.intern_header), and ctx.file keeps its
+# header in use, so the cold open benchmarks forget the interned
+# headers first.
+
+@benchmark('open')
+def _open(ctx):
+    clear_headers()
+    ctx.open()
+    return ctx.headersize
+
+
+def _warm_cache(ctx):
+    cache = HeaderCache(ctx.cachedir)
+    ctx.open(cache=cache)
+    return ctx, cache
+
+
+@benchmark('open_cached', setup=_warm_cache)
+def _open_cached(args):
+    ctx, cache = args
+    clear_headers()
+    ctx.open(cache=cache)
+    return ctx.headersize
+
+
+def _intern(ctx):
+    clear_headers()
+    return ctx, ctx.open()
+
+
+@benchmark('open_interned', setup=_intern)
+def _open_interned(args):
+    ctx, keep = args
+    ctx.open()
+    return ctx.headersize
+
+
+@benchmark('load')
+def _load(ctx):
+    clear_headers()
+    ctx.open(mmap=False)
+    return ctx.filesize
+
+
+@benchmark('get_data')
+def _get_data(ctx):
+    f = ctx.open()
+    for i, reduced in enumerate(ctx.reduced):
+        f.get_data(i, reduced=reduced)
+    return ctx.filesize
+
+
+@benchmark('get_data_single')
+def _get_data_single(ctx):
+    f = ctx.file
+    f.get_data(0, reduced=ctx.reduced[0])
+    rd = f.get_register_description(0)
+    return f.datanum*rd.nch*rd.nsamples*rd.registertypelength
+
+
+def _build_columns(ctx):
+    f = ctx.open(columns=ctx.columndir)
+    if f.columns is None:
+        f.build_columns(directory=ctx.columndir)
+    return ctx
+
+
+@benchmark('get_data_columns', setup=_build_columns)
+def _get_data_columns(ctx):
+    f = ctx.open(columns=ctx.columndir)
+    for i, reduced in enumerate(ctx.reduced):
+        f.get_data(i, reduced=reduced)
+    return ctx.filesize
+
+
+@benchmark('get_many')
+def _get_many(ctx):
+    f = ctx.file
+    f.get_many(range(len(f.registerlist)), reduced=ctx.reduced)
+    return ctx.filesize
+
+
+def _reduction(name):
+    def run(ctx):
+        register = ctx.multisample_register()
+        if register is None:
+            return 0
+        f = ctx.file
+        f.get_data(register, reduced=False, reductionfunction=name)
+        rd = f.get_register_description(register)
+        return f.datanum*rd.nch*rd.nsamples*rd.registertypelength
+    return run
+
+
+for _name in sorted(reducers):
+    benchmark('reduce_' + _name)(_reduction(_name))
+
+
+@benchmark('to_csv')
+def _to_csv(ctx):
+    outname = os.path.join(ctx.workdir, 'out.csv.gz')
+    to_csv.hkebinary_to_csv(ctx.filename, outname, cache=False)
+    os.remove(outname)
+    return ctx.filesize
+
+
+def measure(name, ctx, repeat=3):
+    """
+    Run the benchmark name repeat times and return a dict of its
+    results.
+    """
+    setup, function = benchmarks[name]
+    arg = setup(ctx)
+    times = []
+    peak = 0
+    nbytes = 0
+    for i in range(repeat):
+        gc.collect()
+        if tracemalloc is not None:
+            tracemalloc.start()
+        start = timer()
+        nbytes = function(arg)
+        times.append(timer() - start)
+        if tracemalloc is not None:
+            peak = max(peak, tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+        else:
+            peak = max(peak, max_rss() or 0)
+    best = min(times)
+    return {'seconds': best,
+            'mean_seconds': sum(times)/len(times),
+            'bytes': nbytes,
+            'throughput': float(nbytes)/best if best > 0 else None,
+            'peak_bytes': peak,
+            'peak_source': 'tracemalloc' if tracemalloc else 'maxrss'}
+
+
+def compare(results, baseline, tolerance=0.2):
+    """
+    Compare results against baseline results. Returns a list of
+    (name, quantity, ratio) of the regressions: benchmarks that got
+    slower, or used more memory, by more than a fraction tolerance.
+    Memory is only compared when it was measured with tracemalloc.
+    """
+    regressions = []
+    for name, result in sorted(results.items()):
+        old = baseline.get(name)
+        if old is None:
+            continue
+        for quantity in ('seconds', 'peak_bytes'):
+            if not old.get(quantity):
+                continue
+            if (quantity == 'peak_bytes') and \
+                    ((result['peak_source'] != 'tracemalloc') or
+                     (old['peak_source'] != 'tracemalloc')):
+                continue
+            ratio = float(result[quantity])/old[quantity]
+            if ratio > 1 + tolerance:
+                regressions.append((name, quantity, ratio))
+    return regressions
+
+
+def _format(name, result, old=None):
+    line = '{0:<20s} {1:>10.4f} s {2:>10.1f} MB/s {3:>10.1f} MB'.format(
+        name, result['seconds'], (result['throughput'] or 0)/1e6,
+        result['peak_bytes']/1e6)
+    if old and old.get('seconds'):
+        line += '  x{0:.2f}'.format(result['seconds']/old['seconds'])
+    return line
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmark the HKE binary file tools.")
+    parser.add_argument('--file', default=None,
+                        help="benchmark this file instead of a synthetic "
+                             "one")
+    parser.add_argument('--frames', type=int, default=100000,
+                        help="frames in the synthetic file "
+                             "(default: 100000)")
+    parser.add_argument('--boards', type=int, default=4)
+    parser.add_argument('--registers', type=int, default=8,
+                        help="registers per board (default: 8)")
+    parser.add_argument('--nch', type=int, nargs='+', default=[1, 4])
+    parser.add_argument('--nsamples', type=int, nargs='+', default=[1, 8])
+    parser.add_argument('--types', type=int, nargs='+',
+                        default=[0, 1, 2, 3, 4, 5])
+    parser.add_argument('--flags', type=int, nargs='+', default=[0, 2, 4])
+    parser.add_argument('--repeat', type=int, default=3,
+                        help="runs of each benchmark (default: 3)")
+    parser.add_argument('--only', action='append', default=None,
+                        help="run only this benchmark; may be repeated")
+    parser.add_argument('--skip', action='append', default=[],
+                        help="skip this benchmark; may be repeated")
+    parser.add_argument('--save', default=None,
+                        help="save the results to this JSON file")
+    parser.add_argument('--compare', default=None,
+                        help="compare against results saved with --save")
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help="allowed slowdown or memory growth as a "
+                             "fraction (default: 0.2)")
+    parser.add_argument('--workdir', default=None,
+                        help="scratch directory (default: a temporary "
+                             "directory, removed afterwards)")
+    args = parser.parse_args(argv)
+    unknown = [name for name in (args.only or []) + args.skip
+               if name not in order]
+    if unknown:
+        parser.error("unknown benchmark(s) {0}; available: {1}".format(
+            ', '.join(unknown), ', '.join(order)))
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix='hkebench')
+    if not os.path.isdir(workdir):
+        os.makedirs(workdir)
+    try:
+        filename = args.file
+        layout = None
+        if filename is None:
+            filename = os.path.join(workdir, 'synthetic.dat')
+            layout = dict(nboards=args.boards, nregisters=args.registers,
+                          nch=args.nch, nsamples=args.nsamples,
+                          types=args.types, flags=args.flags)
+            synthetic.make_file(filename, nframes=args.frames, **layout)
+        ctx = Context(filename, workdir)
+
+        baseline = {}
+        if args.compare:
+            with open(args.compare) as f:
+                baseline = json.load(f)['results']
+
+        names = [name for name in (args.only or order)
+                 if name not in args.skip]
+        results = {}
+        for name in names:
+            results[name] = measure(name, ctx, repeat=args.repeat)
+            sys.stdout.write(_format(name, results[name],
+                                     baseline.get(name)) + '\n')
+            sys.stdout.flush()
+
+        if args.save:
+            meta = {'python': platform.python_version(),
+                    'numpy': np.__version__,
+                    'platform': platform.platform(),
+                    'file': args.file, 'filesize': ctx.filesize,
+                    'frames': ctx.file.datanum, 'layout': layout,
+                    'repeat': args.repeat, 'date': time.time()}
+            with open(args.save, 'w') as f:
+                json.dump({'meta': meta, 'results': results}, f, indent=1,
+                          sort_keys=True)
+
+        if args.compare:
+            regressions = compare(results, baseline, args.tolerance)
+            for name, quantity, ratio in regressions:
+                sys.stdout.write('REGRESSION {0} {1}: x{2:.2f}\n'.format(
+                    name, quantity, ratio))
+            return 1 if regressions else 0
+        return 0
+    finally:
+        if args.workdir is None:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,229 @@
+"""
+synthetic.py - Generate synthetic HKE binary files of any size and
+register layout, for benchmarking.
+
+Example usage:
+    python -m benchmarks.synthetic -o big.dat --frames 10000000 \
+        --boards 8 --registers 16 --nch 4 --nsamples 8
+"""
+
+import sys
+import argparse
+import struct
+
+import numpy as np
+
+
+# register type: (frame dtype, name)
+rtypes = {0: ('<u1', 'uint8'), 1: ('<u2', 'uint16'), 2: ('<u4', 'uint32'),
+          3: ('<f4', 'float'), 4: ('<i2', 'int16'), 5: ('<i4', 'int32')}
+
+
+class RegisterSpec(object):
+    """
+    The layout of one register of a synthetic file.
+
+    Arguments:
+        name - (str) register name
+        registertype - (int) register type, a key of rtypes
+        nch, nsamples - (int) number of channels and samples per
+            channel
+        flags - (int) 0 (raw data only), 2 (linear calibration) or 4
+            (reduced data stored in the frames)
+        units - (str) units, for flags 2 and 4
+        slope, offset - (float) linear calibration, for flags 2
+    """
+    def __init__(self, name, registertype=2, nch=1, nsamples=1, flags=0,
+                 units='Volts', slope=0.5, offset=0.):
+        self.name = name
+        self.registertype = registertype
+        self.nch = nch
+        self.nsamples = nsamples
+        self.flags = flags
+        self.units = units
+        self.slope = slope
+        self.offset = offset
+        self.chtags = [''] * nch
+
+
+class BoardSpec(object):
+    """
+    The layout of one board of a synthetic file: a board type, an
+    address, a description and a list of RegisterSpecs.
+    """
+    def __init__(self, boardtype, address, description, registers):
+        self.boardtype = boardtype
+        self.address = address
+        self.description = description
+        self.registers = registers
+
+
+def _string(s):
+    if not isinstance(s, bytes):
+        s = s.encode('latin-1')
+    return struct.pack('<B', len(s)) + s
+
+
+def header_bytes(boards, version=0, timestamp='2012-06-15 12:23:18.615'):
+    """
+    Return the encoded HKE header describing the list of BoardSpecs
+    boards.
+    """
+    out = [b'F', struct.pack('<H', version), _string(timestamp),
+           struct.pack('<H', len(boards))]
+    for board in boards:
+        out.extend([b'B', _string(board.boardtype),
+                    struct.pack('<B', board.address),
+                    _string(board.description),
+                    struct.pack('<H', len(board.registers))])
+        for reg in board.registers:
+            out.extend([b'R', _string(reg.name),
+                        struct.pack('<BHH', reg.registertype, reg.nch,
+                                    reg.nsamples)])
+            out.extend([_string(tag) for tag in reg.chtags])
+            out.append(struct.pack('<B', reg.flags))
+            if reg.flags != 0:
+                out.append(_string(reg.units))
+            if reg.flags == 2:
+                out.append(struct.pack('<ff', reg.slope, reg.offset))
+    return b''.join(out)
+
+
+def frame_dtype(boards):
+    """
+    Return the NumPy dtype of a frame of a file with the list of
+    BoardSpecs boards. This mirrors HKEBinaryLibrary.Data, so that the
+    two can be checked against each other.
+    """
+    dta = [('magic', 'S1'), ('framecount', '<u4'),
+           ('framereceivedms', '<u4')]
+    for board in boards:
+        for reg in board.registers:
+            fullname = '{0} ({1}-{2}): {3}'.format(board.description,
+                                                   board.address,
+                                                   board.boardtype,
+                                                   reg.name)
+            shape = (reg.nch, reg.nsamples)
+            dta.append((fullname, rtypes[reg.registertype][0], shape))
+            if reg.flags == 4:
+                dta.append((fullname + ' (reduced)', '<f4', shape))
+    return np.dtype(dta)
+
+
+def make_boards(nboards=4, nregisters=8, nch=1, nsamples=1,
+                types=(0, 1, 2, 3, 4, 5), flags=(0, 2, 4)):
+    """
+    Return a list of nboards BoardSpecs of nregisters registers each.
+    The register types and flags cycle through types and flags. nch
+    and nsamples may be single values or sequences to cycle through.
+    """
+    if not isinstance(nch, (list, tuple)):
+        nch = [nch]
+    if not isinstance(nsamples, (list, tuple)):
+        nsamples = [nsamples]
+    boards = []
+    i = 0
+    for b in range(nboards):
+        registers = []
+        for r in range(nregisters):
+            registers.append(RegisterSpec('Reg{0:02d}'.format(r),
+                                          types[i % len(types)],
+                                          nch[i % len(nch)],
+                                          nsamples[i % len(nsamples)],
+                                          flags[i % len(flags)]))
+            i += 1
+        boards.append(BoardSpec('Synth', b + 1,
+                                'Synthetic board {0}'.format(b + 1),
+                                registers))
+    return boards
+
+
+def make_frames(dt, start, count, interval=1000, rng=None):
+    """
+    Return count synthetic frames of dtype dt, starting at frame
+    number start, with framereceivedms advancing by interval
+    milliseconds per frame. Register data are random.
+    """
+    if rng is None:
+        rng = np.random.RandomState(start)
+    frames = np.zeros(count, dtype=dt)
+    frames['magic'] = b'F'
+    n = np.arange(start, start + count, dtype=np.uint64)
+    frames['framecount'] = n % 2**32
+    frames['framereceivedms'] = (n*interval) % 2**32
+    for name in dt.names[3:]:
+        field = frames[name]
+        if field.dtype.kind == 'f':
+            field[...] = rng.standard_normal(field.shape)
+        else:
+            info = np.iinfo(field.dtype)
+            field[...] = rng.randint(max(info.min, -2**31),
+                                     min(info.max, 2**31 - 1),
+                                     size=field.shape)
+    return frames
+
+
+def make_file(filename, nframes=10000, boards=None, chunksize=65536,
+              interval=1000, seed=0, timestamp='2012-06-15 12:23:18.615',
+              **layout):
+    """
+    Write a synthetic HKE binary file.
+
+    Arguments:
+        filename - (str) output file
+        nframes - (int) number of frames
+        boards - list of BoardSpecs. Defaults to make_boards(**layout).
+        chunksize - (int) number of frames generated and written at a
+            time, which bounds the memory used however large the file
+        interval - (int) milliseconds between frames
+        seed - (int) random seed; the same arguments always give the
+            same file
+        timestamp - (str) timestamp of the header
+
+    Returns the size of the file in bytes.
+    """
+    if boards is None:
+        boards = make_boards(**layout)
+    dt = frame_dtype(boards)
+    rng = np.random.RandomState(seed)
+    with open(filename, 'wb') as f:
+        f.write(header_bytes(boards, timestamp=timestamp))
+        for start in range(0, nframes, chunksize):
+            count = min(chunksize, nframes - start)
+            make_frames(dt, start, count, interval, rng).tofile(f)
+        return f.tell()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Generate a synthetic HKE binary file.")
+    parser.add_argument('-o', '--output', required=True,
+                        help="output file")
+    parser.add_argument('--frames', type=int, default=10000,
+                        help="number of frames (default: 10000)")
+    parser.add_argument('--boards', type=int, default=4,
+                        help="number of boards (default: 4)")
+    parser.add_argument('--registers', type=int, default=8,
+                        help="registers per board (default: 8)")
+    parser.add_argument('--nch', type=int, nargs='+', default=[1],
+                        help="channels per register, cycled (default: 1)")
+    parser.add_argument('--nsamples', type=int, nargs='+', default=[1],
+                        help="samples per channel, cycled (default: 1)")
+    parser.add_argument('--types', type=int, nargs='+',
+                        default=[0, 1, 2, 3, 4, 5],
+                        help="register types, cycled (default: all)")
+    parser.add_argument('--flags', type=int, nargs='+', default=[0, 2, 4],
+                        help="register flags, cycled (default: 0 2 4)")
+    parser.add_argument('--seed', type=int, default=0,
+                        help="random seed (default: 0)")
+    args = parser.parse_args(argv)
+
+    size = make_file(args.output, nframes=args.frames, seed=args.seed,
+                     nboards=args.boards, nregisters=args.registers,
+                     nch=args.nch, nsamples=args.nsamples,
+                     types=args.types, flags=args.flags)
+    sys.stdout.write('{0}: {1} bytes\n'.format(args.output, size))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
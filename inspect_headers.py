@@ -0,0 +1,254 @@
+"""
+inspect_headers.py - Summarize HKE binary files from their headers
+alone.
+
+Only the header of each file and the framereceivedms counters of its
+first, second and last frames are read; the number of frames follows
+from the file size and the frame size given by the header. Inspecting
+a file therefore costs a few small reads whatever its size, and
+thousands of files are inspected in parallel on a pool of processes.
+Neither NumPy nor bitstring is imported.
+
+Example usage:
+    python inspect_headers.py hke_20120615_001.dat
+    python inspect_headers.py -v hke_20120615_001.dat
+    python inspect_headers.py -r '4W Quadrant' -b 4 --json /data/hke
+"""
+
+import sys
+import os
+import json
+import fnmatch
+import argparse
+from struct import Struct
+from multiprocessing import Pool, cpu_count
+
+from HKEBinaryHeader import (HKEBufferReader, Header, frame_size,
+                             framereceivedmsoffset, HKEBinaryError)
+
+_uint32 = Struct('<I')
+
+
+def _framereceivedms(f, headersize, framesize, frame):
+    f.seek(headersize + frame*framesize + framereceivedmsoffset)
+    return _uint32.unpack(f.read(_uint32.size))[0]
+
+
+def _duration(first, second, last):
+    """
+    Returns the time in ms between the first and last frames given
+    the framereceivedms counters of the first, second and last frames,
+    or None if it cannot be told from them (e.g. the acquisition
+    system was restarted). See HKEBinaryFile.get_times.
+    """
+    def step(a, b):
+        return (b - a + 2**31) % 2**32 - 2**31
+    direction = -1 if step(first, second) < 0 else 1
+    duration = direction*step(first, last)
+    return duration if duration >= 0 else None
+
+
+def inspect_file(fname):
+    """
+    Returns a summary of the HKE binary file fname as a dict with the
+    keys
+
+        filename, filesize, version, timestamp
+        headersize, framesize - (int) in bytes
+        frames - (int) number of whole frames in the file
+        trailingbytes - (int) size of a trailing partial frame
+        firstms, lastms - (int) framereceivedms of the first and last
+            frames, or None if there are no frames
+        duration - (int) ms between the first and last frames, or None
+            if unknown (see _duration)
+        boards - list of dicts of the boards, with the keys type,
+            address, description and registers, a list of dicts of the
+            registers with the keys index, name, fullname, columnname,
+            type, nch, nsamples, flags, units and chtags
+    """
+    reader = HKEBufferReader(fname)
+    try:
+        header = Header(reader)
+    finally:
+        reader.close()
+    headersize = header.endpos//8
+    framesize = frame_size(header)
+    filesize = os.path.getsize(fname)
+    frames, trailing = divmod(max(filesize - headersize, 0), framesize)
+
+    firstms = lastms = duration = None
+    if frames:
+        with open(fname, 'rb') as f:
+            firstms = _framereceivedms(f, headersize, framesize, 0)
+            lastms = _framereceivedms(f, headersize, framesize, frames - 1)
+            if frames > 1:
+                secondms = _framereceivedms(f, headersize, framesize, 1)
+                duration = _duration(firstms, secondms, lastms)
+            else:
+                duration = 0
+
+    boards = []
+    index = 0
+    for bd in header.boarddescriptions:
+        registers = []
+        for rd in bd.registerdescriptions:
+            registers.append({'index': index, 'name': rd.name,
+                              'fullname': rd.fullname,
+                              'columnname': rd.columnname,
+                              'type': rd.registertypename,
+                              'nch': rd.nch, 'nsamples': rd.nsamples,
+                              'flags': rd.flags, 'units': rd.units,
+                              'chtags': list(rd.chtags)})
+            index += 1
+        boards.append({'type': bd.boardtype, 'address': bd.address,
+                       'description': bd.description,
+                       'registers': registers})
+
+    return {'filename': fname, 'filesize': filesize,
+            'version': header.version, 'timestamp': header.timestamp,
+            'headersize': headersize, 'framesize': framesize,
+            'frames': frames, 'trailingbytes': trailing,
+            'firstms': firstms, 'lastms': lastms, 'duration': duration,
+            'boards': boards}
+
+
+def _inspect(fname):
+    """
+    inspect_file for the worker processes: errors are returned in the
+    summary instead of raised, so that one bad file does not stop a
+    scan.
+    """
+    try:
+        return inspect_file(fname)
+    except (HKEBinaryError, IOError, OSError) as e:
+        return {'filename': fname, 'error': str(e) or type(e).__name__}
+
+
+def find_files(paths, pattern='*.dat'):
+    """
+    Expand the list of paths into a sorted list of files: files are
+    taken as they are, and directories are searched recursively for
+    files matching pattern.
+    """
+    found = []
+    for path in paths:
+        if not os.path.isdir(path):
+            found.append(path)
+            continue
+        for root, dirs, files in os.walk(path):
+            found.extend(os.path.join(root, name)
+                         for name in fnmatch.filter(files, pattern))
+    return sorted(found)
+
+
+def select(info, register=None, board=None):
+    """
+    Restrict the summary info to the registers matching register (a
+    shell-style pattern matched against register names, full names
+    and column names) on the boards matching board (an address, or a
+    pattern matched against board descriptions and types). Returns
+    the restricted summary, or None if nothing matches.
+    """
+    if 'error' in info:
+        return info
+    if (register is None) and (board is None):
+        return info
+    boards = []
+    for bd in info['boards']:
+        if (board is not None) and \
+                (str(bd['address']) != board) and \
+                not fnmatch.fnmatch(bd['description'], board) and \
+                not fnmatch.fnmatch(bd['type'], board):
+            continue
+        registers = [rd for rd in bd['registers']
+                     if (register is None) or
+                     any(fnmatch.fnmatch(rd[key], register)
+                         for key in ('name', 'fullname', 'columnname'))]
+        if registers:
+            bd = dict(bd)
+            bd['registers'] = registers
+            boards.append(bd)
+    if not boards:
+        return None
+    info = dict(info)
+    info['boards'] = boards
+    return info
+
+
+def format_info(info, verbose=False):
+    """
+    Format the summary info as text: one line for the file and, if
+    verbose, one line per board and register.
+    """
+    if 'error' in info:
+        return '{0}: ERROR {1}'.format(info['filename'], info['error'])
+    nregisters = sum(len(bd['registers']) for bd in info['boards'])
+    duration = info['duration']
+    duration = '?' if duration is None else '{0:.3f}'.format(duration/1e3)
+    lines = ['{0}: {1} frames x {2} bytes, {3} s, {4} boards, {5} registers'
+             ', {6}'.format(info['filename'], info['frames'],
+                            info['framesize'], duration, len(info['boards']),
+                            nregisters, info['timestamp'])]
+    if info['trailingbytes']:
+        lines[0] += ', {0} trailing bytes'.format(info['trailingbytes'])
+    if verbose:
+        for bd in info['boards']:
+            lines.append('  board {0}: {1} ({2})'.format(
+                bd['address'], bd['description'], bd['type']))
+            for rd in bd['registers']:
+                units = '' if rd['units'] is None else rd['units']
+                lines.append('    {0:>4d} {1:<40s} {2:<7s} {3:>4d} x {4:<5d} '
+                             'flags {5} {6}'.format(rd['index'], rd['name'],
+                                                    rd['type'], rd['nch'],
+                                                    rd['nsamples'],
+                                                    rd['flags'], units))
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Summarize HKE binary files from their headers.")
+    parser.add_argument('paths', nargs='+',
+                        help="HKE binary files, or directories to search")
+    parser.add_argument('-p', '--pattern', default='*.dat',
+                        help="file name pattern in directories "
+                             "(default: *.dat)")
+    parser.add_argument('-r', '--register', default=None,
+                        help="list only files with a register whose name "
+                             "matches this pattern")
+    parser.add_argument('-b', '--board', default=None,
+                        help="list only files with this board (address, "
+                             "or description pattern)")
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        help="list the boards and registers")
+    parser.add_argument('--json', action='store_true',
+                        help="print one JSON object per file")
+    parser.add_argument('-j', '--workers', type=int, default=None,
+                        help="worker processes (default: # of CPUs)")
+    args = parser.parse_args(argv)
+
+    fnames = find_files(args.paths, args.pattern)
+    workers = args.workers or cpu_count()
+    if (workers > 1) and (len(fnames) > 1):
+        pool = Pool(min(workers, len(fnames)))
+        infos = pool.imap(_inspect, fnames, chunksize=16)
+    else:
+        pool = None
+        infos = (_inspect(fname) for fname in fnames)
+    try:
+        for info in infos:
+            info = select(info, args.register, args.board)
+            if info is None:
+                continue
+            if args.json:
+                sys.stdout.write(json.dumps(info, sort_keys=True) + '\n')
+            else:
+                sys.stdout.write(format_info(info, args.verbose) + '\n')
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -8,5 +8,9 @@ setup(name='HKEBinary',
       author='Justin Lazear',
       author_email='jlazear@gmail.com',
       url='http://www.github.com/jlazear/hkebinary',
-      py_modules=['HKEBinaryLibrary', 'HKEBinaryFile', 'to_csv']
+      py_modules=['HKEBinaryLibrary', 'HKEBinaryHeader', 'HKEBinaryFile',
+                  'HKEBinaryCache', 'HKEDataset', 'HKEReduction',
+                  'HKEPyramid', 'HKECalibration', 'HKEInstrument',
+                  'HKECatalog', 'to_csv', 'to_columnar', 'inspect_headers'],
+      packages=['benchmarks']
     )
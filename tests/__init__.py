@@ -0,0 +1,6 @@
+"""
+Tests of the HKE binary file tools. Run them from the top of the
+source tree with
+
+    python -m unittest discover tests
+"""
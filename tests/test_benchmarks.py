@@ -0,0 +1,44 @@
+import os
+import sys
+import json
+import unittest
+
+from benchmarks import run
+from tests.util import TempDirTestCase
+
+
+class TestRun(TempDirTestCase):
+    def test_unknown_benchmark(self):
+        stderr = sys.stderr
+        sys.stderr = open(os.devnull, 'w')
+        try:
+            for option in ('--only', '--skip'):
+                self.assertRaises(SystemExit, run.main,
+                                  ['--frames', '10', option, 'nope'])
+        finally:
+            sys.stderr.close()
+            sys.stderr = stderr
+        self.assertEqual(os.listdir(self.tmpdir), [])
+
+    def test_save(self):
+        out = os.path.join(self.tmpdir, 'results.json')
+        stdout = sys.stdout
+        sys.stdout = open(os.devnull, 'w')
+        try:
+            self.assertEqual(run.main(['--frames', '200', '--repeat', '1',
+                                       '--only', 'get_data', '--only',
+                                       'to_csv', '--save', out,
+                                       '--workdir',
+                                       os.path.join(self.tmpdir, 'work')]),
+                             0)
+        finally:
+            sys.stdout.close()
+            sys.stdout = stdout
+        with open(out) as f:
+            results = json.load(f)['results']
+        self.assertEqual(sorted(results), ['get_data', 'to_csv'])
+        self.assertFalse(os.path.exists(os.environ['HKEBINARY_CACHE_DIR']))
+
+
+if __name__ == '__main__':
+    unittest.main()
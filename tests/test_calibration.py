@@ -0,0 +1,111 @@
+import os
+import shutil
+import unittest
+
+import numpy as np
+
+from HKEBinaryFile import HKEBinaryFile
+from HKEBinaryLibrary import HKECalibrationError
+from HKECalibration import Calibration, PolynomialCalibration, \
+    load_calibration
+from tests.util import TempDirTestCase, sample, samplecurve
+
+
+class TestTableCalibration(unittest.TestCase):
+    def test_interpolation(self):
+        cal = Calibration([3., 1., 2.], [30., 10., 20.])
+        self.assertTrue(np.allclose(cal([1., 1.5, 2.25, 3.]),
+                                    [10., 15., 22.5, 30.]))
+        out = np.empty(2)
+        self.assertTrue(cal([1.5, 2.5], out=out) is out)
+        self.assertTrue(np.allclose(out, [15., 25.]))
+
+    def test_bounds(self):
+        x, y = [1., 2., 3.], [10., 20., 40.]
+        values = np.array([0., 2., 4.])
+        self.assertTrue(np.isnan(Calibration(x, y)(values)[[0, 2]]).all())
+        self.assertTrue(np.allclose(Calibration(x, y, bounds='clip')(values),
+                                    [10., 20., 40.]))
+        self.assertTrue(np.allclose(
+            Calibration(x, y, bounds='extrapolate')(values),
+            [0., 20., 60.]))
+        self.assertRaises(HKECalibrationError,
+                          Calibration(x, y, bounds='error'), values)
+        self.assertRaises(HKECalibrationError, Calibration, [1., 1.],
+                          [1., 2.])
+
+    def test_load(self):
+        cal = load_calibration(samplecurve)
+        self.assertTrue(load_calibration(samplecurve) is cal)
+        self.assertEqual((cal.name, cal.units), ('U02728', 'Kelvin'))
+        table = np.loadtxt(samplecurve)
+        self.assertTrue(np.allclose(cal(table[:, 1]), table[:, 0]))
+
+
+class TestPolynomialCalibration(unittest.TestCase):
+    def test_polynomial(self):
+        cal = PolynomialCalibration([2., -1., 3.])
+        values = np.linspace(-10., 10., 7)
+        self.assertTrue(np.allclose(cal(values), 2*values**2 - values + 3))
+
+    def test_domain(self):
+        values = np.array([0., 1., 2., 3.])
+        cal = PolynomialCalibration([1., 0.], domain=(1., 2.))
+        self.assertTrue(np.allclose(cal(values)[1:3], [1., 2.]))
+        self.assertTrue(np.isnan(cal(values)[[0, 3]]).all())
+        cal = PolynomialCalibration([1., 0.], domain=(1., 2.),
+                                    bounds='clip')
+        self.assertTrue(np.allclose(cal(values), [1., 1., 2., 2.]))
+        cal = PolynomialCalibration([1., 0.], domain=(1., 2.),
+                                    bounds='error')
+        self.assertRaises(HKECalibrationError, cal, values)
+        self.assertRaises(HKECalibrationError, PolynomialCalibration,
+                          [1., 0.], domain=(2., 1.))
+
+
+class TestCalibratedData(TempDirTestCase):
+    def test_tag_lookup(self):
+        f = HKEBinaryFile(sample, cache=False)
+        self.assertEqual(list(f.get_register_description(0).chtags),
+                         ['U02728'])
+        cal = f.get_calibration(0)[0]
+        self.assertTrue(cal is load_calibration(samplecurve))
+        expected = cal(f.get_data(0)[:, 0])
+        a = f.get_data(0, calibrate=True)
+        self.assertEqual(a.dtype, np.float64)
+        self.assertTrue(np.allclose(a[:, 0], expected, equal_nan=True))
+        a = f.get_data(0, calibrate=True, frames=slice(10, 50, 3))
+        self.assertTrue(np.allclose(a[:, 0], expected[10:50:3],
+                                    equal_nan=True))
+
+    def test_missing_table(self):
+        fname = os.path.join(self.tmpdir, 'hke_20120615_001.dat')
+        shutil.copy(sample, fname)
+        f = HKEBinaryFile(fname, cache=False)
+        f.calibrationpath = [self.tmpdir]
+        self.assertEqual(f.get_calibration(0), [None])
+        self.assertRaises(HKECalibrationError, f.get_data, 0,
+                          calibrate=True)
+
+    def test_set_calibration(self):
+        f = HKEBinaryFile(self.make_file(nframes=20, nch=[1, 2]),
+                          cache=False)
+        raw = f.get_data(1)
+        f.set_calibration(1, PolynomialCalibration([2., 0.]))
+        self.assertTrue(np.allclose(f.get_data(1, calibrate=True), 2*raw))
+        f.set_calibration(1, PolynomialCalibration([3., 0.]), channel=1)
+        self.assertTrue(np.allclose(f.get_data(1, calibrate=True),
+                                    raw*[2., 3.]))
+        f.set_calibration(1, Calibration([-1e12, 1e12], [1e12, -1e12]))
+        self.assertTrue(np.allclose(f.get_data(1, calibrate=True), -raw))
+        self.assertTrue(np.allclose(f.get_data(1), raw))
+        f.set_calibration(1, None, channel=0)
+        self.assertRaises(HKECalibrationError, f.get_data, 1,
+                          calibrate=True)
+        self.assertTrue(np.allclose(f.get_data(1, channels=1,
+                                               calibrate=True),
+                                    -raw[:, 1:]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+import os
+import time
+import unittest
+
+from HKECatalog import Catalog, to_seconds
+from tests.util import TempDirTestCase
+
+
+class TestCatalog(TempDirTestCase):
+    def setUp(self):
+        TempDirTestCase.setUp(self)
+        self.catalog = Catalog(':memory:')
+
+    def tearDown(self):
+        self.catalog.close()
+        TempDirTestCase.tearDown(self)
+
+    def make_dir(self, name, nfiles=2):
+        os.mkdir(os.path.join(self.tmpdir, name))
+        for i in range(nfiles):
+            self.make_file(os.path.join(name, 'hke_{0}.dat'.format(i)),
+                           nframes=50 + i)
+        return os.path.join(self.tmpdir, name)
+
+    def paths(self):
+        return sorted(row['path'] for row in self.catalog.files())
+
+    def test_update(self):
+        root = self.make_dir('run')
+        self.assertEqual(self.catalog.update(root, workers=1), (2, 0))
+        self.assertEqual(self.catalog.update(root, workers=1), (0, 0))
+        time.sleep(0.01)
+        self.append_frames(os.path.join(root, 'hke_0.dat'), 50, 10)
+        self.assertEqual(self.catalog.update(root, workers=1), (1, 0))
+        os.remove(os.path.join(root, 'hke_1.dat'))
+        self.assertEqual(self.catalog.update(root, workers=1), (0, 1))
+        self.assertEqual(self.paths(), [os.path.join(root, 'hke_0.dat')])
+        self.assertEqual(self.catalog.errors(), [])
+
+    def test_cache(self):
+        cachedir = os.environ['HKEBINARY_CACHE_DIR']
+        root = self.make_dir('run')
+        self.catalog.update(root, workers=1, cache=False)
+        self.assertFalse(os.path.exists(cachedir))
+        os.mkdir(os.path.join(self.tmpdir, 'other'))
+        self.make_file(os.path.join('other', 'hke_0.dat'), nregisters=2)
+        self.catalog.update(os.path.join(self.tmpdir, 'other'), workers=1)
+        self.assertEqual(len(os.listdir(cachedir)), 1)
+
+    def test_find(self):
+        root = self.make_dir('run', nfiles=1)
+        self.catalog.update(root, workers=1)
+        fname = os.path.join(root, 'hke_0.dat')
+        register = self.catalog.registers()[1]
+        start = to_seconds('2012-06-15 12:23:18.615')
+        self.assertEqual(self.catalog.find(register, start + 10,
+                                           start + 20), [(fname, 10, 20)])
+        self.assertEqual(self.catalog.find(register, start + 100), [])
+
+    def test_sibling_directory(self):
+        root = self.make_dir('hke_2012')
+        siblings = [self.make_dir(name, nfiles=1)
+                    for name in ('hkex2012', 'hke_20120', 'HKE_2012')]
+        for sibling in siblings:
+            self.catalog.update(sibling, workers=1)
+        self.assertEqual(self.catalog.update(root, workers=1), (2, 0))
+        self.assertEqual(len(self.paths()), 5)
+
+        os.remove(os.path.join(root, 'hke_0.dat'))
+        self.assertEqual(self.catalog.update(root, workers=1), (0, 1))
+        self.assertEqual(self.paths(),
+                         sorted([os.path.join(root, 'hke_1.dat')] +
+                                [os.path.join(sibling, 'hke_0.dat')
+                                 for sibling in siblings]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,49 @@
+import unittest
+
+import numpy as np
+
+from HKEBinaryFile import HKEBinaryFile
+from tests.util import TempDirTestCase
+
+
+class TestIterChunks(TempDirTestCase):
+    def setUp(self):
+        TempDirTestCase.setUp(self)
+        self.f = HKEBinaryFile(self.make_file(nframes=50, nch=[1, 2]),
+                               cache=False)
+
+    def test_single_register(self):
+        chunks = list(self.f.iter_chunks(7, registers=-1))
+        self.assertEqual([len(c) for c in chunks], [7]*7 + [1])
+        self.assertTrue(np.array_equal(np.concatenate(chunks),
+                                       self.f.get_data(-1)))
+        chunks = list(self.f.iter_chunks(7, registers=-1, reduced=False,
+                                         channels=1))
+        self.assertTrue(np.array_equal(
+            np.concatenate(chunks), self.f.get_data(-1, reduced=False,
+                                                    channels=1)))
+
+    def test_window(self):
+        chunks = list(self.f.iter_chunks(4, registers=1, start=3, stop=20))
+        self.assertEqual([len(c) for c in chunks], [4, 4, 4, 4, 1])
+        self.assertTrue(np.array_equal(np.concatenate(chunks),
+                                       self.f.get_data(1)[3:20]))
+        chunks = list(self.f.iter_chunks(4, registers=1, start=-5))
+        self.assertTrue(np.array_equal(np.concatenate(chunks),
+                                       self.f.get_data(1)[-5:]))
+        self.assertEqual(list(self.f.iter_chunks(4, registers=1, start=20,
+                                                 stop=10)), [])
+
+    def test_all_registers(self):
+        reduced = [True, False]*3
+        chunks = list(self.f.iter_chunks(9, reduced=reduced, start=2,
+                                         stop=45))
+        self.assertEqual(len(chunks), 5)
+        for i, red in enumerate(reduced):
+            self.assertTrue(np.array_equal(
+                np.concatenate([c[i] for c in chunks]),
+                self.f.get_data(i, reduced=red)[2:45]))
+
+
+if __name__ == '__main__':
+    unittest.main()
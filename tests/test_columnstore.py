@@ -0,0 +1,88 @@
+import os
+import time
+import unittest
+
+import numpy as np
+
+from HKEBinaryCache import ColumnStore
+from HKEBinaryFile import HKEBinaryFile
+from tests.util import TempDirTestCase
+
+
+class TestColumnStore(TempDirTestCase):
+    def open(self, path):
+        return HKEBinaryFile(path, mmap=True, cache=False)
+
+    def assertMatchesFile(self, f):
+        for name in f.data.dt.names[1:]:
+            self.assertTrue(np.array_equal(f._read_field(name),
+                                           f.data.data[name]), name)
+            self.assertTrue(np.array_equal(f._read_field(name, 5, None, 7),
+                                           f.data.data[name][5::7]), name)
+
+    def test_build_and_use(self):
+        path = self.make_file(nframes=100)
+        f = self.open(path)
+        self.assertTrue(f.columns is None)
+        self.assertTrue(f.build_columns())
+        g = self.open(path)
+        self.assertTrue(g.columns is not None)
+        self.assertEqual(g.columns.datanum, 100)
+        self.assertMatchesFile(g)
+
+    def test_appended_frames(self):
+        path = self.make_file(nframes=100)
+        self.open(path).build_columns()
+        time.sleep(0.01)
+        self.append_frames(path, 100, 50)
+
+        f = self.open(path)
+        self.assertEqual(f.datanum, 150)
+        self.assertTrue(f.columns is not None)
+        self.assertEqual(f.columns.datanum, 100)
+        self.assertMatchesFile(f)
+
+    def test_rewritten_file(self):
+        path = self.make_file(nframes=100)
+        self.open(path).build_columns()
+        time.sleep(0.01)
+        # same header, different frames
+        os.remove(path)
+        self.make_file(nframes=120)
+        with open(path, 'r+b') as fobj:
+            f = self.open(path)
+            offset = len(f.header.rawheader) + 99*f.dtsize + 1
+            fobj.seek(offset)
+            fobj.write(b'\xff\xff\xff\xff')
+
+        f = self.open(path)
+        self.assertTrue(f.columns is None)
+        self.assertMatchesFile(f)
+
+    def test_truncated_file(self):
+        path = self.make_file(nframes=100)
+        f = self.open(path)
+        f.build_columns()
+        time.sleep(0.01)
+        with open(path, 'r+b') as fobj:
+            fobj.truncate(len(f.header.rawheader) + 50*f.dtsize)
+        self.assertTrue(self.open(path).columns is None)
+
+    def test_rebuild(self):
+        path = self.make_file(nframes=100)
+        self.open(path).build_columns()
+        self.append_frames(path, 100, 50)
+        f = self.open(path)
+        self.assertTrue(f.build_columns())
+        self.assertEqual(self.open(path).columns.datanum, 150)
+
+    def test_missing_store(self):
+        path = self.make_file(nframes=10)
+        f = self.open(path)
+        store = ColumnStore(path)
+        self.assertFalse(store.fresh(f.header.rawheader, f.data.data))
+        self.assertEqual(store.datanum, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
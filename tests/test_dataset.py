@@ -0,0 +1,92 @@
+import os
+import unittest
+
+import numpy as np
+
+from HKEBinaryFile import HKEBinaryFile
+from HKEBinaryLibrary import HKEIncompatibleFilesError
+from HKEDataset import HKEDataset, load_many
+from tests.util import TempDirTestCase
+
+
+class TestDataset(TempDirTestCase):
+    def setUp(self):
+        TempDirTestCase.setUp(self)
+        self.fnames = [self.make_file('hke_{0}.dat'.format(i),
+                                      nframes=n, seed=i)
+                       for i, n in enumerate((20, 15, 25))]
+        self.d = HKEDataset(os.path.join(self.tmpdir, 'hke_*.dat'),
+                            cache=False)
+        self.files = [HKEBinaryFile(fname, cache=False)
+                      for fname in self.fnames]
+
+    def concatenated(self, identifier, **kwargs):
+        return np.concatenate([f.get_data(identifier, **kwargs)
+                               for f in self.files])
+
+    def test_get_data(self):
+        self.assertEqual(len(self.d), 60)
+        self.assertEqual(self.d.list_registers(),
+                         self.files[0].list_registers())
+        expected = self.concatenated(-1)
+        self.assertTrue(np.array_equal(self.d.get_data(-1), expected))
+        for start, stop in ((5, 40), (20, 35), (19, 21), (-10, None),
+                            (30, 10)):
+            self.assertTrue(np.array_equal(
+                self.d.get_data(-1, start=start, stop=stop),
+                expected[start:stop]))
+        self.assertTrue(np.array_equal(
+            self.d.get_data(-1, reduced=False, start=10, stop=50),
+            self.concatenated(-1, reduced=False)[10:50]))
+
+    def test_getitem(self):
+        frames = np.concatenate([f.data.data for f in self.files])
+        self.assertTrue(np.array_equal(self.d[15:45], frames[15:45]))
+        self.assertTrue(np.array_equal(self.d[3:58:4], frames[3:58:4]))
+        self.assertTrue(np.array_equal(self.d[::-7], frames[::-7]))
+        self.assertTrue(np.array_equal(self.d[50:10:-3], frames[50:10:-3]))
+        self.assertEqual(len(self.d[10:50:-1]), 0)
+        self.assertEqual(self.d[20]['framecount'], 0)
+        self.assertEqual(self.d[-1]['framecount'], 24)
+        self.assertRaises(IndexError, lambda: self.d[60])
+
+    def test_locate(self):
+        self.assertEqual(self.d.locate(0), (self.d.files[0], 0))
+        self.assertEqual(self.d.locate(20), (self.d.files[1], 0))
+        self.assertEqual(self.d.locate(-1), (self.d.files[2], 24))
+        self.assertEqual(self.d.locate(-26), (self.d.files[1], 14))
+        self.assertEqual(self.d.locate(-60), (self.d.files[0], 0))
+        self.assertRaises(IndexError, self.d.locate, -61)
+        self.assertRaises(IndexError, self.d.locate, 60)
+
+    def test_iter_chunks(self):
+        chunks = list(self.d.iter_chunks(6, registers=-1, start=10,
+                                         stop=50))
+        self.assertEqual([len(c) for c in chunks], [6, 4, 6, 6, 3, 6, 6, 3])
+        self.assertTrue(np.array_equal(np.concatenate(chunks),
+                                       self.concatenated(-1)[10:50]))
+
+    def test_incompatible_files(self):
+        other = self.make_file('other.dat', nframes=10, nregisters=2)
+        self.assertRaises(HKEIncompatibleFilesError, HKEDataset,
+                          [self.fnames[0], other], cache=False)
+
+
+class TestLoadMany(TempDirTestCase):
+    def test_executors(self):
+        files = [self.make_file('hke_{0}.dat'.format(i), nframes=20 + i)
+                 for i in range(3)]
+        expected = [HKEBinaryFile(fname, cache=False).get_data(1)
+                    for fname in files]
+        for executor in ('process', 'thread'):
+            results = load_many(files, 1, workers=2, executor=executor,
+                                cache=False)
+            self.assertEqual(len(results), 3)
+            for a, b in zip(results, expected):
+                self.assertTrue(np.array_equal(a, b))
+        results = load_many(files, [0, 1], workers=1, cache=False)
+        self.assertTrue(np.array_equal(results[2][1], expected[2]))
+
+
+if __name__ == '__main__':
+    unittest.main()
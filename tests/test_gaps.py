@@ -0,0 +1,83 @@
+import os
+import unittest
+
+import numpy as np
+
+from HKEBinaryFile import HKEBinaryFile
+from HKEBinaryLibrary import GapIndex
+from tests.util import TempDirTestCase
+
+# a gap of 3 frames at frame 20, a duplicate at 30, a reset at 40 and
+# a time jump of 11 s at 50
+framecount = np.concatenate([np.arange(20), np.arange(23, 33), [32],
+                             np.arange(33, 42), np.arange(20)])
+received = 1000*np.arange(60)
+received[50:] += 10000
+
+
+class TestGapIndex(TempDirTestCase):
+    def assertIndex(self, index):
+        self.assertEqual(list(index), [(20, 'gap', 3), (30, 'duplicate', 0),
+                                       (40, 'reset', 0),
+                                       (50, 'timejump', 11000)])
+        self.assertEqual(index.datanum, 60)
+        self.assertEqual(index.dropped(), 3)
+        self.assertEqual(index.dropped(start=20), 0)
+        self.assertEqual(index.segments(), [(0, 20), (20, 40), (40, 50),
+                                            (50, 60)])
+        self.assertEqual(index.summary(), {'gap': 1, 'duplicate': 1,
+                                           'reset': 1, 'timejump': 1,
+                                           'dropped': 3})
+
+    def test_update(self):
+        index = GapIndex(timeinterval=1000)
+        index.update(framecount, received)
+        self.assertIndex(index)
+        self.assertEqual(list(index.select('reset')), [40])
+        self.assertEqual(list(index.select(['gap', GapIndex.RESET],
+                                           start=20)), [40])
+
+    def test_chunks(self):
+        for size in (1, 7, 20, 59):
+            index = GapIndex(timeinterval=1000)
+            for start in range(0, 60, size):
+                index.update(framecount[start:start + size],
+                             received[start:start + size])
+            self.assertIndex(index)
+
+    def test_wraparound(self):
+        index = GapIndex(timeinterval=1000)
+        index.update((2**32 - 5 + np.arange(10)) % 2**32,
+                     (2**32 - 5000 + 1000*np.arange(10)) % 2**32)
+        self.assertEqual(len(index), 0)
+
+    def test_file(self):
+        path = os.path.join(self.tmpdir, 'hke_test.dat')
+        self.write_counters(path, framecount, received)
+        f = HKEBinaryFile(path, cache=False)
+        self.assertIndex(f.get_gaps(chunksize=7))
+
+        a = f.get_data(1)
+        split = f.get_data(1, gaps='split')
+        self.assertEqual([len(s) for s in split], [20, 20, 10, 10])
+        filled = f.get_data(1, gaps='nan')
+        self.assertEqual(len(filled), 63)
+        self.assertTrue(np.all(np.isnan(filled[20:23])))
+        self.assertTrue(np.array_equal(np.delete(filled, [20, 21, 22], 0),
+                                       a))
+
+    def test_appended_frames(self):
+        path = os.path.join(self.tmpdir, 'hke_test.dat')
+        self.write_counters(path, framecount[:20], received[:20])
+        f = HKEBinaryFile(path, cache=False)
+        index = f.get_gaps()
+        self.assertEqual((len(index), index.datanum), (0, 20))
+        self.write_counters(path, framecount[20:], received[20:],
+                            append=True)
+        f.refresh()
+        self.assertTrue(f.get_gaps() is index)
+        self.assertIndex(index)
+
+
+if __name__ == '__main__':
+    unittest.main()
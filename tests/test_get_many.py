@@ -0,0 +1,51 @@
+import unittest
+
+import numpy as np
+
+from HKEBinaryFile import HKEBinaryFile
+from tests.util import TempDirTestCase
+
+
+class TestGetMany(TempDirTestCase):
+    def setUp(self):
+        TempDirTestCase.setUp(self)
+        self.f = HKEBinaryFile(self.make_file(nframes=50, nch=[1, 2]),
+                               cache=False)
+        self.identifiers = [0, 1, 3, -1]
+
+    def expected(self, reduced, **kwargs):
+        columns = []
+        for identifier, red in zip(self.identifiers, reduced):
+            a = self.f.get_data(identifier, reduced=red, **kwargs)
+            columns.append(a.reshape(len(a), -1))
+        return columns
+
+    def test_columns(self):
+        reduced = [True, False, True, False]
+        out = self.f.get_many(self.identifiers, reduced=reduced,
+                              frames=slice(3, 40, 2), chunksize=7)
+        expected = np.hstack(self.expected(reduced, frames=slice(3, 40, 2)))
+        self.assertEqual(out.shape, expected.shape)
+        self.assertTrue(np.allclose(out, expected))
+
+    def test_structured(self):
+        reduced = [False, True, False, True]
+        out = self.f.get_many(self.identifiers, reduced=reduced,
+                              t_start=5000, t_stop=25000, structured=True,
+                              chunksize=4)
+        expected = self.expected(reduced, t_start=5000, t_stop=25000)
+        self.assertEqual(list(out.dtype.names),
+                         [self.f.get_register_name(i)
+                          for i in self.identifiers])
+        for name, a in zip(out.dtype.names, expected):
+            self.assertTrue(np.allclose(out[name].reshape(len(out), -1), a))
+
+    def test_get_data_list(self):
+        out = self.f.get_data(self.identifiers)
+        expected = self.expected([None]*4)
+        for name, a in zip(out.dtype.names, expected):
+            self.assertTrue(np.allclose(out[name].reshape(len(out), -1), a))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+import gc
+import pickle
+import unittest
+
+from HKEBinaryHeader import HKEBufferReader, Header, clear_headers, \
+    _headers
+from HKEBinaryFile import HKEBinaryFile
+from HKEBinaryLibrary import HKEInvalidRegisterError
+from tests.util import TempDirTestCase
+
+
+class TestSharedHeader(TempDirTestCase):
+    def setUp(self):
+        TempDirTestCase.setUp(self)
+        clear_headers()
+
+    def test_shared(self):
+        a = self.make_file('hke_a.dat', nframes=10)
+        b = self.make_file('hke_b.dat', nframes=20)
+        fa = HKEBinaryFile(a, cache=False)
+        fb = HKEBinaryFile(b, cache=False)
+        self.assertTrue(fa.header is fb.header)
+        self.assertTrue(fa.data.dt is fb.data.dt)
+        self.assertEqual((fa.datanum, fb.datanum), (10, 20))
+        self.assertTrue(isinstance(fa.list_registers(), list))
+        self.assertTrue(isinstance(fa.list_boards(), list))
+        fa.list_registers().append('x')
+        self.assertEqual(len(fb.list_registers()), 6)
+
+        c = self.make_file('hke_c.dat', nframes=10, nregisters=2)
+        fc = HKEBinaryFile(c, cache=False)
+        self.assertFalse(fc.header is fa.header)
+        self.assertEqual(len(_headers), 2)
+
+    def test_released(self):
+        f = HKEBinaryFile(self.make_file(), cache=False)
+        self.assertEqual(len(_headers), 1)
+        del f
+        gc.collect()
+        self.assertEqual(len(_headers), 0)
+
+    def test_immutable(self):
+        header = HKEBinaryFile(self.make_file(), cache=False).header
+        bd = header.boarddescriptions[0]
+        rd = header._rdlist[0]
+        self.assertRaises(AttributeError, setattr, header, 'version', 2)
+        self.assertRaises(AttributeError, setattr, bd, 'address', 7)
+        self.assertRaises(AttributeError, setattr, rd, 'nch', 7)
+        for d in (header.boards, header._bkeydict, header._baddressdict,
+                  header._rkeyindex, header._rcolumnindex, bd.registers):
+            key = list(d)[0]
+            self.assertRaises(TypeError, d.__setitem__, key, None)
+            self.assertRaises(TypeError, d.__delitem__, key)
+            self.assertRaises(TypeError, d.update, {})
+            self.assertRaises(TypeError, d.pop, key)
+        self.assertTrue(isinstance(header._rdlist, tuple))
+
+    def test_pickle(self):
+        reader = HKEBufferReader(self.make_file())
+        header = Header(reader)
+        reader.close()
+        copy = pickle.loads(pickle.dumps(header, pickle.HIGHEST_PROTOCOL))
+        self.assertEqual(copy.rawheader, header.rawheader)
+        self.assertEqual(copy._rkeylist, header._rkeylist)
+        self.assertEqual(copy._rcolumnindex, header._rcolumnindex)
+        self.assertRaises(TypeError, copy._rkeyindex.__setitem__, 'x', 0)
+        self.assertRaises(AttributeError, setattr, copy, 'version', 2)
+
+    def test_lookups(self):
+        f = HKEBinaryFile(self.make_file(), cache=False)
+        for i, rd in enumerate(f.registerdescriptionlist):
+            self.assertEqual(rd.index, i)
+            for identifier in (i, i - len(f.registerlist), rd.fullname,
+                               rd.columnname):
+                self.assertTrue(f.get_register_description(identifier)
+                                is rd)
+            self.assertEqual(f.get_register_name(rd.columnname),
+                             f.registerlist[i])
+        for identifier in (len(f.registerlist), 'x', None):
+            self.assertRaises(HKEInvalidRegisterError,
+                              f.get_register_description, identifier)
+        for i, name in enumerate(f.list_boards()):
+            bd = f.get_board(i)
+            self.assertTrue(f.get_board(name) is bd)
+            self.assertTrue(f.get_board(address=bd.address) is bd)
+        rd = f.registerdescriptionlist[-1]
+        bd = f.get_board(-1)
+        self.assertEqual((rd.boardname, rd.address, rd.boardtype),
+                         (bd.description, bd.address, bd.boardtype))
+        self.assertFalse(hasattr(rd, 'reader'))
+
+
+if __name__ == '__main__':
+    unittest.main()
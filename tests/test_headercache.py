@@ -0,0 +1,108 @@
+import os
+import time
+import unittest
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+from HKEBinaryCache import HeaderCache
+from HKEBinaryHeader import clear_headers
+from HKEBinaryFile import HKEBinaryFile
+from tests.util import TempDirTestCase
+
+
+class TestHeaderCache(TempDirTestCase):
+    def setUp(self):
+        TempDirTestCase.setUp(self)
+        # headers in use elsewhere in the process bypass the cache
+        clear_headers()
+        self.cache = HeaderCache(os.path.join(self.tmpdir, 'headers'))
+
+    def store(self, path):
+        f = HKEBinaryFile(path, cache=False)
+        self.cache.store(path, f.header, f.data.dt)
+        return f
+
+    def entry(self, path):
+        with open(self.cache._entrypath(path), 'rb') as fobj:
+            return pickle.load(fobj)
+
+    def test_hit(self):
+        path = self.make_file()
+        self.assertTrue(self.cache.load(path) is None)
+        f = self.store(path)
+        header, dt = self.cache.load(path)
+        self.assertEqual(header.rawheader, f.header.rawheader)
+        self.assertEqual(header._rkeylist, f.header._rkeylist)
+        self.assertEqual(dt, f.data.dt)
+
+    def test_opened_file(self):
+        path = self.make_file()
+        HKEBinaryFile(path, cache=self.cache)
+        self.assertTrue(self.cache.load(path) is not None)
+        HKEBinaryFile(self.make_file('hke_b.dat'), cache=False)
+        self.assertEqual(len(self.cache._entries()), 1)
+
+    def test_appended_frames(self):
+        path = self.make_file(nframes=10)
+        f = self.store(path)
+        time.sleep(0.01)
+        self.append_frames(path, 10, 5)
+        header, dt = self.cache.load(path)
+        self.assertEqual(header.rawheader, f.header.rawheader)
+        entry = self.entry(path)
+        st = os.stat(path)
+        self.assertEqual((entry['size'], entry['mtime']),
+                         (st.st_size, st.st_mtime))
+
+    def test_changed_header(self):
+        path = self.make_file()
+        self.store(path)
+        time.sleep(0.01)
+        self.make_file(nregisters=2)
+        self.assertTrue(self.cache.load(path) is None)
+        self.assertFalse(os.path.exists(self.cache._entrypath(path)))
+        f = HKEBinaryFile(path, cache=self.cache)
+        self.assertEqual(len(f.list_registers()), 4)
+        self.assertEqual(self.entry(path)['header'].rawheader,
+                         f.header.rawheader)
+
+    def test_eviction(self):
+        self.cache.maxentries = 2
+        paths = [self.make_file('hke_{0}.dat'.format(i)) for i in range(3)]
+        for i, path in enumerate(paths[:2]):
+            self.store(path)
+            t = time.time() - 100 + i
+            os.utime(self.cache._entrypath(path), (t, t))
+        self.assertTrue(self.cache.load(paths[0]) is not None)
+        self.store(paths[2])
+        self.assertEqual(len(self.cache._entries()), 2)
+        self.assertTrue(self.cache.load(paths[1]) is None)
+        self.assertTrue(self.cache.load(paths[0]) is not None)
+        self.assertTrue(self.cache.load(paths[2]) is not None)
+
+    def test_corrupt_entry(self):
+        path = self.make_file()
+        self.store(path)
+        with open(self.cache._entrypath(path), 'wb') as fobj:
+            fobj.write(b'not a pickle')
+        self.assertTrue(self.cache.load(path) is None)
+        clear_headers()
+        f = HKEBinaryFile(path, cache=self.cache)
+        self.assertEqual(f.datanum, 100)
+        self.assertTrue(self.cache.load(path) is not None)
+
+    def test_unwritable_directory(self):
+        blocker = os.path.join(self.tmpdir, 'file')
+        open(blocker, 'w').close()
+        cache = HeaderCache(os.path.join(blocker, 'headers'))
+        path = self.make_file()
+        f = HKEBinaryFile(path, cache=cache)
+        self.assertEqual(f.datanum, 100)
+        self.assertTrue(cache.load(path) is None)
+
+
+if __name__ == '__main__':
+    unittest.main()
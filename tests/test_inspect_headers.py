@@ -0,0 +1,61 @@
+import sys
+import json
+import subprocess
+import unittest
+
+from HKEBinaryFile import HKEBinaryFile
+from tests.util import topdir, sample
+
+# runs inspect_headers in a fresh interpreter and reports the modules
+# it imported on stderr
+script = """
+import sys
+import inspect_headers
+inspect_headers.main(sys.argv[1:])
+sys.stderr.write(' '.join(sorted(sys.modules)))
+"""
+
+
+class TestInspectHeaders(unittest.TestCase):
+    def run_script(self, *args):
+        p = subprocess.Popen([sys.executable, '-c', script] + list(args),
+                             cwd=topdir, stdout=subprocess.PIPE,
+                             stderr=subprocess.PIPE)
+        out, err = p.communicate()
+        self.assertEqual(p.returncode, 0, err)
+        return out.decode(), err.decode().split()
+
+    def test_no_numpy(self):
+        out, modules = self.run_script('-v', sample)
+        self.assertTrue('inspect_headers' in modules)
+        for name in ('numpy', 'bitstring'):
+            self.assertFalse(name in modules)
+        lines = out.splitlines()
+        self.assertTrue(lines[0].startswith(
+            sample + ': 2714 frames x 348 bytes, 2713.651 s, 3 boards, '
+            '23 registers'))
+        self.assertTrue(lines[2].split()[:2] == ['0', 'Demod'])
+        self.assertEqual(len(lines), 1 + 3 + 23)
+
+    def test_registers(self):
+        out, _ = self.run_script('--json', sample)
+        info = json.loads(out)
+        f = HKEBinaryFile(sample, cache=False)
+        registers = [rd for bd in info['boards'] for rd in bd['registers']]
+        self.assertEqual([rd['fullname'] for rd in registers],
+                         f.list_registers())
+        self.assertEqual([rd['index'] for rd in registers],
+                         list(range(23)))
+        self.assertEqual(registers[0]['chtags'], ['U02728'])
+        self.assertEqual((info['frames'], info['trailingbytes']),
+                         (f.datanum, 0))
+
+    def test_select(self):
+        out, _ = self.run_script('-v', '-r', 'Pid*', '-b', '1', sample)
+        names = [line.split()[1] for line in out.splitlines()[2:]]
+        self.assertEqual(names, ['PidSetPoint', 'PidError',
+                                 'PidAccumulator', 'PidP', 'PidI'])
+
+
+if __name__ == '__main__':
+    unittest.main()
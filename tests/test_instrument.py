@@ -0,0 +1,119 @@
+import unittest
+
+import HKEInstrument
+from HKEInstrument import profiling, stage, stats
+from HKEBinaryFile import HKEBinaryFile
+from tests.util import TempDirTestCase
+
+
+class FakeTracemalloc(object):
+    """
+    Stands in for tracemalloc, with allocations made by hand.
+    """
+    def __init__(self):
+        self.tracing = False
+        self.current = self.peak = 0
+
+    def start(self):
+        self.tracing = True
+
+    def stop(self):
+        self.tracing = False
+        self.current = self.peak = 0
+
+    def is_tracing(self):
+        return self.tracing
+
+    def get_traced_memory(self):
+        return self.current, self.peak
+
+    def reset_peak(self):
+        self.peak = self.current
+
+    def allocate(self, n):
+        self.current += n
+        self.peak = max(self.peak, self.current)
+
+
+class TestProfiling(TempDirTestCase):
+    def test_stages(self):
+        f = HKEBinaryFile(self.make_file(), cache=False)
+        f.get_data(1)
+        self.assertEqual(stats.as_dict(), {})
+        with profiling() as profiled:
+            f = HKEBinaryFile(self.make_file('hke_b.dat', nframes=50),
+                              cache=False)
+            f.get_data(1)
+        result = profiled.as_dict()
+        self.assertEqual(result['data_load']['count'], 1)
+        self.assertEqual(result['extract']['count'], 1)
+        self.assertTrue(result['extract']['nbytes'] > 0)
+        self.assertTrue(result['extract']['peak'] is None)
+        self.assertTrue('extract:1-Reg01' in result)
+        self.assertTrue('extract' in profiled.report())
+        self.assertEqual(stats.as_dict(), {})
+
+    def test_module_stats(self):
+        self.assertFalse(HKEInstrument.enabled())
+        stats.record('outside', 1.)
+        with profiling() as profiled:
+            self.assertTrue(HKEInstrument.enabled())
+            with stage('inside', nbytes=10):
+                pass
+            self.assertEqual(list(stats.as_dict()), ['inside'])
+        self.assertTrue(HKEInstrument.stats is stats)
+        self.assertFalse(HKEInstrument.enabled())
+        self.assertEqual(list(stats.as_dict()), ['outside'])
+        self.assertEqual(profiled.as_dict()['inside']['nbytes'], 10)
+        stats.reset()
+
+    def test_memory(self):
+        with profiling(memory=True) as profiled:
+            with stage('allocate'):
+                data = bytearray(2**20)
+        del data
+        peak = profiled.as_dict()['allocate']['peak']
+        if HKEInstrument.max_rss() is not None:
+            self.assertTrue((peak is not None) and (peak >= 0))
+
+
+class TestNestedStages(unittest.TestCase):
+    def setUp(self):
+        self.saved = HKEInstrument.tracemalloc
+        self.fake = HKEInstrument.tracemalloc = FakeTracemalloc()
+
+    def tearDown(self):
+        HKEInstrument.tracemalloc = self.saved
+
+    def test_nested_peaks(self):
+        fake = self.fake
+        with profiling(memory=True) as profiled:
+            with stage('outer'):
+                fake.allocate(100)
+                fake.allocate(-100)
+                with stage('inner'):
+                    fake.allocate(10)
+                    fake.allocate(-10)
+                fake.allocate(5)
+        self.assertFalse(fake.tracing)
+        result = profiled.as_dict()
+        self.assertEqual(result['outer']['peak'], 100)
+        self.assertEqual(result['inner']['peak'], 10)
+
+    def test_inner_peak_is_outer_peak(self):
+        fake = self.fake
+        with profiling(memory=True) as profiled:
+            with stage('outer'):
+                fake.allocate(20)
+                with stage('inner'):
+                    with stage('innermost'):
+                        fake.allocate(200)
+                    fake.allocate(-200)
+        result = profiled.as_dict()
+        self.assertEqual(result['outer']['peak'], 220)
+        self.assertEqual(result['inner']['peak'], 200)
+        self.assertEqual(result['innermost']['peak'], 200)
+
+
+if __name__ == '__main__':
+    unittest.main()
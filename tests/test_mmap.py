@@ -0,0 +1,73 @@
+import unittest
+
+import numpy as np
+
+from HKEBinaryFile import HKEBinaryFile
+from tests.util import TempDirTestCase, sample
+
+
+class TestMmap(TempDirTestCase):
+    def assertSameData(self, a, b):
+        self.assertEqual(a.datanum, b.datanum)
+        self.assertTrue(np.array_equal(a.data.data, b.data.data))
+        self.assertTrue(np.array_equal(a.get_times(), b.get_times()))
+        for i in range(len(a.list_registers())):
+            for reduced in (True, False):
+                self.assertTrue(np.array_equal(
+                    a.get_data(i, reduced=reduced),
+                    b.get_data(i, reduced=reduced)))
+
+    def test_sample(self):
+        self.assertSameData(HKEBinaryFile(sample),
+                            HKEBinaryFile(sample, mmap=True))
+
+    def test_synthetic(self):
+        fname = self.make_file(nframes=50, nch=[1, 2])
+        a = HKEBinaryFile(fname)
+        b = HKEBinaryFile(fname, mmap=True)
+        self.assertTrue(isinstance(b.data.data, np.memmap))
+        self.assertSameData(a, b)
+        self.assertTrue(np.array_equal(a.get_data(-1, frames=slice(5, 40, 3)),
+                                       b.get_data(-1, frames=slice(5, 40,
+                                                                   3))))
+
+
+class TestRefresh(TempDirTestCase):
+    def check_refresh(self, mmap):
+        fname = self.make_file(nframes=20)
+        f = HKEBinaryFile(fname, mmap=mmap)
+        before = f.get_data(-1)
+        times = f.get_times()
+        self.assertEqual(f.refresh(), slice(20, 20))
+
+        self.append_frames(fname, 20, 10)
+        frame = self.frame_bytes(30, 1)
+        with open(fname, 'ab') as fobj:
+            fobj.write(frame[:f.dtsize//2])
+        self.assertEqual(f.refresh(), slice(20, 30))
+        self.assertEqual(f.datanum, 30)
+        self.assertEqual(len(f.get_times()), 30)
+        self.assertTrue(np.array_equal(f.get_times()[:20], times))
+        self.assertTrue(np.array_equal(f.get_data(-1)[:20], before))
+        self.assertEqual(len(before), 20)
+
+        with open(fname, 'ab') as fobj:
+            fobj.write(frame[f.dtsize//2:])
+        self.assertEqual(f.refresh(), slice(30, 31))
+        fresh = HKEBinaryFile(fname)
+        self.assertEqual(f.datanum, fresh.datanum)
+        self.assertTrue(np.array_equal(f.data.data, fresh.data.data))
+        self.assertTrue(np.array_equal(f.get_times(), fresh.get_times()))
+        self.assertTrue(np.array_equal(f.get_data(-1), fresh.get_data(-1)))
+        self.assertTrue(np.array_equal(f.get_data(1, t_start=15000),
+                                       fresh.get_data(1, t_start=15000)))
+
+    def test_refresh(self):
+        self.check_refresh(mmap=False)
+
+    def test_refresh_mmap(self):
+        self.check_refresh(mmap=True)
+
+
+if __name__ == '__main__':
+    unittest.main()
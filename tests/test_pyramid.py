@@ -0,0 +1,111 @@
+import os
+import unittest
+
+import numpy as np
+
+from HKEBinaryFile import HKEBinaryFile
+from HKEPyramid import pyramid_path
+from tests.util import TempDirTestCase
+
+
+class TestPyramidPersistence(TempDirTestCase):
+    def open(self, path):
+        """
+        Open path, recording the (start, stop) of every read of the
+        frames that goes into a pyramid in f.reads.
+        """
+        f = HKEBinaryFile(path, cache=False)
+        f.reads = []
+        extract = f._extract
+
+        def _extract(field, **kwargs):
+            f.reads.append((kwargs.get('start'), kwargs.get('stop')))
+            return extract(field, **kwargs)
+        f._extract = _extract
+        return f
+
+    def assertSamePyramid(self, p, q):
+        self.assertEqual(p.datanum, q.datanum)
+        self.assertEqual(len(p.levels), len(q.levels))
+        for a, b in zip(p.levels, q.levels):
+            for x, y in zip(a, b):
+                self.assertTrue(np.allclose(x, y))
+
+    def built(self, path):
+        return HKEBinaryFile(path, cache=False).get_pyramid(1)
+
+    def saved(self, f):
+        field = f._get_field(1)
+        return os.path.exists(pyramid_path(f.filename,
+                                           '{0}|{1}'.format(*field[1:])))
+
+    def test_reload(self):
+        path = self.make_file(nframes=100)
+        f = self.open(path)
+        p = f.get_pyramid(1, persist=True)
+        self.assertEqual(p.datanum, 96)
+        self.assertEqual(f.reads, [(0, 96)])
+        self.assertTrue(self.saved(f))
+
+        g = self.open(path)
+        q = g.get_pyramid(1, persist=True)
+        self.assertEqual(g.reads, [])
+        self.assertSamePyramid(p, q)
+
+    def test_appended_frames(self):
+        path = self.make_file(nframes=100)
+        self.open(path).get_pyramid(1, persist=True)
+        self.append_frames(path, 100, 60)
+
+        f = self.open(path)
+        p = f.get_pyramid(1, persist=True)
+        self.assertEqual(f.reads, [(96, 160)])
+        self.assertSamePyramid(p, self.built(path))
+        g = self.open(path)
+        g.get_pyramid(1, persist=True)
+        self.assertEqual(g.reads, [])
+
+    def test_rewritten_file(self):
+        path = self.make_file(nframes=100)
+        self.open(path).get_pyramid(1, persist=True)
+        # same header and number of frames, different frames
+        self.write_counters(path, np.arange(100) + 1000,
+                            1000*np.arange(100))
+
+        f = self.open(path)
+        p = f.get_pyramid(1, persist=True)
+        self.assertEqual(f.reads, [(0, 96)])
+        self.assertSamePyramid(p, self.built(path))
+
+    def test_truncated_file(self):
+        path = self.make_file(nframes=100)
+        self.open(path).get_pyramid(1, persist=True)
+        self.make_file(nframes=50)
+
+        f = self.open(path)
+        p = f.get_pyramid(1, persist=True)
+        self.assertEqual(f.reads, [(0, 48)])
+        self.assertEqual(p.datanum, 48)
+
+    def test_changed_header(self):
+        path = self.make_file(nframes=100)
+        self.open(path).get_pyramid(1, persist=True)
+        self.make_file(nframes=100, nregisters=4)
+
+        f = self.open(path)
+        p = f.get_pyramid(1, persist=True)
+        self.assertEqual(f.reads, [(0, 96)])
+        self.assertSamePyramid(p, self.built(path))
+
+    def test_not_persisted(self):
+        path = self.make_file(nframes=100)
+        f = self.open(path)
+        f.get_pyramid(1)
+        self.assertFalse(self.saved(f))
+        g = self.open(path)
+        g.get_pyramid(1, persist=True)
+        self.assertEqual(g.reads, [(0, 96)])
+
+
+if __name__ == '__main__':
+    unittest.main()
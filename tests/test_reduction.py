@@ -0,0 +1,92 @@
+import unittest
+
+import numpy as np
+
+from HKEBinaryFile import HKEBinaryFile
+from HKEReduction import ReductionCache
+from tests.util import TempDirTestCase
+
+
+class TestReductionCache(unittest.TestCase):
+    def test_lru(self):
+        cache = ReductionCache(maxbytes=3*800)
+        for key in 'abc':
+            cache.put(key, np.zeros(100))
+        self.assertEqual((len(cache), cache.nbytes), (3, 2400))
+        cache.get('a')
+        cache.put('d', np.zeros(100))
+        self.assertTrue(cache.get('b') is None)
+        for key in 'acd':
+            self.assertTrue(cache.get(key) is not None, key)
+        self.assertEqual((len(cache), cache.nbytes), (3, 2400))
+
+    def test_maxbytes(self):
+        cache = ReductionCache(maxbytes=1000)
+        cache.put('big', np.zeros(126))
+        self.assertEqual((len(cache), cache.nbytes), (0, 0))
+        cache.put('a', np.zeros(50))
+        cache.put('b', np.zeros(50))
+        cache.put('c', np.zeros(100))
+        self.assertEqual(len(cache), 1)
+        self.assertTrue(cache.get('c') is not None)
+        cache.put('c', np.zeros(10))
+        self.assertEqual(cache.nbytes, 80)
+        cache.clear()
+        self.assertEqual((len(cache), cache.nbytes), (0, 0))
+
+    def test_disabled(self):
+        cache = ReductionCache(maxbytes=0)
+        a = np.zeros(1)
+        self.assertTrue(cache.put('a', a) is a)
+        self.assertEqual(len(cache), 0)
+        self.assertTrue(cache.get('a') is None)
+
+    def test_read_only(self):
+        cache = ReductionCache()
+        a = np.arange(10.)
+        stored = cache.put('a', a)
+        self.assertFalse(stored is a)
+        self.assertFalse(stored.flags.writeable)
+        a[0] = -1
+        b = cache.get('a')
+        self.assertTrue(b is stored)
+        self.assertEqual(b[0], 0)
+        self.assertRaises(ValueError, b.__setitem__, 1, -1)
+        self.assertTrue(cache.get('a') is stored)
+        self.assertEqual((cache.hits, cache.misses), (2, 0))
+        cache.get('b')
+        self.assertEqual((cache.hits, cache.misses), (2, 1))
+
+
+class TestGetDataCache(TempDirTestCase):
+    def test_repeated_request(self):
+        f = HKEBinaryFile(self.make_file(nframes=100), cache=False)
+        a = f.get_data(1, reductionfunction='max')
+        self.assertEqual((f.results.hits, len(f.results)), (0, 1))
+        b = f.get_data(1, reductionfunction='max')
+        self.assertEqual(f.results.hits, 1)
+        self.assertTrue(b is a)
+        self.assertFalse(a.flags.writeable)
+        self.assertRaises(ValueError, b.fill, 0)
+        f.get_data(1, reductionfunction='min')
+        f.get_data(1, reductionfunction='max', frames=slice(0, 50))
+        self.assertEqual(len(f.results), 3)
+
+    def test_appended_frames(self):
+        path = self.make_file(nframes=100)
+        f = HKEBinaryFile(path, cache=False)
+        self.assertEqual(len(f.get_data(1)), 100)
+        self.append_frames(path, 100, 20)
+        f.refresh()
+        self.assertEqual(len(f.get_data(1)), 120)
+
+    def test_disabled(self):
+        f = HKEBinaryFile(self.make_file(nframes=100), cache=False,
+                          cachebytes=0)
+        f.get_data(1)
+        f.get_data(1)
+        self.assertEqual((len(f.results), f.results.hits), (0, 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
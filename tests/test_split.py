@@ -0,0 +1,71 @@
+import os
+import unittest
+
+import numpy as np
+
+from HKEBinaryFile import HKEBinaryFile
+from HKEBinaryLibrary import HKEBinaryError
+from tests.util import TempDirTestCase
+
+
+class TestSplit(TempDirTestCase):
+    def setUp(self):
+        TempDirTestCase.setUp(self)
+        self.f = HKEBinaryFile(self.make_file(nframes=100), cache=False)
+
+    def frames(self, fname):
+        g = HKEBinaryFile(fname, cache=False)
+        self.assertEqual(g.header.rawheader, self.f.header.rawheader)
+        return g.data.data
+
+    def out(self, name='piece.dat'):
+        return os.path.join(self.tmpdir, name)
+
+    def test_split_file(self):
+        data = self.f.data.data
+        self.f.split_file(self.out(), start=10, end=40)
+        self.assertTrue(np.array_equal(self.frames(self.out()), data[10:40]))
+        self.f.split_file(self.out(), start=90)
+        self.assertTrue(np.array_equal(self.frames(self.out()), data[90:]))
+        self.f.split_file(self.out(), start=-5, end=-1)
+        self.assertTrue(np.array_equal(self.frames(self.out()), data[95:99]))
+        self.f.split_file(self.out(), start=50, end=20)
+        self.assertEqual(len(self.frames(self.out())), 0)
+
+    def test_split_file_time(self):
+        self.f.split_file(self.out(), t_start=10000, t_stop=20500)
+        self.assertTrue(np.array_equal(self.frames(self.out()),
+                                       self.f.data.data[10:21]))
+
+    def assertPieces(self, fnames, lengths):
+        pieces = [self.frames(fname) for fname in fnames]
+        self.assertEqual([len(p) for p in pieces], lengths)
+        self.assertTrue(np.array_equal(np.concatenate(pieces),
+                                       self.f.data.data))
+
+    def test_split_into(self):
+        pattern = self.out('piece_{0:02d}.dat')
+        fnames = self.f.split_into(pattern, pieces=3)
+        self.assertEqual(fnames, [pattern.format(i) for i in range(3)])
+        self.assertPieces(fnames, [33, 34, 33])
+        self.assertPieces(self.f.split_into(pattern, frames=30, workers=1),
+                          [30, 30, 30, 10])
+        self.assertPieces(self.f.split_into(pattern, duration=25000),
+                          [25, 25, 25, 25])
+        self.assertPieces(self.f.split_into(pattern, duration=40000),
+                          [40, 40, 20])
+
+    def test_split_into_default_pattern(self):
+        fnames = self.f.split_into(pieces=2)
+        base = os.path.splitext(self.f.filename)[0]
+        self.assertEqual(fnames, [base + '_000.dat', base + '_001.dat'])
+        self.assertPieces(fnames, [50, 50])
+
+    def test_split_into_arguments(self):
+        self.assertRaises(HKEBinaryError, self.f.split_into)
+        self.assertRaises(HKEBinaryError, self.f.split_into, pieces=2,
+                          frames=10)
+
+
+if __name__ == '__main__':
+    unittest.main()
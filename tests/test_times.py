@@ -0,0 +1,64 @@
+import os
+import unittest
+
+import numpy as np
+
+from HKEBinaryFile import HKEBinaryFile
+from tests.util import TempDirTestCase
+
+
+class TestTimeIndex(TempDirTestCase):
+    def open(self, framereceivedms):
+        path = os.path.join(self.tmpdir, 'hke_test.dat')
+        n = len(framereceivedms)
+        self.write_counters(path, np.arange(n), framereceivedms)
+        return HKEBinaryFile(path, cache=False)
+
+    def test_counts_up(self):
+        f = self.open(5000 + 1000*np.arange(100))
+        self.assertTrue(np.array_equal(f.get_times(), 1000*np.arange(100)))
+        self.assertEqual(len(f.timerestarts), 0)
+
+    def test_wraparound(self):
+        f = self.open(2**32 - 2500 + 1000*np.arange(100))
+        self.assertTrue(np.array_equal(f.get_times(), 1000*np.arange(100)))
+        self.assertEqual(len(f.timerestarts), 0)
+
+    def test_counts_down(self):
+        f = self.open(3500 - 1000*np.arange(100))
+        self.assertTrue(np.array_equal(f.get_times(), 1000*np.arange(100)))
+        self.assertEqual(f.frames_for_time(10000, 20000), (10, 20))
+
+    def test_restart(self):
+        received = 1000*np.arange(100) + 50000
+        received[60:] -= 70000
+        f = self.open(received)
+        times = f.get_times()
+        self.assertEqual(list(f.timerestarts), [60])
+        self.assertTrue(np.all(np.diff(times) == 1000))
+        self.assertEqual(f.frames_for_time(59500, None), (60, 100))
+
+    def test_frames_for_time(self):
+        f = self.open(1000*np.arange(100))
+        self.assertEqual(f.frames_for_time(), (0, 100))
+        self.assertEqual(f.frames_for_time(10000, 20000), (10, 20))
+        self.assertEqual(f.frames_for_time(10500, 20500), (11, 21))
+        self.assertEqual(f.frames_for_time(None, 5000), (0, 5))
+        self.assertEqual(f.frames_for_time(-1000, 1e9), (0, 100))
+        self.assertTrue(np.array_equal(f.get_data(1, t_start=10000,
+                                                  t_stop=20000),
+                                       f.get_data(1)[10:20]))
+
+    def test_appended_frames(self):
+        received = 2**32 - 30500 + 1000*np.arange(100)
+        f = self.open(received[:40])
+        self.assertEqual(len(f.get_times()), 40)
+        self.write_counters(f.filename, np.arange(40, 100), received[40:],
+                            append=True)
+        f.refresh()
+        self.assertTrue(np.array_equal(f.get_times(), 1000*np.arange(100)))
+        self.assertEqual(f.frames_for_time(90000, None), (90, 100))
+
+
+if __name__ == '__main__':
+    unittest.main()
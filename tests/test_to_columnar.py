@@ -0,0 +1,173 @@
+import os
+import json
+import zipfile
+import calendar
+import unittest
+from datetime import datetime
+
+import numpy as np
+
+import to_columnar
+from HKEBinaryFile import HKEBinaryFile
+from HKEBinaryLibrary import HKEBinaryError
+from tests.util import TempDirTestCase
+
+# the header timestamp of the synthetic files, in ms since the epoch
+t0 = calendar.timegm(datetime(2012, 6, 15, 12, 23, 18).timetuple())*1000 + \
+    615
+
+
+class ExportTestCase(TempDirTestCase):
+    def open(self, path):
+        return HKEBinaryFile(path, cache=False, columns=False)
+
+    def failing(self, path, after=1):
+        """
+        Open path, with the extraction of reduced data failing after
+        after calls.
+        """
+        f = self.open(path)
+        extract = f._extract
+        calls = []
+
+        def _extract(*args, **kwargs):
+            calls.append(None)
+            if len(calls) > after:
+                raise IOError("read error")
+            return extract(*args, **kwargs)
+        f._extract = _extract
+        return f
+
+
+class TestNPZExport(ExportTestCase):
+    def test_export(self):
+        f = self.open(self.make_file(nframes=50))
+        out = f.export(os.path.join(self.tmpdir, 'out.npz'), fmt='npz',
+                       chunksize=16)
+        rd = f.get_register_description(1)
+        with np.load(out) as npz:
+            self.assertTrue(np.array_equal(npz['framecount'],
+                                           np.arange(50)))
+            self.assertTrue(np.array_equal(npz['time'],
+                                           t0 + 1000*np.arange(50)))
+            self.assertTrue(np.array_equal(npz[rd.columnname + '/raw'],
+                                           f.data.data[rd.fullname]))
+            self.assertTrue(np.allclose(npz[rd.columnname + '/reduced'],
+                                        f.get_data(1)))
+            meta = json.loads(str(npz['__metadata__']))
+        self.assertEqual(meta['header']['registers'], f.list_registers())
+        with zipfile.ZipFile(out) as zf:
+            self.assertEqual(set(i.compress_type for i in zf.infolist()),
+                             set([zipfile.ZIP_DEFLATED]))
+
+    def test_compression(self):
+        f = self.open(self.make_file(nframes=10))
+        out = os.path.join(self.tmpdir, 'out.npz')
+        to_columnar.export(f, out, fmt='npz', compression='none')
+        with zipfile.ZipFile(out) as zf:
+            self.assertEqual(set(i.compress_type for i in zf.infolist()),
+                             set([zipfile.ZIP_STORED]))
+        os.remove(out)
+        self.assertRaises(HKEBinaryError, to_columnar.export, f, out,
+                          fmt='npz', compression='gzip')
+        self.assertFalse(os.path.exists(out))
+
+    def test_failed_export(self):
+        f = self.failing(self.make_file(nframes=50))
+        out = os.path.join(self.tmpdir, 'out.npz')
+        self.assertRaises(IOError, to_columnar.export, f, out, fmt='npz',
+                          chunksize=16)
+        self.assertFalse(os.path.exists(out))
+
+
+@unittest.skipIf(to_columnar.h5py is None, "requires h5py")
+class TestHDF5Export(ExportTestCase):
+    def test_append_second_file(self):
+        a = self.make_file('hke_a.dat', nframes=50)
+        b = self.make_file('hke_b.dat', nframes=30,
+                           timestamp='2012-06-15 12:24:08.615')
+        out = os.path.join(self.tmpdir, 'out.h5')
+        to_columnar.main(['-f', 'hdf5', '-o', out, a, b])
+
+        fa = self.open(a)
+        fb = self.open(b)
+        rd = fa.get_register_description(0)
+        with to_columnar.h5py.File(out, 'r') as h5:
+            raw = h5[rd.columnname + '/raw'][...]
+            self.assertEqual(len(raw), 80)
+            self.assertTrue(np.array_equal(
+                raw[:50], fa.data.data[rd.fullname]))
+            self.assertTrue(np.array_equal(
+                raw[50:], fb.data.data[rd.fullname]))
+            self.assertTrue(np.array_equal(h5['time'][...],
+                                           t0 + 1000*np.arange(80)))
+            self.assertEqual(json.loads(h5.attrs['sources']), [a, b])
+            self.assertEqual(json.loads(h5.attrs['source_offsets']),
+                             [0, 50])
+
+    def test_append_incompatible_file(self):
+        a = self.make_file('hke_a.dat', nframes=10)
+        b = self.make_file('hke_b.dat', nframes=10, nregisters=2)
+        out = os.path.join(self.tmpdir, 'out.h5')
+        to_columnar.export(a, out)
+        self.assertRaises(to_columnar.HKEIncompatibleFilesError,
+                          to_columnar.export, b, out, append=True)
+
+    def test_failed_export(self):
+        a = self.make_file('hke_a.dat', nframes=50)
+        out = os.path.join(self.tmpdir, 'out.h5')
+        self.assertRaises(IOError, to_columnar.export, self.failing(a),
+                          out, chunksize=16)
+        self.assertFalse(os.path.exists(out))
+
+    def test_failed_append(self):
+        a = self.make_file('hke_a.dat', nframes=50)
+        b = self.make_file('hke_b.dat', nframes=30)
+        out = os.path.join(self.tmpdir, 'out.h5')
+        to_columnar.export(a, out, chunksize=16)
+        self.assertRaises(IOError, to_columnar.export, self.failing(b),
+                          out, append=True, chunksize=16)
+        with to_columnar.h5py.File(out, 'r') as h5:
+            for path in ('framecount', 'time'):
+                self.assertEqual(len(h5[path]), 50)
+            self.assertEqual(json.loads(h5.attrs['sources']), [a])
+        to_columnar.export(b, out, append=True, chunksize=16)
+        with to_columnar.h5py.File(out, 'r') as h5:
+            self.assertEqual(len(h5['framecount']), 80)
+            self.assertEqual(json.loads(h5.attrs['source_offsets']),
+                             [0, 50])
+
+
+@unittest.skipIf(to_columnar.pa is None, "requires pyarrow")
+class TestParquetExport(ExportTestCase):
+    def test_append_second_file(self):
+        a = self.make_file('hke_a.dat', nframes=50)
+        b = self.make_file('hke_b.dat', nframes=30,
+                           timestamp='2012-06-15 12:24:08.615')
+        out = os.path.join(self.tmpdir, 'out.parquet')
+        to_columnar.export(a, out, fmt='parquet', chunksize=16)
+        to_columnar.export(b, out, fmt='parquet', append=True)
+        self.assertEqual(sorted(os.listdir(out)),
+                         ['part-00000.parquet', 'part-00001.parquet'])
+        times = []
+        for part in sorted(os.listdir(out)):
+            table = to_columnar.pq.read_table(os.path.join(out, part),
+                                              columns=['time'])
+            times.extend(table.column('time').to_pylist())
+        self.assertEqual(times, list(t0 + 1000*np.arange(80)))
+
+    def test_failed_export(self):
+        a = self.make_file('hke_a.dat', nframes=50)
+        b = self.make_file('hke_b.dat', nframes=50)
+        out = os.path.join(self.tmpdir, 'out.parquet')
+        self.assertRaises(IOError, to_columnar.export, self.failing(a),
+                          out, fmt='parquet', chunksize=16)
+        self.assertFalse(os.path.exists(out))
+        to_columnar.export(a, out, fmt='parquet')
+        self.assertRaises(IOError, to_columnar.export, self.failing(b),
+                          out, fmt='parquet', append=True, chunksize=16)
+        self.assertEqual(os.listdir(out), ['part-00000.parquet'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+import os
+import gzip
+import shutil
+import unittest
+
+import numpy as np
+
+import to_csv
+from HKEBinaryFile import HKEBinaryFile
+from tests.util import TempDirTestCase, testdir, sample
+
+# the CSV export of the sample file by the original, numpy.savetxt
+# based exporter
+baseline = os.path.join(testdir, 'data', 'hke_20120615_001.csv.gz')
+
+
+class TestCSVExport(TempDirTestCase):
+    def setUp(self):
+        TempDirTestCase.setUp(self)
+        with gzip.open(baseline, 'rb') as fobj:
+            self.expected = fobj.read()
+
+    def test_gzip(self):
+        out = os.path.join(self.tmpdir, 'out.csv.gz')
+        to_csv.hkebinary_to_csv(sample, out, chunksize=1000, workers=2,
+                                cache=False)
+        with gzip.open(out, 'rb') as fobj:
+            self.assertTrue(fobj.read() == self.expected)
+
+    def test_plain(self):
+        out = os.path.join(self.tmpdir, 'out.csv')
+        to_csv.hkebinary_to_csv(sample, out, codec='none', cache=False)
+        with open(out, 'rb') as fobj:
+            self.assertTrue(fobj.read() == self.expected)
+
+    def test_default_name(self):
+        fname = os.path.join(self.tmpdir, 'hke_20120615_001.dat')
+        shutil.copy(sample, fname)
+        to_csv.main([fname, '--no-cache'])
+        with gzip.open(os.path.join(self.tmpdir, 'hke_20120615_001.csv.gz'),
+                       'rb') as fobj:
+            self.assertTrue(fobj.read() == self.expected)
+        self.assertFalse(os.path.exists(os.environ['HKEBINARY_CACHE_DIR']))
+
+    def test_selection(self):
+        fname = self.make_file(nframes=100)
+        out = os.path.join(self.tmpdir, 'out.csv')
+        to_csv.hkebinary_to_csv(fname, out, registers=[1, -1],
+                                t_start=10000, t_stop=20000, codec='none',
+                                chunksize=3)
+        f = HKEBinaryFile(fname, cache=False)
+        with open(out) as fobj:
+            header = fobj.readline()
+        names = [f.get_register_name(1), f.get_register_name(-1)]
+        self.assertEqual(header, '# {0}_0,{1}_0\n'.format(*names))
+        expected = np.hstack([f.get_data(1)[10:20], f.get_data(-1)[10:20]])
+        self.assertTrue(np.array_equal(np.loadtxt(out, delimiter=','),
+                                       expected))
+
+
+if __name__ == '__main__':
+    unittest.main()
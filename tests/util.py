@@ -0,0 +1,91 @@
+"""
+util.py - Helpers shared by the tests.
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from benchmarks import synthetic
+
+testdir = os.path.dirname(os.path.abspath(__file__))
+topdir = os.path.dirname(testdir)
+# the sample file shipped with the source, and its calibration curve
+sample = os.path.join(topdir, 'hke_20120615_001.dat')
+samplecurve = os.path.join(topdir, 'U02728.txt')
+
+
+class TempDirTestCase(unittest.TestCase):
+    """
+    A TestCase with a fresh scratch directory, self.tmpdir, that also
+    holds the cache directory (HKEBINARY_CACHE_DIR) for the duration
+    of each test.
+    """
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='hketest')
+        self._cachedir = os.environ.get('HKEBINARY_CACHE_DIR')
+        os.environ['HKEBINARY_CACHE_DIR'] = os.path.join(self.tmpdir,
+                                                         'cache')
+
+    def tearDown(self):
+        if self._cachedir is None:
+            del os.environ['HKEBINARY_CACHE_DIR']
+        else:
+            os.environ['HKEBINARY_CACHE_DIR'] = self._cachedir
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def make_file(self, name='hke_test.dat', nframes=100, **layout):
+        """
+        Write a small synthetic HKE binary file (see
+        benchmarks.synthetic.make_file) to the scratch directory and
+        return its path.
+        """
+        layout.setdefault('nboards', 2)
+        layout.setdefault('nregisters', 3)
+        layout.setdefault('nsamples', [1, 4])
+        path = os.path.join(self.tmpdir, name)
+        synthetic.make_file(path, nframes=nframes, **layout)
+        return path
+
+    def frame_bytes(self, start, count):
+        """
+        Return count synthetic frames, numbered from start, in the
+        default layout of self.make_file, as bytes.
+        """
+        dt = synthetic.frame_dtype(self._boards())
+        return synthetic.make_frames(dt, start, count).tostring()
+
+    def append_frames(self, path, start, count):
+        """
+        Append count synthetic frames, numbered from start, to the
+        file path, which must have been made by self.make_file with
+        the default layout.
+        """
+        with open(path, 'ab') as f:
+            f.write(self.frame_bytes(start, count))
+
+    def write_counters(self, path, framecount, framereceivedms,
+                       append=False):
+        """
+        Write (or, if append, append) synthetic frames with the given
+        framecount and framereceivedms counters, taken modulo 2**32,
+        to the file path, in the default layout of self.make_file.
+        """
+        boards = self._boards()
+        frames = synthetic.make_frames(synthetic.frame_dtype(boards), 0,
+                                       len(framecount))
+        frames['framecount'] = np.asarray(framecount, dtype=np.int64) % 2**32
+        frames['framereceivedms'] = \
+            np.asarray(framereceivedms, dtype=np.int64) % 2**32
+        with open(path, 'ab' if append else 'wb') as f:
+            if not append:
+                f.write(synthetic.header_bytes(boards))
+            frames.tofile(f)
+        return path
+
+    def _boards(self):
+        return synthetic.make_boards(nboards=2, nregisters=3,
+                                     nsamples=[1, 4])
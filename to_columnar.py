@@ -0,0 +1,521 @@
+"""
+to_columnar.py - Export HKE binary files to columnar formats (HDF5,
+Parquet or NPZ).
+
+Every register is written as its own chunked, compressed column (or
+group of columns), so that a reader can load one register without
+touching the others:
+
+    framecount, framereceivedms, time    per-frame bookkeeping; time is
+                                         in ms since the epoch (see
+                                         start_time)
+    <address>-<name>/raw                 raw register data,
+                                         shape (nframes, nch, nsamples)
+    <address>-<name>/reduced             reduced (and, for registers
+                                         with flags 2, calibrated) data,
+                                         shape (nframes, nch); only for
+                                         registers that have reduced data
+
+The register metadata (full name, channel tags, units, calibration,
+...) and the file header metadata are stored alongside the columns.
+The frames are streamed from the (memory-mapped) file a chunk at a
+time, so memory use is bounded by the chunk size.
+
+HDF5 and Parquet outputs may be appended to as new files of the same
+run arrive. HDF5 needs h5py and Parquet needs pyarrow. A Parquet
+output is a directory holding one part file per exported HKE file.
+
+Example usage:
+    python to_columnar.py -f hdf5 -o run.h5 hke_20120615_*.dat
+    python to_columnar.py -f hdf5 -o run.h5 --append hke_20120616_001.dat
+
+    f = HKEBinaryFile('hke_20120615_001.dat')
+    f.export('hke_20120615_001.npz', fmt='npz')
+"""
+
+import sys
+import os
+import argparse
+import binascii
+import json
+import shutil
+import tempfile
+import zipfile
+import calendar
+from datetime import datetime
+
+import numpy as np
+
+from HKEBinaryFile import HKEBinaryFile as File
+from HKEBinaryLibrary import HKEBinaryError, HKEIncompatibleFilesError
+
+try:
+    import h5py
+except ImportError:
+    h5py = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+
+class Column(object):
+    """
+    A column to be exported: its path, per-frame shape and dtype, a
+    function extract(start, stop) returning its values for frames
+    start through stop, and a dictionary of metadata.
+    """
+    def __init__(self, path, shape, dtype, extract, attrs=None):
+        self.path = path
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.extract = extract
+        self.attrs = attrs or {}
+
+    def values(self, start, stop):
+        """
+        Returns the values of the column for frames start through
+        stop, as an array of the column's dtype.
+        """
+        return np.asarray(self.extract(start, stop), dtype=self.dtype)
+
+
+def register_metadata(rd):
+    """
+    Returns a dictionary of the metadata of the register described by
+    the RegisterDescription rd.
+    """
+    return {'fullname': rd.fullname,
+            'name': rd.name,
+            'columnname': rd.columnname,
+            'board': rd.boardname,
+            'address': rd.address,
+            'boardtype': rd.boardtype,
+            'registertype': rd.registertypename,
+            'nch': rd.nch,
+            'nsamples': rd.nsamples,
+            'chtags': list(rd.chtags),
+            'flags': rd.flags,
+            'units': rd.units,
+            'linslope': rd.linslope,
+            'linoffset': rd.linoffset}
+
+
+def header_metadata(f):
+    """
+    Returns a dictionary of the header metadata of the HKEBinaryFile
+    f.
+    """
+    return {'timestamp': f.header.timestamp,
+            'version': f.header.version,
+            'rawheader': binascii.hexlify(f.header.rawheader).decode('ascii'),
+            'registers': f.list_registers()}
+
+
+_timeformats = ('%Y-%m-%d %H:%M:%S.%f', '%Y-%m-%d %H:%M:%S')
+
+
+def start_time(f):
+    """
+    Returns the time of the first frame of the HKEBinaryFile f, in
+    milliseconds since the epoch, taken from the timestamp in its
+    header (with no time zone conversion). Exported times are given
+    from it, so that they continue across the files of a run that are
+    appended to one output.
+    """
+    for fmt in _timeformats:
+        try:
+            t = datetime.strptime(f.header.timestamp, fmt)
+            break
+        except ValueError:
+            pass
+    else:
+        raise HKEBinaryError("Invalid header timestamp: "
+                             "{0}".format(f.header.timestamp))
+    return calendar.timegm(t.timetuple())*1000 + t.microsecond//1000
+
+
+def file_columns(f):
+    """
+    Returns the list of Columns to export from the HKEBinaryFile f.
+    """
+    records = f.data.data
+    t0 = start_time(f)
+    columns = [Column('framecount', (), 'u4',
+                      lambda s, e: records['framecount'][s:e]),
+               Column('framereceivedms', (), 'u4',
+                      lambda s, e: records['framereceivedms'][s:e]),
+               Column('time', (), 'i8',
+                      lambda s, e: f.get_times()[s:e] + t0,
+                      {'units': 'ms since the epoch'})]
+
+    def raw(rname):
+        return lambda s, e: records[rname][s:e]
+
+    def reduced(field):
+        return lambda s, e: f._extract(field, start=s, stop=e)
+
+    for i, rd in enumerate(f.registerdescriptionlist):
+        base = rd.columnname.replace('/', '_')
+        attrs = register_metadata(rd)
+        rawdt = f.data.dt[rd.fullname].base
+        columns.append(Column(base + '/raw', (rd.nch, rd.nsamples), rawdt,
+                              raw(rd.fullname), attrs))
+        if rd.flags != 0:
+            field = f._get_field(i, reduced=True)
+            columns.append(Column(base + '/reduced', (rd.nch,), 'f8',
+                                  reduced(field), attrs))
+    return columns
+
+
+def export(f, outname=None, fmt='hdf5', append=False, chunksize=65536,
+           t_start=None, t_stop=None, compression=None, cache=True):
+    """
+    Export the HKE binary file f (a filename or an HKEBinaryFile) to
+    outname in a columnar format.
+
+    Arguments:
+        f - (str or HKEBinaryFile) file to export
+        outname - (str) output file (a directory for Parquet).
+            Defaults to the name of f with the extension replaced by
+            '.h5', '.parquet' or '.npz'.
+        fmt - (str) 'hdf5', 'parquet' or 'npz'.
+        append - (bool) append the frames to an existing HDF5 file or
+            Parquet directory made from compatible files.
+        chunksize - (int) frames per chunk (HDF5 chunk, Parquet row
+            group) and per streaming step.
+        t_start, t_stop - time range to export, in milliseconds since
+            the first frame (see HKEBinaryFile.frames_for_time).
+        compression - compression to use. Defaults to 'gzip' for HDF5,
+            'zstd' for Parquet and 'deflate' for NPZ, whose members may
+            otherwise only be stored uncompressed ('none').
+        cache - passed on to HKEBinaryFile if f is a filename.
+
+    Returns outname. If the export fails, the partial output is
+    removed (or, when appending, the frames added are removed again)
+    before the error is raised.
+    """
+    if not isinstance(f, File):
+        f = File(f, mmap=True, cache=cache)
+    try:
+        writerclass, extension = _writers[fmt]
+    except KeyError:
+        raise HKEBinaryError("Invalid export format: {0}".format(fmt))
+    if outname is None:
+        outname = os.path.splitext(f.filename)[0] + extension
+
+    start, stop = f.frames_for_time(t_start, t_stop)
+    columns = file_columns(f)
+    metadata = header_metadata(f)
+    writer = writerclass(outname, columns, metadata, f.filename,
+                         stop - start, append=append, chunksize=chunksize,
+                         compression=compression)
+    try:
+        for cstart in range(start, stop, chunksize):
+            cstop = min(cstart + chunksize, stop)
+            writer.write([(col, col.values(cstart, cstop))
+                          for col in columns])
+    except BaseException:
+        writer.abort()
+        raise
+    writer.close()
+    return outname
+
+
+def _jsonattrs(attrs):
+    return json.dumps(attrs, sort_keys=True)
+
+
+class HDF5Writer(object):
+    """
+    Writes columns to datasets of an HDF5 file, with the frame axis
+    chunked and resizable. Metadata are stored in attributes: the
+    register metadata as a JSON string in the 'metadata' attribute of
+    each dataset, and the header metadata and the list of exported
+    files in attributes of the root group.
+    """
+    def __init__(self, outname, columns, metadata, source, nframes,
+                 append=False, chunksize=65536, compression=None):
+        if h5py is None:
+            raise HKEBinaryError("Exporting to HDF5 requires h5py.")
+        if compression is None:
+            compression = 'gzip'
+        self.outname = outname
+        self.created = not (append and os.path.exists(outname))
+        self.h5 = h5py.File(outname, 'a' if append else 'w')
+        root = self.h5.attrs
+        if 'rawheader' in root:
+            if json.loads(root['registers']) != metadata['registers']:
+                self.h5.close()
+                raise HKEIncompatibleFilesError(source, outname)
+        else:
+            root['timestamp'] = metadata['timestamp']
+            root['version'] = metadata['version']
+            root['rawheader'] = metadata['rawheader']
+            root['registers'] = json.dumps(metadata['registers'])
+            root['sources'] = json.dumps([])
+            root['source_offsets'] = json.dumps([])
+
+        nexisting = 0
+        for col in columns:
+            if col.path in self.h5:
+                ds = self.h5[col.path]
+                if (ds.shape[1:] != col.shape) or (ds.dtype != col.dtype):
+                    self.h5.close()
+                    raise HKEIncompatibleFilesError(source, outname)
+                nexisting = ds.shape[0]
+            else:
+                rowbytes = col.dtype.itemsize*int(np.prod(col.shape))
+                rows = max(1, min(chunksize, 2**20//max(rowbytes, 1)))
+                ds = self.h5.create_dataset(
+                    col.path, shape=(0,) + col.shape,
+                    maxshape=(None,) + col.shape, dtype=col.dtype,
+                    chunks=(rows,) + col.shape, compression=compression,
+                    shuffle=True)
+                if col.attrs:
+                    ds.attrs['metadata'] = _jsonattrs(col.attrs)
+
+        self.paths = [col.path for col in columns]
+        self.nexisting = nexisting
+        self.sources = (root['sources'], root['source_offsets'])
+        sources = json.loads(root['sources'])
+        offsets = json.loads(root['source_offsets'])
+        root['sources'] = json.dumps(sources + [source])
+        root['source_offsets'] = json.dumps(offsets + [nexisting])
+
+    def write(self, block):
+        for col, a in block:
+            ds = self.h5[col.path]
+            n = ds.shape[0]
+            ds.resize(n + len(a), axis=0)
+            ds[n:] = a
+
+    def close(self):
+        self.h5.close()
+
+    def abort(self):
+        """
+        Undo the export: remove the output if it was created by this
+        writer, otherwise truncate the datasets to the frames they
+        held before and drop the source from the list of exported
+        files.
+        """
+        try:
+            if not self.created:
+                for path in self.paths:
+                    self.h5[path].resize(self.nexisting, axis=0)
+                root = self.h5.attrs
+                root['sources'], root['source_offsets'] = self.sources
+        finally:
+            self.h5.close()
+            if self.created:
+                os.remove(self.outname)
+
+
+class ParquetWriter(object):
+    """
+    Writes columns to a Parquet part file in the outname directory,
+    one row group per chunk. Multi-channel columns are split into one
+    Parquet column per channel, named '<path>[<channel>]', and raw
+    registers with nsamples > 1 are stored as list columns. The
+    metadata are stored as JSON in the 'hkebinary' key of the schema
+    metadata.
+    """
+    def __init__(self, outname, columns, metadata, source, nframes,
+                 append=False, chunksize=65536, compression=None):
+        if pa is None:
+            raise HKEBinaryError("Exporting to Parquet requires pyarrow.")
+        if compression is None:
+            compression = 'zstd'
+        if os.path.isdir(outname) and (not append):
+            shutil.rmtree(outname)
+        if not os.path.isdir(outname):
+            os.makedirs(outname)
+        parts = sorted(p for p in os.listdir(outname)
+                       if p.endswith('.parquet'))
+
+        layout = [[col.path, col.dtype.str, list(col.shape)]
+                  for col in columns]
+        meta = {'header': metadata, 'source': source, 'layout': layout,
+                'columns': dict((col.path, col.attrs) for col in columns)}
+        fields = []
+        for col in columns:
+            for name, shape in self._split(col):
+                t = pa.from_numpy_dtype(col.dtype)
+                if len(shape) and (shape[-1] > 1):
+                    t = pa.list_(t)
+                fields.append(pa.field(name, t))
+        self.schema = pa.schema(fields).with_metadata(
+            {'hkebinary': json.dumps(meta)})
+
+        if parts:
+            old = pq.read_schema(os.path.join(outname, parts[0]))
+            old = json.loads(old.metadata[b'hkebinary'].decode('utf-8'))
+            if old['layout'] != layout:
+                raise HKEIncompatibleFilesError(source, outname)
+        partname = os.path.join(outname,
+                                'part-{0:05d}.parquet'.format(len(parts)))
+        self.outname = outname
+        self.partname = partname
+        self.created = not parts
+        self.chunksize = chunksize
+        self.writer = pq.ParquetWriter(partname, self.schema,
+                                       compression=compression)
+
+    def _split(self, col):
+        """
+        Returns (name, shape) for each Parquet column that col is
+        split into.
+        """
+        if len(col.shape) == 0:
+            return [(col.path, ())]
+        nch = col.shape[0]
+        shape = col.shape[1:]
+        if nch == 1:
+            return [(col.path, shape)]
+        return [('{0}[{1}]'.format(col.path, i), shape)
+                for i in range(nch)]
+
+    def write(self, block):
+        arrays = []
+        for col, a in block:
+            a = a.reshape((len(a),) + col.shape)
+            for i, (name, shape) in enumerate(self._split(col)):
+                values = a if (len(col.shape) == 0) else a[:, i]
+                values = np.ascontiguousarray(values)
+                if (len(shape) == 0) or (shape[-1] == 1):
+                    arrays.append(pa.array(values.reshape(len(a))))
+                else:
+                    offsets = np.arange(len(a) + 1,
+                                        dtype=np.int32)*shape[-1]
+                    arrays.append(pa.ListArray.from_arrays(
+                        pa.array(offsets), pa.array(values.ravel())))
+        table = pa.Table.from_arrays(arrays, schema=self.schema)
+        self.writer.write_table(table, row_group_size=self.chunksize)
+
+    def close(self):
+        self.writer.close()
+
+    def abort(self):
+        """
+        Undo the export: remove the part file being written, and the
+        output directory if it holds no other parts.
+        """
+        try:
+            self.writer.close()
+        finally:
+            os.remove(self.partname)
+            if self.created:
+                shutil.rmtree(self.outname, ignore_errors=True)
+
+
+class NPZWriter(object):
+    """
+    Writes columns to an NPZ archive, one .npy member per column,
+    deflated (as by numpy.savez_compressed) unless compression is
+    'none' (as by numpy.savez). Each column is first filled a chunk
+    at a time in a temporary memory-mapped .npy file, and the archive
+    is only written by self.close. The metadata are stored as a JSON
+    string in the '__metadata__' member. NPZ archives cannot be
+    appended to.
+    """
+    compressions = {'deflate': zipfile.ZIP_DEFLATED,
+                    'none': zipfile.ZIP_STORED}
+
+    def __init__(self, outname, columns, metadata, source, nframes,
+                 append=False, chunksize=65536, compression=None):
+        if append:
+            raise HKEBinaryError("NPZ archives cannot be appended to.")
+        if compression is None:
+            compression = 'deflate'
+        try:
+            self.compression = self.compressions[compression]
+        except KeyError:
+            raise HKEBinaryError("Invalid NPZ compression: {0} (use one "
+                                 "of {1})".format(compression,
+                                                  sorted(self.compressions)))
+        self.outname = outname
+        self.metadata = {'header': metadata, 'source': source,
+                         'columns': dict((col.path, col.attrs)
+                                         for col in columns)}
+        self.tmpdir = tempfile.mkdtemp()
+        self.arrays = []
+        for i, col in enumerate(columns):
+            tmpname = os.path.join(self.tmpdir, '{0}.npy'.format(i))
+            a = np.lib.format.open_memmap(tmpname, mode='w+',
+                                          dtype=col.dtype,
+                                          shape=(nframes,) + col.shape)
+            self.arrays.append((col.path, tmpname, a))
+        self.pos = 0
+
+    def write(self, block):
+        n = 0
+        for (path, tmpname, a), (col, values) in zip(self.arrays, block):
+            n = len(values)
+            a[self.pos:self.pos + n] = values
+        self.pos += n
+
+    def close(self):
+        try:
+            with zipfile.ZipFile(self.outname, 'w', self.compression,
+                                 allowZip64=True) as zf:
+                for path, tmpname, a in self.arrays:
+                    a.flush()
+                    zf.write(tmpname, path + '.npy')
+                metaname = os.path.join(self.tmpdir, '__metadata__.npy')
+                np.save(metaname, np.array(json.dumps(self.metadata)))
+                zf.write(metaname, '__metadata__.npy')
+        except BaseException:
+            if os.path.exists(self.outname):
+                os.remove(self.outname)
+            raise
+        finally:
+            self.arrays = []
+            shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def abort(self):
+        """
+        Undo the export: discard the columns without writing the
+        archive.
+        """
+        self.arrays = []
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+
+# format: (writer class, default extension)
+_writers = {'hdf5': (HDF5Writer, '.h5'),
+            'parquet': (ParquetWriter, '.parquet'),
+            'npz': (NPZWriter, '.npz')}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Export HKE binary files to a columnar format.")
+    parser.add_argument('fnames', nargs='+', help="HKE binary files")
+    parser.add_argument('-f', '--format', choices=sorted(_writers),
+                        default='hdf5', help="output format")
+    parser.add_argument('-o', '--output', default=None,
+                        help="output file. If given, all files are "
+                             "exported to it, in order; otherwise each "
+                             "file is exported separately.")
+    parser.add_argument('--append', action='store_true',
+                        help="append to an existing output")
+    parser.add_argument('--chunksize', type=int, default=65536,
+                        help="frames per chunk (default: 65536)")
+    parser.add_argument('--no-cache', action='store_false', dest='cache',
+                        help="do not use the on-disk header cache")
+    args = parser.parse_args(argv)
+
+    append = args.append
+    for fname in args.fnames:
+        export(fname, args.output, fmt=args.format, append=append,
+               chunksize=args.chunksize, cache=args.cache)
+        if args.output is not None:
+            append = True
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
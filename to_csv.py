@@ -1,36 +1,180 @@
+"""
+to_csv.py - Export HKE binary files to (compressed) CSV.
+
+The data are streamed from the file a chunk of frames at a time: each
+chunk is formatted as a block of CSV rows with a single string
+formatting operation and compressed on a pool of threads as an
+independent gzip (or bz2) member, so memory use is bounded by the
+chunk size and compression uses every core. The concatenated members
+form a valid compressed file.
+
+Example usage:
+    python to_csv.py hke_20120615_001.dat
+    python to_csv.py -r 0 -r -6 --t-start 60000 --t-stop 120000 \
+        hke_20120615_001.dat
+"""
+
 import sys
 import os
+import argparse
+import bz2
+import zlib
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
 
 import numpy as np
 
 from HKEBinaryFile import HKEBinaryFile as File
 
-def hkebinary_to_csv(fname):
-    f = File(fname)
 
-    reglist = f.list_registers()
+def _gzip_member(data, level=6):
+    c = zlib.compressobj(level, zlib.DEFLATED, 31)
+    return c.compress(data) + c.flush()
+
+
+def _bz2_stream(data, level=9):
+    return bz2.compress(data, level)
+
+
+def _identity(data):
+    return data
+
+
+# codec name: (file extension, function compressing one chunk)
+codecs = {'gzip': ('.gz', _gzip_member),
+          'bz2': ('.bz2', _bz2_stream),
+          'none': ('', _identity)}
+
+
+def format_block(block, fmt='%.18e', delimiter=','):
+    """
+    Format a 2D array as CSV rows in a single string formatting
+    operation, and return the result as bytes.
+    """
+    nrows, ncols = block.shape
+    rowfmt = delimiter.join([fmt]*ncols) + '\n'
+    text = (rowfmt*nrows) % tuple(block.ravel().tolist())
+    if not isinstance(text, bytes):
+        text = text.encode('ascii')
+    return text
+
+
+def hkebinary_to_csv(fname, newfname=None, registers=None, t_start=None,
+                     t_stop=None, codec='gzip', chunksize=4096,
+                     workers=None, fmt='%.18e', cache=True):
+    """
+    Export the registers of the HKE binary file fname to a CSV file.
+
+    Each selected register contributes one column per channel, named
+    '<register>_<channel>', containing its reduced data (see
+    HKEBinaryFile.get_data). The column names are written on a
+    leading '# ' comment line, as numpy.savetxt would.
+
+    Arguments:
+        fname - (str) HKE binary file to export
+        newfname - (str) output file. Defaults to fname with its
+            extension replaced by '.csv' plus the codec extension.
+        registers - list of register identifiers to export (see
+            HKEBinaryFile.get_data). Defaults to all registers.
+        t_start, t_stop - time range to export, in milliseconds since
+            the first frame (see HKEBinaryFile.frames_for_time).
+        codec - (str) 'gzip' (default), 'bz2' or 'none'.
+        chunksize - (int) number of frames formatted and compressed
+            at a time.
+        workers - (int) number of compression threads. Defaults to
+            the number of CPUs.
+        fmt - (str) format of each value.
+        cache - passed on to HKEBinaryFile. False keeps the header of
+            fname out of the on-disk header cache.
+
+    Returns the name of the output file.
+    """
+    extension, compress = codecs[codec]
+    if workers is None:
+        workers = cpu_count()
+
+    f = File(fname, mmap=True, cache=cache)
+    if registers is None:
+        registers = f.list_registers()
+    names = [f.get_register_name(reg) for reg in registers]
 
     header = []
-    alldata = None
-    for reg in reglist:
-        data = f.get_data(reg)
-        ncols = data.shape[1]
-        colnames = ['{0}_{1}'.format(reg, i) for i in range(ncols)]
-        header.extend(colnames)
-        try:
-            alldata = np.hstack([alldata, data])
-        except ValueError:
-            alldata = data
+    for name in names:
+        ncols = f.get_register_description(name).nch
+        header.extend(['{0}_{1}'.format(name, i) for i in range(ncols)])
+    header = '# ' + ','.join(header) + '\n'
 
-    header = ','.join(header)
+    if newfname is None:
+        base = os.path.splitext(fname)[0]
+        newfname = base + '.csv' + extension
 
-    base, ext = os.path.splitext(fname)
-    newfname = base + '.csv.gz'
-    np.savetxt(newfname, alldata, delimiter=',', header=header)
+    start, stop = f.frames_for_time(t_start, t_stop)
+    chunks = f.iter_chunks(chunksize, registers=names, start=start,
+                           stop=stop)
 
+    pool = ThreadPool(max(workers, 1))
+    pending = []
+    try:
+        with open(newfname, 'wb') as out:
+            pending.append(pool.apply_async(compress,
+                                            (header.encode('ascii'),)))
+            for chunk in chunks:
+                block = np.hstack(chunk)
+                text = format_block(block, fmt=fmt)
+                pending.append(pool.apply_async(compress, (text,)))
+                # Keep a bounded number of chunks in flight.
+                while len(pending) > 2*workers:
+                    out.write(pending.pop(0).get())
+            for result in pending:
+                out.write(result.get())
+    finally:
+        pool.close()
+        pool.join()
 
-if __name__ == "__main__":
-    fname = sys.argv[1]
-    hkebinary_to_csv(fname)
+    return newfname
 
 
+def _register(arg):
+    """
+    Interpret a command line register argument as an index if
+    possible, otherwise as a register name.
+    """
+    try:
+        return int(arg)
+    except ValueError:
+        return arg
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Export an HKE binary file to compressed CSV.")
+    parser.add_argument('fname', help="HKE binary file")
+    parser.add_argument('-o', '--output', default=None,
+                        help="output file (default: <fname>.csv.gz)")
+    parser.add_argument('-r', '--register', action='append',
+                        type=_register, dest='registers',
+                        help="register index or name to export; may be "
+                             "repeated (default: all registers)")
+    parser.add_argument('--t-start', type=float, default=None,
+                        help="start time, ms since the first frame")
+    parser.add_argument('--t-stop', type=float, default=None,
+                        help="stop time, ms since the first frame")
+    parser.add_argument('--codec', choices=sorted(codecs), default='gzip',
+                        help="compression codec (default: gzip)")
+    parser.add_argument('-j', '--workers', type=int, default=None,
+                        help="compression threads (default: # of CPUs)")
+    parser.add_argument('--chunksize', type=int, default=4096,
+                        help="frames per chunk (default: 4096)")
+    parser.add_argument('--no-cache', action='store_false', dest='cache',
+                        help="do not use the on-disk header cache")
+    args = parser.parse_args(argv)
+
+    hkebinary_to_csv(args.fname, newfname=args.output,
+                     registers=args.registers, t_start=args.t_start,
+                     t_stop=args.t_stop, codec=args.codec,
+                     chunksize=args.chunksize, workers=args.workers,
+                     cache=args.cache)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])